@@ -1,8 +1,38 @@
 import cv2
 import os
 import json
-import numpy as np
-from multiprocessing import Pool, Manager
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from multiprocessing import Manager
+import image_io
+from image_cache import ImageCache
+from image_pipeline import ImagePipeline
+from enhancement import EnhancementGraph, DEFAULT_GRAPH
+from quality_gate import QualityGate
+from instrumentation import Instrumentation, ImageTimer
+
+# 修改增强算子的实现时提升版本号，使旧缓存失效
+ENHANCE_VERSION = 2
+
+ENHANCE_BACKENDS = ("single", "threads", "processes")
+# 自动选择执行方式时用于测速的图像块边长上限
+CALIBRATION_SIZE = 1024
+
+# 进程池中每个工作进程持有的增强图，由 init_enhance_worker 创建后在该进程处理的所有图像间复用
+_worker_graph = None
+
+
+def init_enhance_worker(enhancement, tile_size, tile_overlap):
+    global _worker_graph
+    # 每个进程只用一个 OpenCV 线程，进程数即并行度
+    cv2.setNumThreads(1)
+    _worker_graph = EnhancementGraph(enhancement, tile_size, tile_overlap)
+
+
+def enhance_in_worker(image):
+    return _worker_graph.apply(image)
 
 
 class ImageProcessor:
@@ -10,62 +40,339 @@ class ImageProcessor:
         self.input_folder = config["input_folder"]
         self.output_folder = config["output_folder"]
         self.progress_queue = progress_queue
+        self.enhancement = config.get("enhancement") or DEFAULT_GRAPH
+        # 每个增强线程持有自己的增强图，复用卷积核、CLAHE 对象和中间缓冲区
+        self.local = threading.local()
+        # 大图处理：超过 max_megapixels 时先缩小再增强；tile_size 大于 0 时局部操作分块执行
+        self.max_megapixels = config.get("max_megapixels", 0)
+        self.tile_size = config.get("tile_size", 0)
+        self.tile_overlap = config.get("tile_overlap")
+        # 读写方式：输出格式、JPEG 质量、缩小解码和 EXIF 保留
+        self.io = dict(image_io.IMAGE_IO_DEFAULTS, **config.get("image_io", {}))
+        if self.io["output_format"] != "source" and self.io["output_format"] not in image_io.OUTPUT_EXTENSIONS:
+            raise ValueError(f"Unknown output format: {self.io['output_format']}")
+
+        self.cache = None
+        if config.get("cache_enabled", True):
+            cache_folder = config.get("cache_folder") or os.path.join(
+                os.path.dirname(os.path.abspath(self.output_folder)), "cache")
+            self.cache = ImageCache(cache_folder, config.get("cache_max_bytes", 2 * 1024 ** 3))
+
+        # 运行报告目录，默认与输出文件夹同级，避免报告文件混入 COLMAP 的图像目录
+        self.report_folder = config.get("report_folder") or os.path.join(
+            os.path.dirname(os.path.abspath(self.output_folder)), "reports")
+
+        # 质量门：剔除模糊和近似重复的图像，减少后续匹配的图像对数量
+        self.quality_gate = None
+        gate_config = config.get("quality_gate", {})
+        if gate_config.get("enabled", False):
+            self.quality_gate = QualityGate(gate_config.get("blur_threshold", 30.0),
+                                            gate_config.get("max_hash_distance", 4))
+
+        # 性能记录：每张图像各阶段耗时与整体资源占用，写入 report_folder
+        self.instrumentation_config = config.get("instrumentation", {})
+        self.instrumentation = None
+        self.image_timer = None
+
+        # 流水线参数：增强线程数、编码线程数、同时在处理中的图像上限（控制峰值内存）
+        self.enhance_workers = config.get("enhance_workers") or os.cpu_count() or 1
+        self.encode_workers = config.get("encode_workers", 2)
+        self.max_in_flight = config.get("max_in_flight_images") or 2 * self.enhance_workers
+        self.queue_size = config.get("pipeline_queue_size", 2)
+        # 增强的执行方式：threads 为多线程、每线程一个 OpenCV 线程；single 为单线程、由 OpenCV 内部并行；
+        # processes 为进程池；auto 在第一次运行时对三种方式测速后选择，结果保存在报告目录
+        self.enhance_backend = config.get("enhance_backend", "threads")
+        self.pipeline_workers = self.enhance_workers
+        self.process_pool = None
+        # 界面取消任务时设置，已开始的图像处理完后不再取新图像
+        self.cancel_event = threading.Event()
+
+    def enhance_fingerprint(self):
+        return ImageCache.fingerprint({
+            "version": ENHANCE_VERSION,
+            "graph": self.enhancement,
+            "max_megapixels": self.max_megapixels,
+            "tile_size": self.tile_size,
+            "tile_overlap": self.tile_overlap,
+            "io": self.io,
+        })
 
-    def process_images(self):
-        filenames = [f for f in os.listdir(self.input_folder) if f.lower().endswith((".jpg", ".png"))]
+    def process_images(self, on_ready=None):
+        if self.instrumentation_config.get("enabled", True):
+            self.instrumentation = Instrumentation(self.report_folder, "image_processing",
+                                                   self.instrumentation_config.get("sample_interval", 0.5),
+                                                   self.instrumentation_config.get("prometheus_path"))
+            self.image_timer = ImageTimer(self.instrumentation)
+            try:
+                with self.instrumentation.stage("Image Processing", kind="python"):
+                    self.run_image_processing(on_ready)
+            finally:
+                report_path = self.instrumentation.write_report()
+                if self.progress_queue:
+                    self.progress_queue.put(f"Run report written to {report_path}")
+        else:
+            self.run_image_processing(on_ready)
+
+    def run_image_processing(self, on_ready=None):
+        # on_ready(name) 在每张图像写入输出文件夹后立即调用，name 为输出文件名，供后续阶段边处理边消费
+        filenames = image_io.list_images(self.input_folder)
         if self.progress_queue:
             self.progress_queue.put(f"Found {len(filenames)} images to process.")
-        with Pool() as pool:
-            pool.map(self.process_image, filenames)
-        if self.progress_queue:
+            self.progress_queue.put(f"Enhancement plan: {self.enhancement_graph().describe()}")
+        os.makedirs(self.output_folder, exist_ok=True)
+
+        if self.quality_gate:
+            filenames = self.apply_quality_gate(filenames)
+
+        # 内容未变化的图像直接从缓存硬链接，只处理未命中的图像
+        pending = []
+        cache_keys = {}
+        if self.cache:
+            fingerprint = self.enhance_fingerprint()
+            for filename in filenames:
+                key = self.cache.make_key(os.path.join(self.input_folder, filename), fingerprint)
+                if not self.cache.restore(key, os.path.join(self.output_folder, self.output_name(filename))):
+                    cache_keys[filename] = key
+                    pending.append(filename)
+                elif on_ready:
+                    on_ready(self.output_name(filename))
+        else:
+            pending = filenames
+
+        with self.execution_backend(pending):
+            for filename, output_path in self.iter_process_images(pending):
+                if self.cancel_event.is_set():
+                    if self.progress_queue:
+                        self.progress_queue.put("Image processing cancelled.")
+                    break
+                if self.cache and output_path:
+                    self.cache.store(cache_keys[filename], output_path)
+                if on_ready and output_path:
+                    on_ready(os.path.basename(output_path))
+
+        if self.cache:
+            self.cache.evict()
+            self.cache.save_index()
+            if self.progress_queue:
+                self.progress_queue.put(f"Cache hits: {self.cache.hits}, misses: {self.cache.misses}")
+        if self.progress_queue and not self.cancel_event.is_set():
             self.progress_queue.put("Image processing completed.")
 
+    def cancel(self):
+        self.cancel_event.set()
+
+    @contextmanager
+    def execution_backend(self, filenames):
+        backend = self.enhance_backend
+        if backend == "auto":
+            backend = self.choose_backend(filenames)
+        if backend not in ENHANCE_BACKENDS:
+            raise ValueError(f"Unknown enhancement backend: {backend}")
+        previous_threads = cv2.getNumThreads()
+        self.start_backend(backend)
+        if self.progress_queue:
+            self.progress_queue.put(f"Enhancement backend: {backend} ({self.pipeline_workers} workers, "
+                                    f"{cv2.getNumThreads()} OpenCV threads)")
+        try:
+            yield backend
+        finally:
+            self.stop_backend()
+            cv2.setNumThreads(previous_threads)
+
+    def start_backend(self, backend):
+        # 流水线的增强线程数与 OpenCV 线程数之积不超过核心数，避免两层并行互相争抢
+        cores = os.cpu_count() or 1
+        if backend == "single":
+            self.pipeline_workers = 1
+            cv2.setNumThreads(cores)
+        elif backend == "threads":
+            self.pipeline_workers = self.enhance_workers
+            cv2.setNumThreads(max(1, cores // self.enhance_workers))
+        else:
+            # 增强线程只把图像交给进程池并等待结果，解码和编码仍在本进程
+            self.pipeline_workers = self.enhance_workers
+            cv2.setNumThreads(1)
+            self.process_pool = ProcessPoolExecutor(self.enhance_workers, initializer=init_enhance_worker,
+                                                    initargs=(self.enhancement, self.tile_size, self.tile_overlap))
+
+    def stop_backend(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+        self.pipeline_workers = self.enhance_workers
+
+    def choose_backend(self, filenames):
+        # 测速结果与增强参数和核心数有关，两者不变时直接复用上次的选择
+        calibration_path = os.path.join(self.report_folder, "enhance_backend.json")
+        key = f"{self.enhance_fingerprint()}:{os.cpu_count()}:{self.enhance_workers}"
+        try:
+            with open(calibration_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("key") == key:
+                return saved["backend"]
+        except (OSError, ValueError):
+            pass
+        if not filenames:
+            return "threads"
+        image = self.decode_image(filenames[0])
+        height, width = image.shape[:2]
+        y0, x0 = max(0, (height - CALIBRATION_SIZE) // 2), max(0, (width - CALIBRATION_SIZE) // 2)
+        sample = image[y0:y0 + CALIBRATION_SIZE, x0:x0 + CALIBRATION_SIZE].copy()
+
+        throughput = {backend: self.measure_backend(backend, sample) for backend in ENHANCE_BACKENDS}
+        backend = max(throughput, key=throughput.get)
+        os.makedirs(self.report_folder, exist_ok=True)
+        with open(calibration_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "backend": backend, "images_per_second": throughput}, f, indent=4)
+        if self.progress_queue:
+            rates = ", ".join(f"{name} {rate:.2f}/s" for name, rate in throughput.items())
+            self.progress_queue.put(f"Enhancement backend calibration: {rates}; using {backend}")
+        return backend
+
+    def measure_backend(self, backend, sample):
+        # 按该方式的并行度同时增强若干份样本；先各运行一轮，排除进程启动和增强图创建的时间
+        previous_threads = cv2.getNumThreads()
+        self.start_backend(backend)
+        try:
+            count = self.pipeline_workers
+            with ThreadPoolExecutor(count) as executor:
+                list(executor.map(self.enhance_image, [sample] * count))
+                start = time.perf_counter()
+                list(executor.map(self.enhance_image, [sample] * 2 * count))
+                return 2 * count / (time.perf_counter() - start)
+        finally:
+            self.stop_backend()
+            cv2.setNumThreads(previous_threads)
+
+    def apply_quality_gate(self, filenames):
+        kept, report = self.quality_gate.filter(self.input_folder, filenames, self.cache)
+        # 删除上次运行留下的、本次被剔除图像的输出，避免它们继续进入 COLMAP
+        rejected = set(filenames) - set(kept)
+        for filename in rejected:
+            output_path = os.path.join(self.output_folder, self.output_name(filename))
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+        report_path = self.quality_gate.write_report(report, self.report_folder)
+        if self.progress_queue:
+            self.progress_queue.put(
+                f"Quality gate kept {report['accepted']}/{report['total']} images "
+                f"({len(report['blurry'])} blurry, {len(report['duplicates'])} duplicates, "
+                f"{len(report['unreadable'])} unreadable), saving {report['pairs_saved']} of "
+                f"{report['pairs_before']} exhaustive matching pairs. Report: {report_path}")
+        return kept
+
+    def iter_process_images(self, filenames):
+        # 流式处理，按完成顺序产出 (filename, output_path)，失败时 output_path 为 None
+        pipeline = ImagePipeline(self.decode_stage, self.enhance_stage, self.encode_stage,
+                                 enhance_workers=self.pipeline_workers, encode_workers=self.encode_workers,
+                                 max_in_flight=self.max_in_flight, queue_size=self.queue_size)
+        total = len(filenames)
+        for done, (filename, output_path, error) in enumerate(pipeline.run(filenames), start=1):
+            if self.image_timer:
+                self.image_timer.finish(filename)
+            if error is not None:
+                if self.progress_queue:
+                    self.progress_queue.put(f"Error processing image {os.path.join(self.input_folder, filename)}: {error}")
+                yield filename, None
+                continue
+            if self.progress_queue:
+                self.progress_queue.put(f"Processed and saved [{done}/{total}]: {output_path}")
+            yield filename, output_path
+
     def process_image(self, filename):
         img_path = os.path.join(self.input_folder, filename)
         try:
-            image = cv2.imread(img_path)
-            if image is None:
-                if self.progress_queue:
-                    self.progress_queue.put(f"Failed to read image: {img_path}")
-                return
-            processed_image = self.enhance_image(image)
-            output_path = os.path.join(self.output_folder, filename)
-            cv2.imwrite(output_path, processed_image)
+            image = self.decode_stage(filename, filename)
+            processed_image = self.enhance_stage(filename, image)
+            output_path = self.encode_stage(filename, processed_image)
             if self.progress_queue:
                 self.progress_queue.put(f"Processed and saved: {output_path}")
+            return output_path
         except Exception as e:
             if self.progress_queue:
                 self.progress_queue.put(f"Error processing image {img_path}: {e}")
+            return None
+        finally:
+            if self.image_timer:
+                self.image_timer.finish(filename)
+
+    def measure(self, filename, phase):
+        if self.image_timer is None:
+            return nullcontext({})
+        return self.image_timer.measure(filename, phase)
+
+    def decode_stage(self, filename, _):
+        with self.measure(filename, "decode") as record:
+            image = self.decode_image(filename)
+            record["read_bytes"] = os.path.getsize(os.path.join(self.input_folder, filename))
+            return image
+
+    def enhance_stage(self, filename, image):
+        with self.measure(filename, "enhance"):
+            return self.enhance_image(image)
+
+    def encode_stage(self, filename, image):
+        with self.measure(filename, "encode") as record:
+            output_path = self.encode_image(filename, image)
+            record["write_bytes"] = os.path.getsize(output_path)
+            return output_path
+
+    def decode_image(self, filename):
+        img_path = os.path.join(self.input_folder, filename)
+        image = image_io.read_image(img_path, self.max_megapixels if self.io["reduced_decode"] else 0)
+        if image is None:
+            raise ValueError(f"Failed to read image: {img_path}")
+        return self.limit_resolution(image)
+
+    def limit_resolution(self, image):
+        # COLMAP 的 SIFT 提取不需要原始分辨率，超过上限时按面积插值缩小
+        if not self.max_megapixels:
+            return image
+        height, width = image.shape[:2]
+        megapixels = height * width / 1e6
+        if megapixels <= self.max_megapixels:
+            return image
+        scale = (self.max_megapixels / megapixels) ** 0.5
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def output_name(self, filename):
+        if self.io["output_format"] == "source":
+            return filename
+        return os.path.splitext(filename)[0] + image_io.OUTPUT_EXTENSIONS[self.io["output_format"]]
+
+    def encode_image(self, filename, image):
+        name = self.output_name(filename)
+        output_path = os.path.join(self.output_folder, name)
+        # 输出文件可能是缓存文件的硬链接，先删除再写入，避免覆盖缓存内容
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        if self.io["output_format"] != "source":
+            # 更换输出格式后删除以前格式的输出，避免同一张图像两次进入 COLMAP
+            stem = os.path.splitext(name)[0]
+            for extension in set(image_io.OUTPUT_EXTENSIONS.values()) | {os.path.splitext(filename)[1]}:
+                stale_path = os.path.join(self.output_folder, stem + extension)
+                if stale_path != output_path and os.path.lexists(stale_path):
+                    os.remove(stale_path)
+        exif = source_size = None
+        if self.io["preserve_exif"]:
+            input_path = os.path.join(self.input_folder, filename)
+            exif = image_io.read_metadata(input_path)
+            source_size = image_io.read_image_size(input_path) if exif else None
+        data = image_io.encode_image(image, os.path.splitext(name)[1].lower(), self.io, exif, source_size)
+        image_io.write_image(output_path, data)
+        return output_path
+
+    def enhancement_graph(self):
+        graph = getattr(self.local, "graph", None)
+        if graph is None:
+            graph = self.local.graph = EnhancementGraph(self.enhancement, self.tile_size, self.tile_overlap)
+        return graph
 
     def enhance_image(self, image):
-        # 图像锐化（稍微调整）
-        sharpen_kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        image = cv2.filter2D(image, -1, sharpen_kernel)
-
-        # 去噪（减少强度）
-        image = cv2.fastNlMeansDenoisingColored(image, None, 3, 3, 7, 21)
-
-        # 直方图均衡化（保持不变）
-        img_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
-        img_yuv[:, :, 0] = cv2.equalizeHist(img_yuv[:, :, 0])
-        image = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2BGR)
-
-        # 图像缩放（保持原分辨率）
-        scale_percent = 100
-        width = int(image.shape[1] * scale_percent / 100)
-        height = int(image.shape[0] * scale_percent / 100)
-        dim = (width, height)
-        image = cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
-
-        # 颜色校正（保持不变）
-        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        cl = clahe.apply(l)
-        limg = cv2.merge((cl, a, b))
-        image = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
-
-        return image
+        if self.process_pool is not None:
+            return self.process_pool.submit(enhance_in_worker, image).result()
+        return self.enhancement_graph().apply(image)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+import fake_colmap
+from instrumentation import Instrumentation
+
+# 图像增强与重建编排的基准测试：生成合成图像集，测量增强吞吐量和峰值内存，
+# 并用 fake_colmap 替身驱动 ColmapReconstructor，结果写入 JSON，可与其他提交的结果对比
+
+RESOLUTIONS = [(1024, 768), (2048, 1536), (4000, 3000)]
+DATASETS = [(20, 1024, 768), (50, 2048, 1536)]
+RECONSTRUCTION_SIZES = [20, 200]
+QUICK_RESOLUTIONS = [(1024, 768)]
+QUICK_DATASETS = [(10, 1024, 768)]
+QUICK_RECONSTRUCTION_SIZES = [20]
+# 测量输出流处理时每张图像的日志行数
+STREAM_LOG_LINES = 200
+
+
+def synthetic_image(width, height, seed):
+    # 渐变背景加随机纹理块和噪声，使增强、JPEG 编码和特征提取的开销接近真实照片
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[..., 0] = x * 0.6 + y * 0.2
+    image[..., 1] = x * 0.2 + y * 0.6
+    image[..., 2] = 128
+    for _ in range(40):
+        w, h = int(rng.integers(width // 20, width // 4)), int(rng.integers(height // 20, height // 4))
+        x0, y0 = int(rng.integers(0, width - w)), int(rng.integers(0, height - h))
+        image[y0:y0 + h, x0:x0 + w] = rng.integers(0, 256, 3)
+    image += rng.normal(0, 12, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def make_dataset(folder, count, width, height, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        cv2.imwrite(os.path.join(folder, f"image_{i:04d}.jpg"), synthetic_image(width, height, seed + i))
+    return folder
+
+
+def reconstruction_config(image_folder, workspace_folder, executable):
+    # 固定匹配方式和参数档位，结果不随图像数量和本机硬件变化
+    return {
+        "output_folder": image_folder,
+        "workspace_folder": workspace_folder,
+        "colmap_executable": executable,
+        "matching": {"strategy": "exhaustive"},
+        "profile": {"name": "max", "gpu": False},
+        "instrumentation": {"enabled": False},
+    }
+
+
+class Benchmark:
+    def __init__(self, work_folder, sample_interval=0.05):
+        self.work_folder = work_folder
+        self.instrumentation = Instrumentation(os.path.join(work_folder, "reports"), "benchmark", sample_interval)
+        self.results = {}
+
+    def measure(self, name, function, items, megapixels=None):
+        # items、megapixels 为一次运行处理的图像数和总像素数（百万），用于换算吞吐量
+        with self.instrumentation.stage(name, kind="python"):
+            function()
+        record = self.instrumentation.stages[-1]
+        seconds = max(record["wall_seconds"], 1e-9)
+        result = {
+            "wall_seconds": record["wall_seconds"],
+            "cpu_seconds": record["cpu_seconds"],
+            "peak_rss_bytes": record.get("peak_rss_bytes"),
+            "images_per_second": round(items / seconds, 3),
+        }
+        message = f"{name}: {result['wall_seconds']:.3f} s, {result['images_per_second']:.2f} images/s"
+        if megapixels is not None:
+            result["megapixels_per_second"] = round(megapixels / seconds, 3)
+            message += f", {result['megapixels_per_second']:.2f} MP/s"
+        self.results[name] = result
+        print(message)
+        return result
+
+    def enhance(self, config, resolutions, repeats=5):
+        from ImageProcessor import ImageProcessor
+        processor = ImageProcessor(dict(config, input_folder=self.work_folder, output_folder=self.work_folder,
+                                        report_folder=os.path.join(self.work_folder, "reports"), cache_enabled=False))
+        for width, height in resolutions:
+            image = synthetic_image(width, height, 0)
+            # 预热一次，排除增强图初始化和 OpenCV 线程池启动
+            processor.enhance_image(image)
+
+            def run():
+                for _ in range(repeats):
+                    processor.enhance_image(image)
+            self.measure(f"enhance_image/{width}x{height}", run, repeats, repeats * width * height / 1e6)
+
+    def process_images(self, config, datasets):
+        from ImageProcessor import ImageProcessor
+        for count, width, height in datasets:
+            name = f"{count}x{width}x{height}"
+            input_folder = make_dataset(os.path.join(self.work_folder, "datasets", name), count, width, height)
+            output_folder = os.path.join(self.work_folder, "output", name)
+            processor = ImageProcessor(dict(config, input_folder=input_folder, output_folder=output_folder,
+                                            report_folder=os.path.join(self.work_folder, "reports"),
+                                            cache_enabled=False, instrumentation={"enabled": False},
+                                            quality_gate={"enabled": False}))
+            self.measure(f"process_images/{name}", processor.process_images, count, count * width * height / 1e6)
+
+    def reconstruction(self, sizes):
+        from colmapReconstruction import ColmapReconstructor
+        executable = fake_colmap.install(os.path.join(self.work_folder, "fake_colmap"))
+        for count in sizes:
+            image_folder = make_dataset(os.path.join(self.work_folder, "datasets", f"reconstruction_{count}"),
+                                        count, 320, 240)
+            workspace_folder = os.path.join(self.work_folder, "workspaces", f"reconstruction_{count}")
+            os.makedirs(workspace_folder, exist_ok=True)
+            config = reconstruction_config(image_folder, workspace_folder, executable)
+
+            def run(resume=True, log_lines=0):
+                os.environ["FAKE_COLMAP_LOG_LINES"] = str(log_lines)
+                try:
+                    reconstructor = ColmapReconstructor(dict(config, resume=resume))
+                    if not reconstructor.run_stages(reconstructor.build_stages()):
+                        raise RuntimeError("Reconstruction failed")
+                finally:
+                    os.environ.pop("FAKE_COLMAP_LOG_LINES", None)
+
+            # 全新运行：替身不做实际计算，耗时即为进程启动、输出解析和断点记录等编排开销
+            self.measure(f"reconstruction/{count}/orchestration", lambda: run(resume=False), count)
+            # 所有阶段都未变化，只有输入指纹检查
+            self.measure(f"reconstruction/{count}/resume", run, count)
+            # 每张图像输出大量日志，测量输出流的处理速度
+            result = self.measure(f"reconstruction/{count}/streaming",
+                                  lambda: run(resume=False, log_lines=STREAM_LOG_LINES), count)
+            # 7 个阶段中每张图像都输出日志的有 6 个（网格化只输出一行）
+            lines = 6 * count * (STREAM_LOG_LINES + 1)
+            result["lines_per_second"] = round(lines / max(result["wall_seconds"], 1e-9), 1)
+
+    def resume_after_failure(self, count=20):
+        # 在建图阶段注入失败，再次运行时前面的阶段应全部跳过
+        from colmapReconstruction import ColmapReconstructor
+        executable = fake_colmap.install(os.path.join(self.work_folder, "fake_colmap"))
+        image_folder = os.path.join(self.work_folder, "datasets", f"reconstruction_{count}")
+        if not os.path.exists(image_folder):
+            make_dataset(image_folder, count, 320, 240)
+        workspace_folder = os.path.join(self.work_folder, "workspaces", "resume_after_failure")
+        os.makedirs(workspace_folder, exist_ok=True)
+        config = reconstruction_config(image_folder, workspace_folder, executable)
+        os.environ["FAKE_COLMAP_FAIL"] = "mapper"
+        try:
+            reconstructor = ColmapReconstructor(config)
+            failed = not reconstructor.run_stages(reconstructor.build_stages())
+        finally:
+            os.environ.pop("FAKE_COLMAP_FAIL", None)
+
+        def run():
+            reconstructor = ColmapReconstructor(config)
+            if not reconstructor.run_stages(reconstructor.build_stages()):
+                raise RuntimeError("Reconstruction failed after resume")
+        result = self.measure("reconstruction/resume_after_failure", run, count)
+        result["failure_injected"] = failed
+
+    def write(self, path):
+        report = {
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "commit": git_commit(),
+            "host": {"platform": sys.platform, "cpu_count": os.cpu_count(), "python": sys.version.split()[0],
+                     "opencv": cv2.__version__},
+            "results": self.results,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        return path
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline_path, current_path):
+    # 耗时和内存越小越好，吞吐量越大越好；变化超过 10% 时标出
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(current_path, "r", encoding="utf-8") as f:
+        current = json.load(f)
+    print(f"{baseline.get('commit')} -> {current.get('commit')}")
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        for metric in ("wall_seconds", "peak_rss_bytes", "images_per_second", "megapixels_per_second",
+                       "lines_per_second"):
+            if not old.get(metric) or result.get(metric) is None:
+                continue
+            ratio = result[metric] / old[metric]
+            better = ratio > 1 if metric.endswith("per_second") else ratio < 1
+            flag = "" if abs(ratio - 1) < 0.1 else (" better" if better else " WORSE")
+            print(f"{name:<45} {metric:<22} {old[metric]:>14.3f} {result[metric]:>14.3f} {ratio:>7.2f}x{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image enhancement and reconstruction orchestration")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--quick", action="store_true", help="small datasets only")
+    parser.add_argument("--suite", nargs="+", default=["enhance", "process", "reconstruction"],
+                        choices=["enhance", "process", "reconstruction"])
+    parser.add_argument("--work-folder", help="keep generated data here instead of a temporary folder")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare the new results with an earlier JSON file")
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists("config.json"):
+        with open("config.json", "r") as f:
+            config = json.load(f)
+    work_folder = args.work_folder or tempfile.mkdtemp(prefix="benchmark_")
+    benchmark = Benchmark(work_folder)
+    try:
+        if "enhance" in args.suite:
+            benchmark.enhance(config, QUICK_RESOLUTIONS if args.quick else RESOLUTIONS)
+        if "process" in args.suite:
+            benchmark.process_images(config, QUICK_DATASETS if args.quick else DATASETS)
+        if "reconstruction" in args.suite:
+            benchmark.reconstruction(QUICK_RECONSTRUCTION_SIZES if args.quick else RECONSTRUCTION_SIZES)
+            benchmark.resume_after_failure()
+    finally:
+        if not args.work_folder:
+            shutil.rmtree(work_folder, ignore_errors=True)
+    print(f"Results written to {benchmark.write(args.output)}")
+    if args.compare:
+        compare(args.compare, args.output)
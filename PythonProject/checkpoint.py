@@ -0,0 +1,89 @@
+import os
+import re
+import json
+import time
+import hashlib
+from logging_config import get_logger
+
+
+def path_fingerprint(path):
+    # 文件以大小和修改时间为指纹，目录对其中所有文件的相对路径、大小和修改时间求哈希
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            stat = os.stat(full_path)
+            digest.update(f"{os.path.relpath(full_path, path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class StageCheckpoint:
+    def __init__(self, workspace_folder):
+        self.checkpoint_folder = os.path.join(workspace_folder, "checkpoints")
+        self.logger = get_logger(__name__)
+        os.makedirs(self.checkpoint_folder, exist_ok=True)
+
+    def manifest_path(self, description):
+        slug = re.sub(r"[^a-z0-9]+", "_", description.lower()).strip("_")
+        return os.path.join(self.checkpoint_folder, f"{slug}.json")
+
+    def load(self, description):
+        path = self.manifest_path(description)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, description, command, inputs, outputs):
+        manifest = self.load(description)
+        if manifest is None:
+            return False
+        if manifest["command"] != list(command):
+            self.logger.debug(f"{description}: command changed")
+            return False
+        for path, fingerprint in manifest["inputs"].items():
+            if path_fingerprint(path) != fingerprint:
+                self.logger.debug(f"{description}: input changed: {path}")
+                return False
+        if sorted(manifest["inputs"]) != sorted(inputs):
+            return False
+        # 输出可能被后续阶段原地修改（例如匹配阶段写入 database.db），这里只要求输出仍然存在
+        for path in outputs:
+            if not os.path.exists(path):
+                self.logger.debug(f"{description}: output missing: {path}")
+                return False
+        return True
+
+    def record(self, description, command, inputs, outputs):
+        # 输入指纹在阶段完成后记录，原地修改输入的阶段（匹配）因此也能被正确跳过
+        manifest = {
+            "description": description,
+            "command": list(command),
+            "inputs": {path: path_fingerprint(path) for path in inputs},
+            "outputs": {path: path_fingerprint(path) for path in outputs},
+            "completed_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        path = self.manifest_path(description)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def invalidate(self, description):
+        path = self.manifest_path(description)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def invalidate_all(self):
+        # 工作区在阶段流程之外被修改时（例如增量更新），所有阶段都需要重新检查
+        for name in os.listdir(self.checkpoint_folder):
+            if name.endswith(".json"):
+                os.remove(os.path.join(self.checkpoint_folder, name))
@@ -1,9 +1,64 @@
 import subprocess
 import os
 import json
+import queue
 import logging
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
 from multiprocessing import Queue
 from PySide6.QtWidgets import QMessageBox
+from checkpoint import StageCheckpoint
+from colmap_progress import ProgressParser
+from instrumentation import Instrumentation
+from dense_clusters import DenseClusterRunner, DENSE_CLUSTER_DEFAULTS
+from database_analytics import ViewGraphAnalyzer, VIEW_GRAPH_DEFAULTS
+from mesh_postprocess import MeshPostProcessor, MESH_POSTPROCESS_DEFAULTS
+from exif_utils import read_exif
+from image_io import list_images
+from pair_generation import pairs_from_descriptors, pairs_from_timestamps, write_pair_list
+from profiles import (PROFILE_DEFAULTS, choose_profile, dataset_statistics, describe_estimate, estimate_pairs,
+                      estimate_run, hardware_statistics, profile_options)
+
+MATCHING_DEFAULTS = {
+    "strategy": "auto",
+    "exhaustive_max_images": 200,
+    "vocab_tree_min_images": 1000,
+    "vocab_tree_path": "",
+    "vocab_tree_num_images": 100,
+    "sequential_overlap": 10,
+    "spatial_max_neighbors": 50,
+    "spatial_max_distance": 100,
+    "pair_source": "auto",
+    "pairs_k": 20,
+    "time_window": 10.0,
+}
+
+class JobCancelled(RuntimeError):
+    pass
+
+class ReconstructionStage:
+    def __init__(self, description, command, inputs=(), outputs=(), expected_total=None, resource="cpu",
+                 threads_option=None, action=None):
+        self.description = description
+        self.command = command
+        # 输出中没有总数的阶段（建图）用于计算进度百分比的总数
+        self.expected_total = expected_total
+        # 输入输出路径用于断点续跑：输入和命令行都未变化且输出存在时跳过该阶段
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        # 调度器按资源类型（cpu / io / gpu）分配核心，并通过 threads_option 设置该阶段的线程数
+        self.resource = resource
+        self.threads_option = threads_option
+        # 由 Python 代码完成的阶段：action(threads) 代替外部命令执行，command 只用于断点续跑的指纹
+        self.action = action
+
+    def command_for(self, threads=None):
+        # 线程数只影响运行速度，不计入断点续跑的命令行指纹
+        if threads and self.threads_option:
+            return self.command + [self.threads_option, str(threads)]
+        return self.command
 
 class ColmapReconstructor:
     def __init__(self, config, progress_queue=None):
@@ -14,9 +69,30 @@ class ColmapReconstructor:
         except KeyError as e:
             raise KeyError(f"Missing configuration key: {e}")
         self.progress_queue = progress_queue
+        self.resume = config.get("resume", True)
+        self.matching = dict(MATCHING_DEFAULTS, **config.get("matching", {}))
+        self.dense_clusters = dict(DENSE_CLUSTER_DEFAULTS, **config.get("dense_clusters", {}))
+        self.view_graph = dict(VIEW_GRAPH_DEFAULTS, **config.get("view_graph", {}))
+        self.mesh_postprocess = dict(MESH_POSTPROCESS_DEFAULTS, **config.get("mesh_postprocess", {}))
+        # 速度/质量参数档位，第一次构建阶段命令时确定
+        self.profile = dict(PROFILE_DEFAULTS, **config.get("profile", {}))
+        self.parameters = None
+        # 增强后的图像不带 EXIF 时，从原始图像读取拍摄时间和 GPS
+        self.exif_folder = config.get("input_folder")
+
+        self.instrumentation_config = config.get("instrumentation", {})
+        self.instrumentation = None
+        self.log_max_bytes = config.get("log_max_bytes", 10 * 1024 * 1024)
+        self.log_backup_count = config.get("log_backup_count", 5)
+
+        # 取消时终止正在运行的 COLMAP 进程，并不再开始后续阶段；簇并行时可能同时有多个进程
+        self.cancel_event = threading.Event()
+        self.processes = set()
+        self.process_lock = threading.Lock()
 
         self.check_paths()
         logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.command_log = self.setup_command_log()
 
     def check_paths(self):
         paths = [
@@ -29,28 +105,112 @@ class ColmapReconstructor:
             if not os.path.exists(path):
                 raise FileNotFoundError(f"Path does not exist: {path}")
 
-    def run_command(self, command, description):
+    def setup_command_log(self):
+        # COLMAP 原始输出写入按大小轮转的日志文件，不在内存中累积
+        log_folder = os.path.join(self.workspace_folder, "logs")
+        os.makedirs(log_folder, exist_ok=True)
+        log_path = os.path.abspath(os.path.join(log_folder, "colmap.log"))
+        logger = logging.getLogger(f"colmap.output.{log_path}")
+        if not logger.handlers:
+            handler = RotatingFileHandler(log_path, maxBytes=self.log_max_bytes, backupCount=self.log_backup_count,
+                                          encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        return logger
+
+    @staticmethod
+    def read_stream(stream, name, lines):
+        for line in iter(stream.readline, ""):
+            lines.put((name, line.rstrip("\r\n")))
+        stream.close()
+        lines.put((name, None))
+
+    def run_command(self, command, description, expected_total=None, env=None):
         command_str = ' '.join(command)
         logging.debug(f"Running command: {command_str}")
         if self.progress_queue:
             self.progress_queue.put(f"Running command: {command_str}")
-        result = subprocess.run(command, capture_output=True, text=True, shell=True)
-        logging.debug(f"Command stdout: {result.stdout}")
-        logging.debug(f"Command stderr: {result.stderr}")
+        self.command_log.info(f"[{description}] {command_str}")
+
+        probe_context = self.instrumentation.stage(description) if self.instrumentation else nullcontext()
+        with probe_context as probe:
+            self.stream_command(command, command_str, description, expected_total, probe, env)
         if self.progress_queue:
-            self.progress_queue.put(f"Command stdout: {result.stdout}")
-            self.progress_queue.put(f"Command stderr: {result.stderr}")
-        if result.returncode != 0:
-            error_message = f"Error executing: {command_str}\n{result.stderr}"
+            self.progress_queue.put(description + " completed")
+        logging.debug(f"{description} completed")
+
+    def stream_command(self, command, command_str, description, expected_total, probe=None, env=None):
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"{description} cancelled")
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   encoding="utf-8", errors="replace", bufsize=1, shell=os.name == "nt", env=env)
+        with self.process_lock:
+            self.processes.add(process)
+        if probe is not None:
+            probe.attach(process.pid)
+        # 两个读线程把 stdout/stderr 的行放入队列，主线程逐行解析进度，不会因某个管道写满而阻塞
+        lines = queue.Queue()
+        readers = [
+            threading.Thread(target=self.read_stream, args=(process.stdout, "stdout", lines), daemon=True),
+            threading.Thread(target=self.read_stream, args=(process.stderr, "stderr", lines), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        parser = ProgressParser(description, expected_total)
+        stderr_tail = deque(maxlen=50)
+        open_streams = len(readers)
+        while open_streams:
+            name, line = lines.get()
+            if line is None:
+                open_streams -= 1
+                continue
+            self.command_log.info(f"[{description}] {line}")
+            if name == "stderr":
+                stderr_tail.append(line)
+            event = parser.parse(line)
+            if event and self.progress_queue:
+                self.progress_queue.put(event)
+        returncode = process.wait()
+        with self.process_lock:
+            self.processes.discard(process)
+
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"{description} cancelled")
+        if returncode != 0:
+            stderr_text = "\n".join(stderr_tail)
+            error_message = f"Error executing: {command_str}\n{stderr_text}"
             logging.error(f"{error_message}")
             if self.progress_queue:
                 self.progress_queue.put(error_message)
-            raise RuntimeError(f"Command failed: {command_str}\n{result.stderr}")
-        if self.progress_queue:
-            self.progress_queue.put(description + " completed")
-        logging.debug(f"{description} completed")
+            raise RuntimeError(f"Command failed: {command_str}\n{stderr_text}")
+
+    def cancel(self):
+        self.cancel_event.set()
+        with self.process_lock:
+            processes = list(self.processes)
+        for process in processes:
+            self.kill_process_tree(process)
+
+    @staticmethod
+    def kill_process_tree(process):
+        # Windows 上通过 shell 启动 COLMAP.bat，只终止 shell 不会结束真正的 COLMAP 进程
+        if process.poll() is not None:
+            return
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)], capture_output=True)
+        else:
+            process.kill()
 
     def run_colmap(self):
+        self.run_stages(self.build_stages())
+
+        # 三维重建完成后弹出消息框
+        self.show_message("三维重建完成")
+
+    def build_stages(self):
         if not os.path.exists(self.workspace_folder):
             os.makedirs(self.workspace_folder)
 
@@ -62,80 +222,322 @@ class ColmapReconstructor:
         if not os.path.exists(dense_folder):
             os.makedirs(dense_folder)
 
+        database_path = os.path.join(self.workspace_folder, "database.db")
+        stages = [
+            self.feature_extraction_stage(database_path),
+            self.matching_stage(database_path),
+        ]
+        mapper_database_path = database_path
+        if self.view_graph["enabled"]:
+            # 剪枝后的图像对写入建图专用的数据库副本；图像较少时不剪枝，建图直接使用原数据库
+            pruned_database_path = None
+            if self.view_graph["prune"] and len(self.list_images()) >= self.view_graph["prune_min_images"]:
+                pruned_database_path = os.path.join(self.workspace_folder, "database_mapper.db")
+            stages.append(self.view_graph_stage(database_path, pruned_database_path))
+            mapper_database_path = pruned_database_path or database_path
+        stages.append(self.sparse_reconstruction_stage(mapper_database_path, sparse_folder))
+        stages += self.dense_stages(os.path.join(sparse_folder, "0"), dense_folder,
+                                    self.dense_clusters.get("enabled", False))
+        if self.mesh_postprocess["enabled"]:
+            stages.append(self.mesh_postprocess_stage(dense_folder))
+        return stages
+
+    def view_graph_stage(self, database_path, mapper_database_path=None):
+        report_path = os.path.join(self.workspace_folder, "reports", "view_graph.json")
+        analyzer = ViewGraphAnalyzer(database_path, mapper_database_path, report_path, self.view_graph,
+                                     self.progress_queue)
+        options = json.dumps(self.view_graph, sort_keys=True)
+        return ReconstructionStage("View Graph Analysis", ["view_graph", database_path, options],
+                                   inputs=[database_path],
+                                   outputs=[report_path] + ([mapper_database_path] if mapper_database_path else []),
+                                   resource="io", action=analyzer.run)
+
+    def mesh_postprocess_stage(self, dense_folder):
+        meshed_path = os.path.join(dense_folder, "meshed.ply")
+        output_path = os.path.join(dense_folder, "meshed_clean.ply")
+        glb_path = os.path.join(dense_folder, "meshed_clean.glb") if self.mesh_postprocess["export_glb"] else None
+        processor = MeshPostProcessor(meshed_path, output_path, self.mesh_postprocess, glb_path, self.progress_queue)
+        options = json.dumps(self.mesh_postprocess, sort_keys=True)
+        return ReconstructionStage("Mesh Post-processing", ["mesh_postprocess", meshed_path, options],
+                                   inputs=[meshed_path], outputs=[output_path] + ([glb_path] if glb_path else []),
+                                   resource="io", action=processor.run)
+
+    def profile_parameters(self):
+        if self.parameters is None:
+            folder, names = self.image_folder, self.list_images()
+            if not names and self.exif_folder and os.path.isdir(self.exif_folder):
+                # 边增强边提取特征时输出文件夹还是空的，用原始图像估计数据集规模
+                folder = self.exif_folder
+                names = sorted(list_images(folder))
+            dataset = dataset_statistics(folder, names)
+            hardware = hardware_statistics(self.profile["gpu"])
+            pairs = estimate_pairs(len(names), self.matching)
+            name = self.profile["name"]
+            if name == "auto":
+                name = choose_profile(dataset, hardware, pairs, self.profile["time_budget_hours"],
+                                      self.profile["options"])
+            self.parameters = profile_options(name, self.profile["options"])
+            stages, memory = estimate_run(self.parameters, dataset, hardware, pairs)
+            label = f"{name} (auto)" if self.profile["name"] == "auto" else name
+            message = describe_estimate(label, stages, memory, dataset, hardware)
+            logging.info(message)
+            if self.progress_queue:
+                self.progress_queue.put(message)
+        return self.parameters
+
+    def parameter(self, key):
+        return self.profile_parameters()[key]
+
+    def optional_parameters(self, *keys):
+        # 档位中值为 None 的参数不出现在命令行中，使用 COLMAP 默认值
+        parameters = self.profile_parameters()
+        return [item for key in keys if parameters[key] is not None for item in (f"--{key}", parameters[key])]
+
+    def sparse_reconstruction_stage(self, database_path, sparse_folder):
+        return ReconstructionStage("Sparse Reconstruction", [
+            self.colmap_executable, "mapper",
+            "--database_path", database_path,
+            "--image_path", self.image_folder,
+            "--output_path", sparse_folder,
+            "--Mapper.ba_refine_focal_length", "1",
+            "--Mapper.ba_refine_principal_point", "1",
+            "--Mapper.ba_refine_extra_params", "1"
+        ], inputs=[database_path, self.image_folder], outputs=[os.path.join(sparse_folder, "0")],
+            expected_total=len(self.list_images()), threads_option="--Mapper.num_threads")
+
+    def dense_stages(self, sparse_model_folder, dense_folder, clustered=False):
         fused_output_path = os.path.join(dense_folder, "fused.ply")
         meshed_output_path = os.path.join(dense_folder, "meshed.ply")
-
-        commands = [
-            ("Feature Extraction", [
-                self.colmap_executable, "feature_extractor",
-                "--database_path", os.path.join(self.workspace_folder, "database.db"),
-                "--image_path", self.image_folder,
-                "--ImageReader.single_camera", "1",
-                "--SiftExtraction.max_num_features", "200000",  # 增加特征点数量
-                "--SiftExtraction.estimate_affine_shape", "true",
-                "--SiftExtraction.domain_size_pooling", "true",
-                "--SiftExtraction.num_octaves", "4",  # 增加金字塔层数
-                "--SiftExtraction.peak_threshold", "0.01",  # 降低峰值阈值
-                "--SiftExtraction.edge_threshold", "5"  # 降低边缘阈值
-            ]),
-            ("Exhaustive Matching", [
-                self.colmap_executable, "exhaustive_matcher",
-                "--database_path", os.path.join(self.workspace_folder, "database.db"),
-                "--ExhaustiveMatching.block_size", "200"  # 增加块大小
-            ]),
-            ("Sparse Reconstruction", [
-                self.colmap_executable, "mapper",
-                "--database_path", os.path.join(self.workspace_folder, "database.db"),
-                "--image_path", self.image_folder,
-                "--output_path", sparse_folder,
-                "--Mapper.ba_refine_focal_length", "1",
-                "--Mapper.ba_refine_principal_point", "1",
-                "--Mapper.ba_refine_extra_params", "1"
-            ]),
-            ("Image Undistortion", [
+        stereo_folder = os.path.join(dense_folder, "stereo")
+        stages = [
+            ReconstructionStage("Image Undistortion", [
                 self.colmap_executable, "image_undistorter",
                 "--image_path", self.image_folder,
-                "--input_path", os.path.join(sparse_folder, "0"),
+                "--input_path", sparse_model_folder,
                 "--output_path", dense_folder,
                 "--output_type", "COLMAP"
-            ]),
-            ("Dense Reconstruction", [
+            ], inputs=[self.image_folder, sparse_model_folder],
+                outputs=[os.path.join(dense_folder, "images"), os.path.join(dense_folder, "sparse")], resource="io"),
+            ReconstructionStage("Dense Reconstruction", [
                 self.colmap_executable, "patch_match_stereo",
                 "--workspace_path", dense_folder,
                 "--workspace_format", "COLMAP",
-                "--PatchMatchStereo.geom_consistency", "true",
-                "--PatchMatchStereo.window_radius", "9",  # 增加窗口半径
-                "--PatchMatchStereo.num_iterations", "7",  # 增加迭代次数
+                "--PatchMatchStereo.geom_consistency", self.parameter("PatchMatchStereo.geom_consistency"),
+                "--PatchMatchStereo.window_radius", self.parameter("PatchMatchStereo.window_radius"),
+                "--PatchMatchStereo.num_iterations", self.parameter("PatchMatchStereo.num_iterations"),
                 "--PatchMatchStereo.filter", "1",  # 启用滤波器
-                "--PatchMatchStereo.max_image_size", "4000"  # 增加最大图像尺寸
-            ]),
-            ("Dense Fusion", [
+                "--PatchMatchStereo.max_image_size", self.parameter("PatchMatchStereo.max_image_size")
+            ], inputs=[os.path.join(dense_folder, "images"), os.path.join(dense_folder, "sparse")],
+                outputs=[os.path.join(stereo_folder, "depth_maps"), os.path.join(stereo_folder, "normal_maps")],
+                resource="gpu"),
+            ReconstructionStage("Dense Fusion", [
                 self.colmap_executable, "stereo_fusion",
                 "--workspace_path", dense_folder,
                 "--workspace_format", "COLMAP",
                 "--input_type", "photometric",  # 使用光度一致性
                 "--output_path", fused_output_path,
-                "--StereoFusion.check_num_images", "7"  # 提高检查图像数量
-            ]),
-            ("Mesh Generation", [
+                "--StereoFusion.check_num_images", self.parameter("StereoFusion.check_num_images")
+            ] + self.optional_parameters("StereoFusion.max_image_size"), inputs=[os.path.join(dense_folder, "sparse"), stereo_folder], outputs=[fused_output_path],
+                threads_option="--StereoFusion.num_threads"),
+            ReconstructionStage("Mesh Generation", [
                 self.colmap_executable, "poisson_mesher",
                 "--input_path", fused_output_path,
                 "--output_path", meshed_output_path
-            ])
+            ] + self.optional_parameters("PoissonMeshing.depth"), inputs=[fused_output_path], outputs=[meshed_output_path], threads_option="--PoissonMeshing.num_threads")
         ]
+        if clustered:
+            # 按图像簇分块计算深度图并融合，替换整体运行的 patch_match_stereo 和 stereo_fusion
+            stages[1:3] = [self.clustered_dense_stage(stages[1], stages[2], dense_folder)]
+        return stages
+
+    def clustered_dense_stage(self, stereo, fusion, dense_folder):
+        runner = DenseClusterRunner(self, stereo, fusion, dense_folder, self.dense_clusters)
+        options = json.dumps(self.dense_clusters, sort_keys=True)
+        return ReconstructionStage("Clustered Dense Reconstruction", stereo.command + fusion.command + [options],
+                                   inputs=stereo.inputs, outputs=stereo.outputs + fusion.outputs, resource="gpu",
+                                   action=runner.run)
+
+    def feature_extraction_stage(self, database_path):
+        return ReconstructionStage("Feature Extraction", [
+            self.colmap_executable, "feature_extractor",
+            "--database_path", database_path,
+            "--image_path", self.image_folder,
+            "--ImageReader.single_camera", "1",
+            # 特征数量、仿射形状估计和 DSP 由参数档位决定
+            "--SiftExtraction.max_num_features", self.parameter("SiftExtraction.max_num_features"),
+            "--SiftExtraction.estimate_affine_shape", self.parameter("SiftExtraction.estimate_affine_shape"),
+            "--SiftExtraction.domain_size_pooling", self.parameter("SiftExtraction.domain_size_pooling"),
+            "--SiftExtraction.num_octaves", "4",  # 增加金字塔层数
+            "--SiftExtraction.peak_threshold", "0.01",  # 降低峰值阈值
+            "--SiftExtraction.edge_threshold", "5"  # 降低边缘阈值
+        ] + self.optional_parameters("SiftExtraction.max_image_size"), inputs=[self.image_folder], outputs=[database_path], threads_option="--SiftExtraction.num_threads")
+
+    def list_images(self):
+        return sorted(list_images(self.image_folder))
+
+    def read_image_exif(self, names, fallback=True):
+        # fallback 为 False 时只读取实际送入 COLMAP 的图像；GPS 先验必须来自这些图像本身
+        exif = {}
+        for name in names:
+            info = read_exif(os.path.join(self.image_folder, name))
+            if fallback and info["timestamp"] is None and info["gps"] is None and self.exif_folder:
+                source_path = os.path.join(self.exif_folder, name)
+                if os.path.exists(source_path):
+                    info = read_exif(source_path)
+            exif[name] = info
+        return exif
+
+    def choose_matching_strategy(self, names):
+        strategy = self.matching["strategy"]
+        if strategy != "auto":
+            return strategy
+        # 根据数据集规模选择匹配方式：小数据集穷举，大数据集用词汇树、GPS 或候选图像对
+        count = len(names)
+        if count <= self.matching["exhaustive_max_images"]:
+            return "exhaustive"
+        vocab_tree_path = self.matching["vocab_tree_path"]
+        if count >= self.matching["vocab_tree_min_images"] and vocab_tree_path and os.path.exists(vocab_tree_path):
+            return "vocab_tree"
+        sample = names[::max(1, count // 20)]
+        # spatial_matcher 只能使用 feature_extractor 从 image_folder 中读到的位置先验，不能回退到原始图像
+        exif = self.read_image_exif(sample, fallback=False)
+        if sum(1 for info in exif.values() if info["gps"]) >= 0.8 * len(sample):
+            return "spatial"
+        return "pairs"
+
+    def generate_pairs(self, names):
+        source = self.matching["pair_source"]
+        pairs = set()
+        if source in ("auto", "timestamps"):
+            exif = self.read_image_exif(names)
+            timestamps = [exif[name]["timestamp"] for name in names]
+            pairs |= pairs_from_timestamps(names, timestamps, self.matching["time_window"])
+        # 自动模式下总是并入外观最相似的 k 张，拍摄时间不可用或不连续时也能找到重叠图像
+        if source in ("auto", "descriptors"):
+            pairs |= pairs_from_descriptors(self.image_folder, names, self.matching["pairs_k"])
+        return pairs
+
+    def matching_stage(self, database_path):
+        names = self.list_images()
+        strategy = self.choose_matching_strategy(names)
+        logging.debug(f"Matching strategy for {len(names)} images: {strategy}")
+        if self.progress_queue:
+            self.progress_queue.put(f"Matching strategy: {strategy} ({len(names)} images)")
+
+        if strategy == "exhaustive":
+            return ReconstructionStage("Exhaustive Matching", [
+                self.colmap_executable, "exhaustive_matcher",
+                "--database_path", database_path,
+                "--ExhaustiveMatching.block_size", self.parameter("ExhaustiveMatching.block_size")
+            ], inputs=[database_path], outputs=[database_path],
+                threads_option="--SiftMatching.num_threads")
+        if strategy == "sequential":
+            return ReconstructionStage("Sequential Matching", [
+                self.colmap_executable, "sequential_matcher",
+                "--database_path", database_path,
+                "--SequentialMatching.overlap", str(self.matching["sequential_overlap"]),
+                "--SequentialMatching.quadratic_overlap", "1"
+            ], inputs=[database_path], outputs=[database_path],
+                threads_option="--SiftMatching.num_threads")
+        if strategy == "spatial":
+            # 特征提取时 COLMAP 会把 EXIF GPS 写入数据库作为位置先验
+            return ReconstructionStage("Spatial Matching", [
+                self.colmap_executable, "spatial_matcher",
+                "--database_path", database_path,
+                "--SpatialMatching.is_gps", "1",
+                "--SpatialMatching.max_num_neighbors", str(self.matching["spatial_max_neighbors"]),
+                "--SpatialMatching.max_distance", str(self.matching["spatial_max_distance"])
+            ], inputs=[database_path], outputs=[database_path],
+                threads_option="--SiftMatching.num_threads")
+        if strategy == "vocab_tree":
+            vocab_tree_path = self.matching["vocab_tree_path"]
+            return ReconstructionStage("Vocab Tree Matching", [
+                self.colmap_executable, "vocab_tree_matcher",
+                "--database_path", database_path,
+                "--VocabTreeMatching.vocab_tree_path", vocab_tree_path,
+                "--VocabTreeMatching.num_images", str(self.matching["vocab_tree_num_images"])
+            ], inputs=[database_path, vocab_tree_path], outputs=[database_path],
+                threads_option="--SiftMatching.num_threads")
+        if strategy == "pairs":
+            pairs_path = os.path.join(self.workspace_folder, "match_pairs.txt")
+            pairs = self.generate_pairs(names)
+            write_pair_list(pairs, pairs_path)
+            if self.progress_queue:
+                total = len(names) * (len(names) - 1) // 2
+                self.progress_queue.put(f"Generated {len(pairs)} candidate pairs (exhaustive: {total})")
+            return ReconstructionStage("Pair List Matching", [
+                self.colmap_executable, "matches_importer",
+                "--database_path", database_path,
+                "--match_list_path", pairs_path,
+                "--match_type", "pairs"
+            ], inputs=[database_path, pairs_path], outputs=[database_path],
+                threads_option="--SiftMatching.num_threads")
+        raise ValueError(f"Unknown matching strategy: {strategy}")
+
+    @contextmanager
+    def instrumented(self, run_name="reconstruction"):
+        if self.instrumentation_config.get("enabled", True):
+            self.instrumentation = Instrumentation(os.path.join(self.workspace_folder, "reports"), run_name,
+                                                   self.instrumentation_config.get("sample_interval", 0.5),
+                                                   self.instrumentation_config.get("prometheus_path"))
+        try:
+            yield self.instrumentation
+        finally:
+            if self.instrumentation:
+                report_path = self.instrumentation.write_report()
+                if self.progress_queue:
+                    self.progress_queue.put(f"Run report written to {report_path}")
+                self.instrumentation = None
+
+    def run_stages(self, stages, allocate=None):
+        with self.instrumented():
+            return self.run_stage_list(stages, allocate)
 
-        for description, command in commands:
+    def run_action(self, stage, threads=None):
+        logging.debug(f"Running {stage.description}")
+        if self.progress_queue:
+            self.progress_queue.put(f"Running {stage.description}")
+        with self.instrumentation.stage(stage.description, kind="python") if self.instrumentation else nullcontext():
+            stage.action(threads)
+        if self.progress_queue:
+            self.progress_queue.put(stage.description + " completed")
+        logging.debug(f"{stage.description} completed")
+
+    def run_stage_list(self, stages, allocate=None):
+        # allocate(stage) 返回上下文管理器，进入时等待资源并给出该阶段可用的线程数；单独运行时不限制
+        checkpoint = StageCheckpoint(self.workspace_folder)
+        for stage in stages:
+            description = stage.description
+            if self.cancel_event.is_set():
+                if self.progress_queue:
+                    self.progress_queue.put("Reconstruction cancelled")
+                return False
+            if self.resume and checkpoint.is_fresh(description, stage.command, stage.inputs, stage.outputs):
+                logging.debug(f"{description} is up to date, skipping")
+                if self.progress_queue:
+                    self.progress_queue.put(f"{description} skipped (inputs and parameters unchanged)")
+                continue
+            # 先删除旧清单，阶段中途失败时下次运行会从该阶段重新开始
+            checkpoint.invalidate(description)
             try:
-                self.run_command(command, description)
+                with allocate(stage) if allocate else nullcontext() as threads:
+                    if stage.action:
+                        self.run_action(stage, threads)
+                    else:
+                        self.run_command(stage.command_for(threads), description, stage.expected_total)
+                checkpoint.record(description, stage.command, stage.inputs, stage.outputs)
                 print(f"{description} step completed successfully.")
+            except JobCancelled:
+                logging.info(f"{description} cancelled")
+                if self.progress_queue:
+                    self.progress_queue.put(f"{description} cancelled")
+                return False
             except RuntimeError as e:
                 logging.error(f"{description} failed with error: {e}")
                 if self.progress_queue:
                     self.progress_queue.put(f"[ERROR] {description} failed with error: {e}")
-                break
-
-        # 三维重建完成后弹出消息框
-        self.show_message("三维重建完成")
+                return False
+        return True
 
     def show_message(self, message):
         message_dialog = QMessageBox()
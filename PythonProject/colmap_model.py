@@ -0,0 +1,257 @@
+import os
+import json
+import struct
+import numpy as np
+from logging_config import get_logger
+
+# COLMAP 相机模型编号 -> (名称, 参数个数)
+CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3),
+    1: ("PINHOLE", 4),
+    2: ("SIMPLE_RADIAL", 4),
+    3: ("RADIAL", 5),
+    4: ("OPENCV", 8),
+    5: ("OPENCV_FISHEYE", 8),
+    6: ("FULL_OPENCV", 12),
+    7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4),
+    9: ("RADIAL_FISHEYE", 5),
+    10: ("THIN_PRISM_FISHEYE", 12),
+    11: ("RAD_TAN_THIN_PRISM_FISHEYE", 16),
+}
+
+CAMERA_DTYPE = np.dtype([("camera_id", "<i4"), ("model_id", "<i4"), ("width", "<u8"), ("height", "<u8")])
+IMAGE_DTYPE = np.dtype([("image_id", "<i4"), ("qvec", "<f8", 4), ("tvec", "<f8", 3), ("camera_id", "<i4"),
+                        ("num_points2D", "<u8")])
+POINT2D_DTYPE = np.dtype([("xy", "<f8", 2), ("point3D_id", "<i8")])
+TRACK_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+
+# points3D.bin 中每个点的定长头部，之后紧跟 track_length 个 TRACK_DTYPE 记录
+POINT3D_HEADER_DTYPE = np.dtype([("id", "<u8"), ("xyz", "<f8", 3), ("rgb", "u1", 3), ("error", "<f8"),
+                                 ("track_length", "<u8")])
+POINT3D_HEADER_SIZE = POINT3D_HEADER_DTYPE.itemsize
+CACHE_VERSION = 1
+
+
+def gather_records(raw, offsets, dtype):
+    # 从任意字节偏移处批量读取定长记录：先按字节取出，再整体重解释为结构化类型
+    dtype = np.dtype(dtype)
+    index = offsets[:, None] + np.arange(dtype.itemsize)
+    return raw[index].view(dtype).ravel()
+
+
+def read_cameras(path):
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    count = struct.unpack_from("<Q", raw, 0)[0]
+    cameras = np.empty(count, dtype=CAMERA_DTYPE)
+    params = {}
+    offset = 8
+    for i in range(count):
+        camera_id, model_id, width, height = struct.unpack_from("<iiQQ", raw, offset)
+        offset += 24
+        num_params = CAMERA_MODELS[model_id][1]
+        cameras[i] = (camera_id, model_id, width, height)
+        params[camera_id] = np.frombuffer(raw, dtype="<f8", count=num_params, offset=offset)
+        offset += 8 * num_params
+    return cameras, params
+
+
+def read_images(path):
+    # 每张图像的二维点是文件中连续的定长记录，直接作为内存映射上的零拷贝视图返回
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    count = struct.unpack_from("<Q", raw, 0)[0]
+    images = np.empty(count, dtype=IMAGE_DTYPE)
+    names = []
+    points2D = []
+    offset = 8
+    for i in range(count):
+        image_id = struct.unpack_from("<i", raw, offset)[0]
+        qvec = struct.unpack_from("<4d", raw, offset + 4)
+        tvec = struct.unpack_from("<3d", raw, offset + 36)
+        camera_id = struct.unpack_from("<i", raw, offset + 60)[0]
+        offset += 64
+        name_end = offset
+        while raw[name_end] != 0:
+            name_end += 1
+        names.append(bytes(raw[offset:name_end]).decode("utf-8"))
+        offset = name_end + 1
+        num_points2D = struct.unpack_from("<Q", raw, offset)[0]
+        offset += 8
+        images[i] = (image_id, qvec, tvec, camera_id, num_points2D)
+        points2D.append(np.ndarray((num_points2D,), dtype=POINT2D_DTYPE, buffer=raw, offset=offset))
+        offset += POINT2D_DTYPE.itemsize * num_points2D
+    return images, names, points2D
+
+
+class Points3DCache:
+    # points3D.bin 是变长记录，无法直接映射为定长数组；首次读取时转换为列式 .npy 文件，之后内存映射加载
+    FILES = ("ids", "xyz", "rgb", "error", "track_offsets", "track")
+
+    def __init__(self, bin_path, cache_folder):
+        self.bin_path = bin_path
+        self.cache_folder = cache_folder
+        self.logger = get_logger(__name__)
+
+    def source_stamp(self):
+        stat = os.stat(self.bin_path)
+        return {"version": CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_valid(self):
+        meta_path = os.path.join(self.cache_folder, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if meta != self.source_stamp():
+            return False
+        return all(os.path.exists(os.path.join(self.cache_folder, f"{name}.npy")) for name in self.FILES)
+
+    def load(self):
+        if not self.is_valid():
+            self.build()
+        return {name: np.load(os.path.join(self.cache_folder, f"{name}.npy"), mmap_mode="r") for name in self.FILES}
+
+    def scan_offsets(self, raw, count):
+        # 逐点跳过变长的 track 找到每个点记录的起始位置，只在建立缓存时执行一次；
+        # 每个记录的起点取决于前一个记录的 track 长度，只能顺序扫描，耗时随点数线性增长（千万级点需要数秒以上），
+        # 之后的加载直接内存映射缓存文件，不再扫描
+        read_length = struct.Struct("<Q").unpack_from
+        length_offset = POINT3D_HEADER_DTYPE.fields["track_length"][1]
+        buffer = memoryview(raw)
+        offsets = []
+        lengths = []
+        offset = 8
+        for _ in range(count):
+            offsets.append(offset)
+            length = read_length(buffer, offset + length_offset)[0]
+            lengths.append(length)
+            offset += POINT3D_HEADER_SIZE + TRACK_DTYPE.itemsize * length
+        return np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+    def build(self, chunk_points=1 << 17):
+        self.logger.debug(f"Building points3D cache for {self.bin_path}")
+        os.makedirs(self.cache_folder, exist_ok=True)
+        raw = np.memmap(self.bin_path, dtype=np.uint8, mode="r")
+        count = struct.unpack_from("<Q", raw, 0)[0]
+        offsets, lengths = self.scan_offsets(raw, count)
+        track_offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(lengths, out=track_offsets[1:])
+
+        def create(name, shape, dtype):
+            return np.lib.format.open_memmap(os.path.join(self.cache_folder, f"{name}.npy.tmp"), mode="w+",
+                                             dtype=dtype, shape=shape)
+
+        ids = create("ids", (count,), "<u8")
+        xyz = create("xyz", (count, 3), "<f8")
+        rgb = create("rgb", (count, 3), "u1")
+        error = create("error", (count,), "<f8")
+        track = create("track", (int(track_offsets[-1]),), TRACK_DTYPE)
+
+        # 分块转换，临时索引数组的内存与块大小成正比
+        for start in range(0, count, chunk_points):
+            end = min(start + chunk_points, count)
+            chunk = offsets[start:end]
+            headers = gather_records(raw, chunk, POINT3D_HEADER_DTYPE)
+            ids[start:end] = headers["id"]
+            xyz[start:end] = headers["xyz"]
+            rgb[start:end] = headers["rgb"]
+            error[start:end] = headers["error"]
+
+            chunk_lengths = lengths[start:end]
+            total = int(chunk_lengths.sum())
+            if total:
+                first = track_offsets[start]
+                within = np.arange(total, dtype=np.int64) - np.repeat(track_offsets[start:end] - first, chunk_lengths)
+                element_offsets = np.repeat(chunk + POINT3D_HEADER_SIZE, chunk_lengths) + TRACK_DTYPE.itemsize * within
+                track[first:first + total] = gather_records(raw, element_offsets, TRACK_DTYPE)
+
+        for array in (ids, xyz, rgb, error, track):
+            array.flush()
+        del ids, xyz, rgb, error, track
+        with open(os.path.join(self.cache_folder, "track_offsets.npy.tmp"), "wb") as f:
+            np.save(f, track_offsets)
+        for name in self.FILES:
+            os.replace(os.path.join(self.cache_folder, f"{name}.npy.tmp"), os.path.join(self.cache_folder, f"{name}.npy"))
+        with open(os.path.join(self.cache_folder, "meta.json"), "w") as f:
+            json.dump(self.source_stamp(), f)
+
+
+class SparseModel:
+    def __init__(self, model_folder, cache_folder=None):
+        self.model_folder = model_folder
+        for name in ("cameras.bin", "images.bin", "points3D.bin"):
+            path = os.path.join(model_folder, name)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Path does not exist: {path}")
+        # 缓存默认放在模型目录旁边，避免改变 sparse/0 的内容指纹
+        self.cache_folder = cache_folder or os.path.normpath(model_folder) + ".npcache"
+
+        self.cameras, self.camera_params = read_cameras(os.path.join(model_folder, "cameras.bin"))
+        self.images, self.image_names, self.points2D = read_images(os.path.join(model_folder, "images.bin"))
+        points = Points3DCache(os.path.join(model_folder, "points3D.bin"), self.cache_folder).load()
+        self.point_ids = points["ids"]
+        self.xyz = points["xyz"]
+        self.rgb = points["rgb"]
+        self.error = points["error"]
+        # CSR 布局：第 i 个点的观测为 track[track_offsets[i]:track_offsets[i + 1]]
+        self.track_offsets = points["track_offsets"]
+        self.track = points["track"]
+
+    def track_lengths(self):
+        return np.diff(self.track_offsets)
+
+    def point_track(self, index):
+        return self.track[self.track_offsets[index]:self.track_offsets[index + 1]]
+
+    def image_index(self):
+        return {name: i for i, name in enumerate(self.image_names)}
+
+    def covisibility(self, chunk_pairs=1 << 23):
+        # 返回共视图像对数组 (M, 2) 及其共视点数，按 track 长度分组向量化展开所有图像对
+        lengths = self.track_lengths()
+        image_ids = np.asarray(self.track["image_id"], dtype=np.int64)
+        keys = []
+        counts = []
+        for length in np.unique(lengths[lengths > 1]):
+            length = int(length)
+            indices = np.flatnonzero(lengths == length)
+            first, second = np.triu_indices(length, 1)
+            step = max(1, chunk_pairs // len(first))
+            for start in range(0, len(indices), step):
+                starts = self.track_offsets[indices[start:start + step]]
+                observations = image_ids[starts[:, None] + np.arange(length)]
+                a = observations[:, first].ravel()
+                b = observations[:, second].ravel()
+                valid = a != b
+                low, high = np.minimum(a, b)[valid], np.maximum(a, b)[valid]
+                chunk_keys, chunk_counts = np.unique(low << 32 | high, return_counts=True)
+                keys.append(chunk_keys)
+                counts.append(chunk_counts)
+        if not keys:
+            return np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64)
+        all_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+        return np.stack([all_keys >> 32, all_keys & 0xFFFFFFFF], axis=1), totals
+
+    def statistics(self):
+        lengths = self.track_lengths()
+        observations = int(lengths.sum())
+        return {
+            "num_cameras": int(len(self.cameras)),
+            "num_registered_images": int(len(self.images)),
+            "num_points3D": int(len(self.xyz)),
+            "num_observations": observations,
+            "mean_track_length": float(lengths.mean()) if len(lengths) else 0.0,
+            "max_track_length": int(lengths.max()) if len(lengths) else 0,
+            "mean_observations_per_image": observations / len(self.images) if len(self.images) else 0.0,
+            "mean_reprojection_error": float(self.error.mean()) if len(self.error) else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    model = SparseModel(sys.argv[1] if len(sys.argv) > 1 else "workspace/sparse/0")
+    print(json.dumps(model.statistics(), indent=4))
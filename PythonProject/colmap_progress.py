@@ -0,0 +1,69 @@
+import re
+import time
+
+# COLMAP 各命令输出的进度行，例如 "Processed file [3/120]"、"Fusing image [5/120]"
+BRACKET_PATTERNS = [
+    re.compile(r"Processed file \[(\d+)/(\d+)\]"),
+    re.compile(r"Matching image \[(\d+)/(\d+)\]"),
+    re.compile(r"Indexing image \[(\d+)/(\d+)\]"),
+    re.compile(r"Undistorting image \[(\d+)/(\d+)\]"),
+    re.compile(r"Fusing image \[(\d+)/(\d+)\]"),
+    re.compile(r"Importing matches \[(\d+)/(\d+)\]"),
+    re.compile(r"Processing view (\d+) / (\d+)"),
+]
+BLOCK_PATTERN = re.compile(r"Matching block \[(\d+)/(\d+), (\d+)/(\d+)\]")
+REGISTER_PATTERN = re.compile(r"Registering image #(\d+) \((\d+)\)")
+
+
+class ProgressParser:
+    def __init__(self, stage, expected_total=None, min_interval=1.0, min_step=1.0):
+        self.stage = stage
+        # 建图阶段的输出不带总数，用图像数量作为总数
+        self.expected_total = expected_total
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.start_time = time.time()
+        self.last_emit_time = 0.0
+        self.last_percent = None
+
+    def match(self, line):
+        block = BLOCK_PATTERN.search(line)
+        if block:
+            row, rows, column, columns = (int(value) for value in block.groups())
+            return (row - 1) * columns + column, rows * columns
+        registered = REGISTER_PATTERN.search(line)
+        if registered and self.expected_total:
+            return min(int(registered.group(2)), self.expected_total), self.expected_total
+        for pattern in BRACKET_PATTERNS:
+            found = pattern.search(line)
+            if found:
+                return int(found.group(1)), int(found.group(2))
+        return None
+
+    def parse(self, line):
+        # 返回结构化进度事件；变化太小或间隔太短时返回 None，避免刷屏
+        matched = self.match(line)
+        if matched is None:
+            return None
+        current, total = matched
+        if total <= 0:
+            return None
+        fraction = min(current / total, 1.0)
+        percent = round(100.0 * fraction, 1)
+        now = time.time()
+        if self.last_percent is not None and percent < 100.0:
+            if percent - self.last_percent < self.min_step and now - self.last_emit_time < self.min_interval:
+                return None
+        self.last_percent = percent
+        self.last_emit_time = now
+        elapsed = now - self.start_time
+        eta = elapsed / fraction * (1 - fraction) if fraction > 0 else None
+        return {
+            "type": "progress",
+            "stage": self.stage,
+            "current": current,
+            "total": total,
+            "percent": percent,
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+        }
@@ -0,0 +1,149 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import nullcontext
+from multiprocessing import Manager
+from logging_config import get_logger
+from checkpoint import StageCheckpoint
+from ImageProcessor import ImageProcessor
+from colmapReconstruction import ColmapReconstructor
+
+
+class FeatureBatcher:
+    # 图像写入输出文件夹后加入待提取列表；提取线程空闲时把已就绪的图像作为一批交给 feature_extractor
+    def __init__(self, reconstructor, stage, batch_folder, min_batch=16, max_batch=256, cancel_event=None):
+        self.reconstructor = reconstructor
+        self.stage = stage
+        self.batch_folder = batch_folder
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.pending = []
+        self.closed = False
+        self.error = None
+        self.batches = 0
+        self.extracted = 0
+        self.camera_id = None
+        # 提取失败时设置，通知图像处理停止，不再增强之后不会被提取的图像
+        self.cancel_event = cancel_event
+        # 单相机模式下后续批次复用第一批创建的相机，否则每次调用都会新建一个相机
+        command = stage.command
+        self.single_camera = "--ImageReader.single_camera" in command and \
+            command[command.index("--ImageReader.single_camera") + 1] == "1"
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.logger = get_logger(__name__)
+        os.makedirs(batch_folder, exist_ok=True)
+
+    def start(self):
+        self.thread.start()
+
+    def add(self, filename):
+        with self.condition:
+            self.pending.append(filename)
+            self.condition.notify()
+
+    def close(self):
+        # 图像处理结束后提交剩余图像并等待提取完成，返回提取线程中发生的错误
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        return self.error
+
+    def take(self):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.pending) >= self.min_batch or self.closed)
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            return batch
+
+    def run(self):
+        try:
+            while True:
+                batch = self.take()
+                if not batch:
+                    return
+                self.extract(batch)
+        except Exception as e:
+            self.error = e
+            if self.cancel_event is not None:
+                self.cancel_event.set()
+
+    def extract(self, batch):
+        self.batches += 1
+        list_path = os.path.join(self.batch_folder, f"batch_{self.batches:04d}.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            f.write("".join(f"{name}\n" for name in batch))
+        command = self.stage.command_for() + ["--image_list_path", list_path]
+        if self.camera_id is not None:
+            command += ["--ImageReader.existing_camera_id", str(self.camera_id)]
+        self.reconstructor.run_command(command, f"{self.stage.description} batch {self.batches}")
+        self.extracted += len(batch)
+        if self.single_camera and self.camera_id is None:
+            self.camera_id = self.read_camera_id()
+        if self.reconstructor.progress_queue:
+            self.reconstructor.progress_queue.put(f"Extracted features for {self.extracted} images "
+                                                  f"({self.batches} batches)")
+
+    def read_camera_id(self):
+        database_path = self.stage.command[self.stage.command.index("--database_path") + 1]
+        connection = sqlite3.connect(database_path)
+        try:
+            row = connection.execute("SELECT MIN(camera_id) FROM cameras").fetchone()
+        finally:
+            connection.close()
+        return row[0] if row else None
+
+
+class CombinedPipeline:
+    # 图像增强与 COLMAP 特征提取同时进行，其余重建阶段在全部图像提取完成后照常运行
+    def __init__(self, config, progress_queue=None):
+        self.config = config
+        self.progress_queue = progress_queue
+        options = config.get("combined_pipeline", {})
+        self.min_batch = options.get("min_batch", 16)
+        self.max_batch = options.get("max_batch", 256)
+        self.processor = ImageProcessor(config, progress_queue)
+        os.makedirs(config["output_folder"], exist_ok=True)
+        self.reconstructor = ColmapReconstructor(config, progress_queue)
+        self.logger = get_logger(__name__)
+
+    def run(self):
+        workspace_folder = self.reconstructor.workspace_folder
+        stage = self.reconstructor.feature_extraction_stage(os.path.join(workspace_folder, "database.db"))
+        checkpoint = StageCheckpoint(workspace_folder)
+        checkpoint.invalidate(stage.description)
+
+        batcher = FeatureBatcher(self.reconstructor, stage, os.path.join(workspace_folder, "feature_batches"),
+                                 self.min_batch, self.max_batch, self.processor.cancel_event)
+        # 各批次的 feature_extractor 命令和整个重叠阶段都写入运行报告
+        with self.reconstructor.instrumented("combined_feature_extraction") as instrumentation:
+            with instrumentation.stage(stage.description, kind="python") if instrumentation else nullcontext() as probe:
+                batcher.start()
+                try:
+                    self.processor.process_images(on_ready=batcher.add)
+                finally:
+                    error = batcher.close()
+                if error is not None and probe is not None:
+                    probe.record["status"] = "failed"
+        if error is not None:
+            self.logger.error(f"{stage.description} failed with error: {error}")
+            if self.progress_queue:
+                self.progress_queue.put(f"[ERROR] {stage.description} failed with error: {error}")
+            return False
+        # 记录与单独运行时相同的特征提取清单，之后单独运行重建也会跳过该阶段
+        checkpoint.record(stage.description, stage.command, stage.inputs, stage.outputs)
+
+        stages = self.reconstructor.build_stages()
+        return self.reconstructor.run_stages(stages[1:])
+
+
+if __name__ == "__main__":
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    manager = Manager()
+    progress_queue = manager.Queue()
+    pipeline = CombinedPipeline(config, progress_queue)
+    pipeline.run()
+    print("Image processing and 3D reconstruction completed.")
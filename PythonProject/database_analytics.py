@@ -0,0 +1,217 @@
+import os
+import json
+import sqlite3
+import logging
+import numpy as np
+
+VIEW_GRAPH_DEFAULTS = {
+    "enabled": False,
+    # 内点数少于该值的图像对不计入视图图
+    "min_inliers": 15,
+    # 度数低于该值的图像报告为弱连接
+    "min_degree": 3,
+    # 剪枝：保留最大生成树加上每张图像内点数最多的 k 条边，只在图像数不少于 prune_min_images 时进行
+    "prune": True,
+    "prune_min_images": 300,
+    "k_nearest": 10,
+}
+
+# COLMAP 中 pair_id = image_id1 * MAX_IMAGE_ID + image_id2，其中 image_id1 < image_id2
+MAX_IMAGE_ID = 2147483647
+
+
+def pair_ids_to_images(pair_ids):
+    pair_ids = np.asarray(pair_ids, dtype=np.int64)
+    return pair_ids // MAX_IMAGE_ID, pair_ids % MAX_IMAGE_ID
+
+
+def blob_array(data, rows, cols, dtype):
+    # 直接在 SQLite 返回的 bytes 上建立视图，不复制
+    if not rows:
+        return np.empty((0, cols), dtype=dtype)
+    return np.frombuffer(data, dtype=dtype).reshape(rows, cols)
+
+
+def read_images(connection):
+    rows = connection.execute("SELECT image_id, name FROM images ORDER BY image_id").fetchall()
+    return np.array([row[0] for row in rows], dtype=np.int64), [row[1] for row in rows]
+
+
+def read_keypoint_counts(connection):
+    # 关键点数量只需 rows 列，不读取 blob
+    return dict(connection.execute("SELECT image_id, rows FROM keypoints"))
+
+
+def read_keypoints(connection, image_id):
+    row = connection.execute("SELECT rows, cols, data FROM keypoints WHERE image_id = ?", (image_id,)).fetchone()
+    if row is None:
+        return np.empty((0, 2), dtype=np.float32)
+    return blob_array(row[2], row[0], row[1], np.float32)
+
+
+def read_matches(connection, table="matches"):
+    # 按 pair_id 返回 (image_id1, image_id2, N x 2 的关键点序号)；一次查询取出整张表
+    query = f"SELECT pair_id, rows, cols, data FROM {table} WHERE rows > 0"
+    for pair_id, rows, cols, data in connection.execute(query):
+        image_id1, image_id2 = pair_ids_to_images(pair_id)
+        yield int(image_id1), int(image_id2), blob_array(data, rows, cols, np.uint32)
+
+
+def read_two_view_edges(connection):
+    # 视图图的边权为几何验证后的内点数，同样只需 rows 列
+    rows = connection.execute("SELECT pair_id, rows FROM two_view_geometries WHERE rows > 0").fetchall()
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    data = np.array(rows, dtype=np.int64)
+    first, second = pair_ids_to_images(data[:, 0])
+    return data[:, 0], first, second, data[:, 1]
+
+
+def matched_keypoint_counts(connection, image_ids):
+    # 每张图像至少出现在一个验证图像对中的关键点数：把 (图像, 关键点序号) 编为一个整数后去重
+    keys = []
+    for image_id1, image_id2, matches in read_matches(connection, "two_view_geometries"):
+        keys.append((np.int64(image_id1) << 32) | matches[:, 0].astype(np.int64))
+        keys.append((np.int64(image_id2) << 32) | matches[:, 1].astype(np.int64))
+    if not keys:
+        return np.zeros(len(image_ids), dtype=np.int64)
+    unique = np.unique(np.concatenate(keys))
+    owners, counts = np.unique(unique >> 32, return_counts=True)
+    result = np.zeros(len(image_ids), dtype=np.int64)
+    positions = np.searchsorted(image_ids, owners)
+    valid = (positions < len(image_ids)) & (image_ids[np.minimum(positions, len(image_ids) - 1)] == owners)
+    result[positions[valid]] = counts[valid]
+    return result
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return False
+        self.parent[second] = first
+        return True
+
+
+def maximum_spanning_forest(count, first, second, weights):
+    # Kruskal：按内点数从大到小加入不成环的边；返回选中边的下标和每个顶点的连通分量编号
+    forest = UnionFind(count)
+    selected = [edge for edge in np.argsort(-weights, kind="stable").tolist()
+                if forest.union(int(first[edge]), int(second[edge]))]
+    return np.array(selected, dtype=np.int64), np.array([forest.find(i) for i in range(count)])
+
+
+def nearest_edges(count, first, second, weights, k):
+    # 每个顶点内点数最多的 k 条边：每条边在两个端点下各出现一次，按 (顶点, 权重降序) 排序后取各组前 k 条
+    order = np.argsort(-weights, kind="stable")
+    ends = np.concatenate([first[order], second[order]])
+    edges = np.concatenate([order, order])
+    position = np.concatenate([np.arange(len(order)), np.arange(len(order))])
+    by_vertex = np.lexsort((position, ends))
+    sorted_ends = ends[by_vertex]
+    starts = np.searchsorted(sorted_ends, sorted_ends, side="left")
+    rank = np.arange(len(sorted_ends)) - starts
+    keep = np.zeros(len(weights), dtype=bool)
+    keep[edges[by_vertex[rank < k]]] = True
+    return keep
+
+
+class ViewGraphAnalyzer:
+    # 在匹配和建图之间读取 database.db：报告视图图的连通分量和弱连接图像，
+    # 并把冗余图像对从建图使用的数据库副本中删除，减少建图时光束法平差的观测数
+    def __init__(self, database_path, mapper_database_path, report_path, options, progress_queue=None):
+        self.database_path = database_path
+        self.mapper_database_path = mapper_database_path
+        self.report_path = report_path
+        self.options = dict(VIEW_GRAPH_DEFAULTS, **options)
+        self.progress_queue = progress_queue
+
+    def notify(self, message):
+        logging.debug(message)
+        if self.progress_queue:
+            self.progress_queue.put(message)
+
+    def run(self, threads=None):
+        connection = sqlite3.connect(self.database_path)
+        try:
+            report, prune_pairs = self.analyze(connection)
+        finally:
+            connection.close()
+        if self.mapper_database_path:
+            self.write_mapper_database(prune_pairs)
+        os.makedirs(os.path.dirname(self.report_path), exist_ok=True)
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        self.notify(f"View graph: {report['images']} images, {report['edges']} verified pairs, "
+                    f"{len(report['components'])} components, {len(report['weak_images'])} weakly connected images, "
+                    f"{report['pruned_edges']} pairs pruned. Report: {self.report_path}")
+        return report
+
+    def analyze(self, connection):
+        image_ids, names = read_images(connection)
+        index = {image_id: i for i, image_id in enumerate(image_ids.tolist())}
+        all_pair_ids, first_ids, second_ids, all_inliers = read_two_view_edges(connection)
+        strong = all_inliers >= self.options["min_inliers"]
+        pair_ids, inliers = all_pair_ids[strong], all_inliers[strong]
+        first = np.array([index[i] for i in first_ids[strong].tolist()], dtype=np.int64)
+        second = np.array([index[i] for i in second_ids[strong].tolist()], dtype=np.int64)
+
+        count = len(image_ids)
+        degree = np.bincount(np.concatenate([first, second]), minlength=count)
+        tree, roots = maximum_spanning_forest(count, first, second, inliers)
+        keypoints = read_keypoint_counts(connection)
+        matched = matched_keypoint_counts(connection, image_ids)
+
+        component_members = {}
+        for i, root in enumerate(roots.tolist()):
+            component_members.setdefault(root, []).append(names[i])
+        components = sorted(component_members.values(), key=len, reverse=True)
+
+        weak_images = []
+        for i in np.flatnonzero(degree < self.options["min_degree"]).tolist():
+            total = keypoints.get(int(image_ids[i]), 0)
+            weak_images.append({"name": names[i], "degree": int(degree[i]), "keypoints": int(total),
+                                "matched_keypoints": int(matched[i])})
+
+        prune_pairs = np.empty(0, dtype=np.int64)
+        if self.options["prune"] and count >= self.options["prune_min_images"]:
+            keep = nearest_edges(count, first, second, inliers, self.options["k_nearest"])
+            keep[tree] = True
+            # 内点数低于阈值的图像对本来就不计入视图图，一并删除
+            prune_pairs = np.concatenate([pair_ids[~keep], all_pair_ids[~strong]])
+
+        report = {
+            "images": count,
+            "edges": int(len(pair_ids)),
+            "mean_degree": float(degree.mean()) if count else 0.0,
+            "components": [{"size": len(members), "images": members if len(members) <= 50 else members[:50]}
+                           for members in components],
+            "weak_images": weak_images,
+            "pruned_edges": int(len(prune_pairs)),
+        }
+        return report, prune_pairs
+
+    def write_mapper_database(self, prune_pairs):
+        # 在副本上删除图像对，原数据库保持匹配阶段的结果，匹配阶段的断点续跑不受影响
+        source = sqlite3.connect(self.database_path)
+        target = sqlite3.connect(self.mapper_database_path + ".tmp")
+        try:
+            source.backup(target)
+            with target:
+                target.executemany("DELETE FROM two_view_geometries WHERE pair_id = ?",
+                                   ((int(pair_id),) for pair_id in prune_pairs))
+        finally:
+            source.close()
+            target.close()
+        os.replace(self.mapper_database_path + ".tmp", self.mapper_database_path)
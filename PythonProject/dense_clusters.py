@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import struct
+import logging
+from array import array
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from colmap_model import SparseModel, read_images
+import ply_io
+
+DENSE_CLUSTER_DEFAULTS = {
+    "enabled": False,
+    # 每个簇负责计算深度图的图像数
+    "cluster_size": 40,
+    # 每张图像加入簇上下文的最强共视邻居数，与 patch-match 的源图像数一致
+    "num_sources": 20,
+    # 同时运行的 COLMAP 进程数，以及每个融合进程的线程数（0 表示按核心数平分）
+    "workers": 2,
+    "threads_per_worker": 0,
+    # 多 GPU 时各进程轮流使用的 GPU 编号，为空时使用 COLMAP 默认设置
+    "gpu_indices": [],
+}
+
+
+def link_directory(source, target):
+    if os.path.lexists(target):
+        return
+    try:
+        os.symlink(os.path.abspath(source), target, target_is_directory=True)
+    except OSError:
+        # Windows 未开启开发者模式时无法创建符号链接，改用目录联接
+        if os.name != "nt":
+            raise
+        import _winapi
+        _winapi.CreateJunction(os.path.abspath(source), target)
+
+
+def cluster_images(model, cluster_size, num_sources):
+    # 在共视图上从连接最强的图像开始贪心扩展，每个簇的核心图像互不重叠；
+    # 上下文为核心图像的最强共视邻居，使簇边界处的深度图和融合也有足够的视角
+    names = model.image_names
+    index = {image_id: i for i, image_id in enumerate(model.images["image_id"].tolist())}
+    neighbors = [{} for _ in names]
+    pairs, counts = model.covisibility()
+    for (first, second), count in zip(pairs.tolist(), counts.tolist()):
+        if first in index and second in index:
+            neighbors[index[first]][index[second]] = count
+            neighbors[index[second]][index[first]] = count
+
+    assigned = np.full(len(names), -1)
+    clusters = []
+    for seed in sorted(range(len(names)), key=lambda i: -sum(neighbors[i].values())):
+        if assigned[seed] >= 0:
+            continue
+        label = len(clusters)
+        core = [seed]
+        assigned[seed] = label
+        frontier = dict(neighbors[seed])
+        while len(core) < cluster_size:
+            candidates = {i: weight for i, weight in frontier.items() if assigned[i] < 0}
+            if not candidates:
+                break
+            best = max(candidates, key=candidates.get)
+            core.append(best)
+            assigned[best] = label
+            for i, weight in neighbors[best].items():
+                frontier[i] = frontier.get(i, 0) + weight
+        core_set = set(core)
+        context = set()
+        for i in core:
+            strongest = sorted(neighbors[i].items(), key=lambda item: -item[1])[:num_sources]
+            context.update(j for j, _ in strongest if j not in core_set)
+        clusters.append({"core": sorted(names[i] for i in core), "context": sorted(names[i] for i in context)})
+    return clusters
+
+
+def read_visibility(path, mapping=None):
+    # fused.ply.vis：点数 (uint64)，之后每个点为可见图像数 (uint32) 和对应的图像序号 (uint32)；
+    # mapping 把文件中的图像序号换算为全局序号；返回每个点可见图像中的最小序号，没有可见图像时为 -1
+    with open(path, "rb") as f:
+        count = struct.unpack("<Q", f.read(8))[0]
+        data = array("I")
+        data.frombytes(f.read())
+    if sys.byteorder != "little":
+        data.byteswap()
+    # 记录变长，只能顺序找到每个点的起始位置，耗时随点数线性增长；array 的下标访问比 NumPy 标量快
+    starts = []
+    offset = 0
+    for _ in range(count):
+        starts.append(offset)
+        offset += 1 + data[offset]
+    raw = np.frombuffer(data, dtype=np.uint32)
+    starts = np.array(starts, dtype=np.int64)
+    sizes = raw[starts].astype(np.int64)
+    is_index = np.ones(len(raw), dtype=bool)
+    is_index[starts] = False
+    indices = raw[is_index]
+    if mapping is not None:
+        indices = mapping[indices]
+    owners = np.full(count, -1, dtype=np.int64)
+    nonempty = sizes > 0
+    segment_starts = (np.cumsum(sizes) - sizes)[nonempty]
+    if len(segment_starts):
+        owners[nonempty] = np.minimum.reduceat(indices, segment_starts)
+    return owners
+
+
+class DenseClusterRunner:
+    # 把稠密重建拆成按图像簇的小工作区：先对所有簇做光度一致性计算，再做几何一致性计算（需要邻居的光度深度图），
+    # 已存在的深度图不再计算，中断后重新运行只处理剩余图像；最后把各簇的融合点云合并为一个 fused.ply
+    def __init__(self, reconstructor, stereo_stage, fusion_stage, dense_folder, options):
+        self.reconstructor = reconstructor
+        self.stereo_stage = stereo_stage
+        self.fusion_stage = fusion_stage
+        self.dense_folder = dense_folder
+        self.options = dict(DENSE_CLUSTER_DEFAULTS, **options)
+        self.stereo_folder = os.path.join(dense_folder, "stereo")
+        self.clusters_folder = os.path.join(dense_folder, "clusters")
+        self.fused_path = fusion_stage.command[fusion_stage.command.index("--output_path") + 1]
+
+    def notify(self, message):
+        logging.debug(message)
+        if self.reconstructor.progress_queue:
+            self.reconstructor.progress_queue.put(message)
+
+    def run(self, threads=None):
+        model = SparseModel(os.path.join(self.dense_folder, "sparse"))
+        clusters = cluster_images(model, self.options["cluster_size"], self.options["num_sources"])
+        os.makedirs(self.clusters_folder, exist_ok=True)
+        with open(os.path.join(self.clusters_folder, "clusters.json"), "w", encoding="utf-8") as f:
+            json.dump(clusters, f, indent=4, ensure_ascii=False)
+        self.notify(f"Dense reconstruction split into {len(clusters)} clusters of up to "
+                    f"{self.options['cluster_size']} images")
+
+        # 请求中的进程池由线程池代替：每个任务本身就启动一个独立的 COLMAP 进程，线程只负责等待和转发输出，
+        # 这样各任务仍是进程级并行，又能共用 run_command 的输出流解析、性能记录和取消
+        workers = max(1, self.options["workers"])
+        self.threads_per_worker = self.options["threads_per_worker"] or max(1, (threads or os.cpu_count() or 1) // workers)
+        folders = [self.prepare_workspace(i, cluster) for i, cluster in enumerate(clusters)]
+        with ThreadPoolExecutor(workers) as executor:
+            for kind in self.passes():
+                # list() 让任一簇失败时在这里抛出
+                list(executor.map(self.run_patch_match, range(len(clusters)), folders, clusters, [kind] * len(clusters)))
+            fused = list(executor.map(self.run_fusion, range(len(clusters)), folders))
+        self.merge(model, clusters, fused)
+
+    def passes(self):
+        # 不做几何一致性检查的参数档位只需要光度一致性深度图
+        command = self.stereo_stage.command
+        if command[command.index("--PatchMatchStereo.geom_consistency") + 1] == "true":
+            return "photometric", "geometric"
+        return ("photometric",)
+
+    def prepare_workspace(self, index, cluster):
+        # 簇工作区链接到共享的图像、模型和深度图目录，只有配置文件是各簇独立的
+        folder = os.path.join(self.clusters_folder, f"cluster_{index:03d}")
+        stereo_folder = os.path.join(folder, "stereo")
+        os.makedirs(stereo_folder, exist_ok=True)
+        link_directory(os.path.join(self.dense_folder, "images"), os.path.join(folder, "images"))
+        link_directory(os.path.join(self.dense_folder, "sparse"), os.path.join(folder, "sparse"))
+        for name in ("depth_maps", "normal_maps", "consistency_graphs"):
+            os.makedirs(os.path.join(self.stereo_folder, name), exist_ok=True)
+            link_directory(os.path.join(self.stereo_folder, name), os.path.join(stereo_folder, name))
+        with open(os.path.join(stereo_folder, "fusion.cfg"), "w", encoding="utf-8") as f:
+            f.write("".join(f"{name}\n" for name in cluster["core"] + cluster["context"]))
+        return folder
+
+    def is_done(self, name, kind):
+        return all(os.path.exists(os.path.join(self.stereo_folder, folder, f"{name}.{kind}.bin"))
+                   for folder in ("depth_maps", "normal_maps"))
+
+    def run_patch_match(self, index, folder, cluster, kind):
+        pending = [name for name in cluster["core"] if not self.is_done(name, kind)]
+        if not pending:
+            return
+        with open(os.path.join(folder, "stereo", "patch-match.cfg"), "w", encoding="utf-8") as f:
+            f.write("".join(f"{name}\n__auto__, {self.options['num_sources']}\n" for name in pending))
+        command = list(self.stereo_stage.command)
+        command[command.index("--workspace_path") + 1] = folder
+        if kind == "photometric":
+            command[command.index("--PatchMatchStereo.geom_consistency") + 1] = "false"
+            command[command.index("--PatchMatchStereo.filter") + 1] = "0"
+        gpu_indices = self.options["gpu_indices"]
+        if gpu_indices:
+            command += ["--PatchMatchStereo.gpu_index", str(gpu_indices[index % len(gpu_indices)])]
+        # patch_match_stereo 在 GPU 上运行，不受线程数限制；多 GPU 时由 gpu_index 把各进程分到不同 GPU
+        self.reconstructor.run_command(command, f"Dense Cluster {index} ({kind}, {len(pending)} images)")
+
+    def run_fusion(self, index, folder):
+        fused_path = os.path.join(folder, "fused.ply")
+        command = list(self.fusion_stage.command_for(self.threads_per_worker))
+        command[command.index("--workspace_path") + 1] = folder
+        command[command.index("--output_path") + 1] = fused_path
+        self.reconstructor.run_command(command, f"Dense Cluster {index} (fusion)")
+        return fused_path
+
+    def merge(self, model, clusters, fused):
+        # 上下文图像会让同一个点出现在多个簇中：按点的可见图像中全局序号最小者归属，只保留归属本簇核心图像的点；
+        # 可见性文件中的图像序号是该簇工作区 sparse 模型中的图像顺序，先按图像名换算为稠密工作区模型中的序号
+        image_index = {name: i for i, name in enumerate(model.image_names)}
+        writer = None
+        total = 0
+        try:
+            for cluster, path in zip(clusters, fused):
+                ply = ply_io.PlyFile(path)
+                if writer is None:
+                    writer = ply_io.PlyWriter(self.fused_path, ply.vertices.dtype)
+                keep = None
+                if os.path.exists(path + ".vis"):
+                    local_names = read_images(os.path.join(os.path.dirname(path), "sparse", "images.bin"))[1]
+                    mapping = np.array([image_index[name] for name in local_names], dtype=np.int64)
+                    owners = read_visibility(path + ".vis", mapping)
+                    core = np.array(sorted(image_index[name] for name in cluster["core"]))
+                    keep = np.isin(owners, core)
+                start = 0
+                for chunk in ply.iter_chunks():
+                    writer.write(chunk if keep is None else chunk[keep[start:start + len(chunk)]])
+                    start += len(chunk)
+            if writer is not None:
+                total = writer.count
+                writer.close()
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        # 合并结果没有对应的可见性文件，删除旧文件避免与新点云不一致
+        if os.path.exists(self.fused_path + ".vis"):
+            os.remove(self.fused_path + ".vis")
+        self.notify(f"Merged {len(fused)} cluster point clouds into {self.fused_path} ({total} points)")
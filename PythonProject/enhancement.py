@@ -0,0 +1,305 @@
+import cv2
+import copy
+import numpy as np
+
+# 与原先硬编码流程等价的默认增强图：锐化 -> 去噪 -> 直方图均衡化（YUV 的 Y 通道）-> 缩放 -> CLAHE（LAB 的 L 通道）
+DEFAULT_GRAPH = {
+    "luma_space": "lab",
+    "steps": [
+        {"op": "sharpen", "amount": 1.0},
+        {"op": "denoise", "h": 3, "h_color": 3, "template_window": 7, "search_window": 21},
+        {"op": "equalize_hist", "luma_space": "yuv"},
+        {"op": "resize", "scale_percent": 100},
+        {"op": "clahe", "clip_limit": 3.0, "tile_grid_size": [8, 8]},
+    ],
+}
+
+LUMA_SPACES = {
+    "lab": (cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2BGR),
+    "yuv": (cv2.COLOR_BGR2YUV, cv2.COLOR_YUV2BGR),
+}
+
+
+class BgrOp:
+    # 作用于整幅 BGR 图像的操作；radius 不为 None 的局部操作可以分块执行
+    luma = False
+    radius = None
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def is_identity(self):
+        return False
+
+    def output_shape(self, shape):
+        return shape
+
+    def apply(self, src, dst):
+        raise NotImplementedError
+
+
+class LumaOp:
+    # 只作用于亮度通道的操作，相邻且亮度空间相同的操作会被合并到同一次颜色空间转换中
+    luma = True
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.luma_space = spec.get("luma_space")
+
+    def is_identity(self):
+        return False
+
+    def apply(self, src, dst):
+        raise NotImplementedError
+
+
+class SharpenOp(BgrOp):
+    def __init__(self, spec):
+        super().__init__(spec)
+        amount = spec.get("amount", 1.0)
+        self.kernel = np.array([[0, -amount, 0], [-amount, 1 + 4 * amount, -amount], [0, -amount, 0]],
+                               dtype=np.float32)
+
+    radius = 1
+
+    def is_identity(self):
+        return self.spec.get("amount", 1.0) == 0
+
+    def apply(self, src, dst):
+        return cv2.filter2D(src, -1, self.kernel, dst=dst)
+
+
+class DenoiseOp(BgrOp):
+    def __init__(self, spec):
+        super().__init__(spec)
+        # 模板窗口与搜索窗口半径之和即为输出像素依赖的邻域半径
+        self.radius = spec.get("template_window", 7) // 2 + spec.get("search_window", 21) // 2
+
+    def is_identity(self):
+        return self.spec.get("h", 3) == 0 and self.spec.get("h_color", 3) == 0
+
+    def apply(self, src, dst):
+        spec = self.spec
+        return cv2.fastNlMeansDenoisingColored(src, dst, spec.get("h", 3), spec.get("h_color", 3),
+                                               spec.get("template_window", 7), spec.get("search_window", 21))
+
+
+class ResizeOp(BgrOp):
+    def is_identity(self):
+        return self.spec.get("scale_percent", 100) == 100
+
+    def output_shape(self, shape):
+        scale_percent = self.spec.get("scale_percent", 100)
+        return (int(shape[0] * scale_percent / 100), int(shape[1] * scale_percent / 100)) + tuple(shape[2:])
+
+    def apply(self, src, dst):
+        height, width = dst.shape[:2]
+        return cv2.resize(src, (width, height), dst=dst, interpolation=cv2.INTER_AREA)
+
+
+class EqualizeHistOp(LumaOp):
+    def apply(self, src, dst):
+        return cv2.equalizeHist(src, dst=dst)
+
+
+class ClaheOp(LumaOp):
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.clahe = cv2.createCLAHE(clipLimit=spec.get("clip_limit", 3.0),
+                                     tileGridSize=tuple(spec.get("tile_grid_size", [8, 8])))
+
+    def apply(self, src, dst):
+        return self.clahe.apply(src, dst=dst)
+
+
+OPS = {
+    "sharpen": SharpenOp,
+    "denoise": DenoiseOp,
+    "resize": ResizeOp,
+    "equalize_hist": EqualizeHistOp,
+    "clahe": ClaheOp,
+}
+
+
+class LumaGroup:
+    # 合并后的亮度处理：一次转换到亮度空间，依次执行所有亮度操作，再转换回 BGR
+    def __init__(self, ops, luma_space):
+        self.ops = ops
+        self.forward, self.backward = LUMA_SPACES[luma_space]
+
+    def output_shape(self, shape):
+        return shape
+
+    def apply(self, src, dst, buffers):
+        shape = src.shape
+        converted = cv2.cvtColor(src, self.forward, dst=buffers.get("luma_converted", shape, src.dtype))
+        channel = cv2.extractChannel(converted, 0, dst=buffers.get("luma_a", shape[:2], src.dtype))
+        spare = buffers.get("luma_b", shape[:2], src.dtype)
+        for op in self.ops:
+            channel, spare = op.apply(channel, spare), channel
+        cv2.insertChannel(channel, converted, 0)
+        return cv2.cvtColor(converted, self.backward, dst=dst)
+
+
+class TiledRun:
+    # 将连续的局部操作按重叠分块执行，降低大图去噪时的峰值内存
+    def __init__(self, ops, tile_size, overlap=None):
+        self.ops = ops
+        self.tile_size = tile_size
+        # 默认重叠取邻域半径之和的两倍：融合带位于重叠区中部，此时分块结果与整幅处理一致
+        self.overlap = 2 * sum(op.radius for op in ops) if overlap is None else overlap
+        self.spec = {"op": "tiled(" + "+".join(op.spec["op"] for op in ops) + ")"}
+
+    def output_shape(self, shape):
+        return shape
+
+    def apply(self, src, dst, buffers):
+        height, width = src.shape[:2]
+        tile, overlap = self.tile_size, self.overlap
+        for y0 in range(0, height, tile):
+            for x0 in range(0, width, tile):
+                y1, x1 = min(y0 + tile, height), min(x0 + tile, width)
+                # 带重叠区域裁剪输入块
+                cy0, cx0 = max(y0 - overlap, 0), max(x0 - overlap, 0)
+                cy1, cx1 = min(y1 + overlap, height), min(x1 + overlap, width)
+                block = src[cy0:cy1, cx0:cx1]
+                for index, op in enumerate(self.ops):
+                    out = buffers.get(f"tile{index % 2}", block.shape, block.dtype)
+                    block = op.apply(block, out)
+                # 写回时向左、向上多写入半个重叠带，与已写入的相邻块线性羽化融合
+                band_y, band_x = (y0 - cy0) // 2, (x0 - cx0) // 2
+                region = block[y0 - cy0 - band_y:y1 - cy0, x0 - cx0 - band_x:x1 - cx0]
+                self.blend(dst, region, y0 - band_y, x0 - band_x, band_y, band_x)
+        return dst
+
+    @staticmethod
+    def blend(dst, region, y0, x0, band_y, band_x):
+        rows, cols = region.shape[:2]
+        if band_y == 0 and band_x == 0:
+            dst[y0:y0 + rows, x0:x0 + cols] = region
+            return
+        weight_y = np.ones(rows, dtype=np.float32)
+        weight_x = np.ones(cols, dtype=np.float32)
+        if band_y:
+            weight_y[:band_y] = (np.arange(band_y, dtype=np.float32) + 0.5) / band_y
+        if band_x:
+            weight_x[:band_x] = (np.arange(band_x, dtype=np.float32) + 0.5) / band_x
+        weight = np.minimum(weight_y[:, None], weight_x[None, :])
+        # 只对重叠带做浮点融合，其余区域直接拷贝
+        dst[y0 + band_y:y0 + rows, x0 + band_x:x0 + cols] = region[band_y:, band_x:]
+        for ys, xs in ((slice(0, band_y), slice(0, cols)), (slice(band_y, rows), slice(0, band_x))):
+            w = weight[ys, xs][..., None]
+            old = dst[y0 + ys.start:y0 + ys.stop, x0 + xs.start:x0 + xs.stop].astype(np.float32)
+            new = region[ys, xs].astype(np.float32)
+            dst[y0 + ys.start:y0 + ys.stop, x0 + xs.start:x0 + xs.stop] = np.clip(
+                old + (new - old) * w + 0.5, 0, 255).astype(dst.dtype)
+
+
+class BufferPool:
+    # 按名称、尺寸和类型复用的中间缓冲区，避免每帧重新分配整幅图像
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def clear(self):
+        self.buffers.clear()
+
+
+class EnhancementGraph:
+    def __init__(self, graph=None, tile_size=0, tile_overlap=None):
+        self.graph = copy.deepcopy(graph or DEFAULT_GRAPH)
+        self.luma_space = self.graph.get("luma_space", "lab")
+        if self.luma_space not in LUMA_SPACES:
+            raise ValueError(f"Unknown luma space: {self.luma_space}")
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.plan = self.compile(self.graph.get("steps", []))
+        self.buffers = BufferPool()
+        self.last_shape = None
+
+    def compile(self, steps):
+        plan = []
+        pending_luma = []
+        for spec in steps:
+            if not spec.get("enabled", True):
+                continue
+            op_name = spec.get("op")
+            if op_name not in OPS:
+                raise ValueError(f"Unknown enhancement op: {op_name}")
+            op = OPS[op_name](spec)
+            # 去掉不改变图像的操作（例如 100% 缩放），使其两侧的亮度操作可以合并
+            if op.is_identity():
+                continue
+            if op.luma:
+                # 单个步骤可以用 luma_space 覆盖全图的亮度空间，空间不同的相邻操作分开转换
+                op.luma_space = op.luma_space or self.luma_space
+                if op.luma_space not in LUMA_SPACES:
+                    raise ValueError(f"Unknown luma space: {op.luma_space}")
+                if pending_luma and pending_luma[-1].luma_space != op.luma_space:
+                    plan.append(LumaGroup(pending_luma, pending_luma[-1].luma_space))
+                    pending_luma = []
+                pending_luma.append(op)
+                continue
+            if pending_luma:
+                plan.append(LumaGroup(pending_luma, pending_luma[-1].luma_space))
+                pending_luma = []
+            plan.append(op)
+        if pending_luma:
+            plan.append(LumaGroup(pending_luma, pending_luma[-1].luma_space))
+        if self.tile_size:
+            plan = self.tile(plan)
+        return plan
+
+    def tile(self, plan):
+        # 亮度操作依赖全图直方图，缩放会改变尺寸，只有局部操作参与分块
+        tiled = []
+        run = []
+        for step in plan:
+            if getattr(step, "radius", None) is not None:
+                run.append(step)
+                continue
+            if run:
+                tiled.append(TiledRun(run, self.tile_size, self.tile_overlap))
+                run = []
+            tiled.append(step)
+        if run:
+            tiled.append(TiledRun(run, self.tile_size, self.tile_overlap))
+        return tiled
+
+    def describe(self):
+        names = []
+        for step in self.plan:
+            if isinstance(step, LumaGroup):
+                names.append("luma(" + "+".join(op.spec["op"] for op in step.ops) + ")")
+            elif isinstance(step, TiledRun):
+                names.append(f"{step.spec['op']}[{self.tile_size}px, overlap {step.overlap}]")
+            else:
+                names.append(step.spec["op"])
+        return " -> ".join(names)
+
+    def apply(self, image):
+        if not self.plan:
+            return image
+        # 图像尺寸变化时释放旧尺寸的缓冲区
+        if image.shape != self.last_shape:
+            self.buffers.clear()
+            self.last_shape = image.shape
+        src = image
+        for index, step in enumerate(self.plan):
+            shape = step.output_shape(src.shape)
+            # 中间结果在两个缓冲区之间交替，最后一步写入新数组以便交给下游
+            if index == len(self.plan) - 1:
+                dst = np.empty(shape, dtype=src.dtype)
+            else:
+                dst = self.buffers.get(f"frame{index % 2}", shape, src.dtype)
+            if isinstance(step, (LumaGroup, TiledRun)):
+                src = step.apply(src, dst, self.buffers)
+            else:
+                src = step.apply(src, dst)
+        return src
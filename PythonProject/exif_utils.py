@@ -0,0 +1,210 @@
+import struct
+from datetime import datetime
+
+# 只解析重建需要的少量标签，不依赖第三方 EXIF 库
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_FOCAL_LENGTH = 0x920A
+TAG_FOCAL_LENGTH_35MM = 0xA405
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_PIXEL_X_DIMENSION = 0xA002
+TAG_PIXEL_Y_DIMENSION = 0xA003
+TAG_FOCAL_PLANE_X_RESOLUTION = 0xA20E
+TAG_FOCAL_PLANE_Y_RESOLUTION = 0xA20F
+
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+
+def read_exif_segment(path):
+    # 返回 JPEG 中 APP1 Exif 段的 TIFF 数据，没有 EXIF 时返回 None
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            # SOS 之后是压缩数据，EXIF 只会出现在它之前
+            if marker[1] == 0xDA:
+                return None
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack(">H", length_bytes)[0]
+            payload = f.read(length - 2)
+            if marker[1] == 0xE1 and payload.startswith(b"Exif\x00\x00"):
+                return payload[6:]
+
+
+def parse_ifd(tiff, offset, endian):
+    entries = {}
+    if offset + 2 > len(tiff):
+        return entries
+    count = struct.unpack(endian + "H", tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + 12 * i
+        if entry + 12 > len(tiff):
+            break
+        tag, value_type, value_count = struct.unpack(endian + "HHI", tiff[entry:entry + 8])
+        size = TYPE_SIZES.get(value_type, 1) * value_count
+        if size <= 4:
+            data = tiff[entry + 8:entry + 8 + size]
+        else:
+            data_offset = struct.unpack(endian + "I", tiff[entry + 8:entry + 12])[0]
+            data = tiff[data_offset:data_offset + size]
+        entries[tag] = decode_value(data, value_type, value_count, endian)
+    return entries
+
+
+def ifd_entry_offsets(tiff, offset, endian):
+    # 产出 IFD 中每个条目的 (条目偏移, 标签, 类型, 数量)
+    if offset + 2 > len(tiff):
+        return
+    count = struct.unpack(endian + "H", tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + 12 * i
+        if entry + 12 > len(tiff):
+            return
+        yield (entry,) + struct.unpack(endian + "HHI", tiff[entry:entry + 8])
+
+
+def decode_value(data, value_type, value_count, endian):
+    try:
+        if value_type == 2:
+            return data.split(b"\x00", 1)[0].decode("ascii", errors="ignore").strip()
+        if value_type == 1:
+            values = tuple(data)
+        elif value_type == 3:
+            values = struct.unpack(endian + "H" * value_count, data)
+        elif value_type in (4, 9):
+            values = struct.unpack(endian + ("I" if value_type == 4 else "i") * value_count, data)
+        elif value_type in (5, 10):
+            raw = struct.unpack(endian + ("I" if value_type == 5 else "i") * (2 * value_count), data)
+            values = tuple(raw[i] / raw[i + 1] if raw[i + 1] else 0.0 for i in range(0, len(raw), 2))
+        else:
+            return data
+    except struct.error:
+        return None
+    return values[0] if value_count == 1 else values
+
+
+def read_exif(path):
+    # 读取拍摄时间、焦距和 GPS，失败或缺失的字段为 None
+    result = {"make": None, "model": None, "timestamp": None, "focal_length": None,
+              "focal_length_35mm": None, "gps": None}
+    try:
+        tiff = read_exif_segment(path)
+    except OSError:
+        return result
+    if not tiff or len(tiff) < 8:
+        return result
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd0 = parse_ifd(tiff, struct.unpack(endian + "I", tiff[4:8])[0], endian)
+    exif = parse_ifd(tiff, ifd0[TAG_EXIF_IFD], endian) if isinstance(ifd0.get(TAG_EXIF_IFD), int) else {}
+
+    result["make"] = ifd0.get(TAG_MAKE)
+    result["model"] = ifd0.get(TAG_MODEL)
+    result["focal_length"] = exif.get(TAG_FOCAL_LENGTH)
+    result["focal_length_35mm"] = exif.get(TAG_FOCAL_LENGTH_35MM)
+    stamp = exif.get(TAG_DATETIME_ORIGINAL) or ifd0.get(TAG_DATETIME)
+    if isinstance(stamp, str):
+        try:
+            result["timestamp"] = datetime.strptime(stamp, "%Y:%m:%d %H:%M:%S").timestamp()
+        except ValueError:
+            pass
+
+    if isinstance(ifd0.get(TAG_GPS_IFD), int):
+        gps = parse_ifd(tiff, ifd0[TAG_GPS_IFD], endian)
+        latitude, longitude = gps.get(2), gps.get(4)
+        if isinstance(latitude, tuple) and isinstance(longitude, tuple) and len(latitude) == 3 and len(longitude) == 3:
+            lat = latitude[0] + latitude[1] / 60 + latitude[2] / 3600
+            lon = longitude[0] + longitude[1] / 60 + longitude[2] / 3600
+            if gps.get(1) == "S":
+                lat = -lat
+            if gps.get(3) == "W":
+                lon = -lon
+            altitude = gps.get(6) if isinstance(gps.get(6), float) else 0.0
+            if gps.get(5) == 1:
+                altitude = -altitude
+            result["gps"] = (lat, lon, altitude)
+    return result
+
+
+def update_exif(tiff, width, height, source_size=None):
+    # OpenCV 解码时已按方向标签旋转像素，输出图像也可能被缩小：方向改为 1，像素尺寸改为输出尺寸，
+    # 焦平面分辨率按缩放比例调整（COLMAP 用它和焦距计算焦距先验），其余标签（相机型号、焦距、GPS 等）原样保留；
+    # source_size 为原图的 (宽, 高)，缺省时取 EXIF 中的像素尺寸
+    data = bytearray(tiff)
+    if len(data) < 8:
+        return bytes(data)
+    endian = "<" if data[:2] == b"II" else ">"
+    entries = {}
+    exif_offset = None
+    ifds = [struct.unpack(endian + "I", data[4:8])[0]]
+    while ifds:
+        for entry, tag, value_type, value_count in ifd_entry_offsets(data, ifds.pop(), endian):
+            if tag == TAG_EXIF_IFD and exif_offset is None and value_type in (4, 13):
+                exif_offset = struct.unpack(endian + "I", data[entry + 8:entry + 12])[0]
+                ifds.append(exif_offset)
+            elif value_count == 1:
+                entries[tag] = (entry, value_type)
+
+    if source_size is None:
+        dimensions = [entries.get(tag) for tag in (TAG_PIXEL_X_DIMENSION, TAG_PIXEL_Y_DIMENSION)]
+        if all(item is not None and item[1] in (3, 4) for item in dimensions):
+            source_size = tuple(struct.unpack_from(endian + ("H" if value_type == 3 else "I"), data, entry + 8)[0]
+                                for entry, value_type in dimensions)
+    # 缩放保持宽高比，用长边计算比例，与方向旋转无关
+    scale = max(width, height) / max(source_size) if source_size and max(source_size) else 1.0
+
+    values = {TAG_ORIENTATION: 1, TAG_PIXEL_X_DIMENSION: width, TAG_PIXEL_Y_DIMENSION: height}
+    for tag, value in values.items():
+        entry, value_type = entries.get(tag, (None, None))
+        if value_type == 4 or value_type == 3 and value <= 0xFFFF:
+            struct.pack_into(endian + ("H" if value_type == 3 else "I"), data, entry + 8, value)
+    if scale != 1.0:
+        for tag in (TAG_FOCAL_PLANE_X_RESOLUTION, TAG_FOCAL_PLANE_Y_RESOLUTION):
+            entry, value_type = entries.get(tag, (None, None))
+            if value_type != 5:
+                continue
+            offset = struct.unpack_from(endian + "I", data, entry + 8)[0]
+            if offset + 8 > len(data):
+                continue
+            numerator, denominator = struct.unpack_from(endian + "II", data, offset)
+            # 保留分母，只缩放分子；分子溢出时改用更小的分母
+            numerator = round(numerator * scale)
+            while numerator > 0xFFFFFFFF and denominator > 1:
+                numerator, denominator = round(numerator / 10), max(1, denominator // 10)
+            struct.pack_into(endian + "II", data, offset, min(numerator, 0xFFFFFFFF), denominator)
+    return bytes(data)
+
+
+def read_image_size(path):
+    # 只读取文件头中的宽高，不解码图像；支持 JPEG 与 PNG，失败时返回 None
+    try:
+        with open(path, "rb") as f:
+            header = f.read(24)
+            if header.startswith(b"\x89PNG\r\n\x1a\n") and header[12:16] == b"IHDR":
+                return struct.unpack(">II", header[16:24])
+            if not header.startswith(b"\xff\xd8"):
+                return None
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                length_bytes = f.read(2)
+                if len(length_bytes) < 2:
+                    return None
+                length = struct.unpack(">H", length_bytes)[0]
+                # SOF0-SOF15（不含 DHT、JPG、DAC）中记录了图像尺寸
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">xHH", f.read(5))
+                    return width, height
+                f.seek(length - 2, 1)
+    except OSError:
+        return None
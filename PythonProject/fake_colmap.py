@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import struct
+import sqlite3
+import shutil
+import numpy as np
+import ply_io
+
+# 用于基准测试的 COLMAP 替身：接受与 COLMAP 相同的命令行，输出格式相同的进度行，写出结构正确但内容是合成数据的结果，
+# 不需要 GPU，可以在 Linux 上测量编排开销、输出流处理和断点续跑。行为由环境变量控制：
+#   FAKE_COLMAP_DELAY      每张图像的耗时（秒），默认 0
+#   FAKE_COLMAP_LOG_LINES  每张图像额外输出的日志行数，用于测量输出流处理，默认 0
+#   FAKE_COLMAP_FAIL       命令名（例如 mapper），执行到该命令时以非零状态退出
+#   FAKE_COLMAP_POINTS     稀疏模型的点数，默认每张图像 200 个
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+KEYPOINTS_PER_IMAGE = 1000
+MATCH_NEIGHBORS = 5
+POINT_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+
+
+def parse_options(arguments):
+    return dict(zip(arguments[0::2], arguments[1::2]))
+
+
+def emit_progress(names, template):
+    delay = float(os.environ.get("FAKE_COLMAP_DELAY", 0))
+    log_lines = int(os.environ.get("FAKE_COLMAP_LOG_LINES", 0))
+    total = len(names)
+    for i, name in enumerate(names, start=1):
+        if delay:
+            time.sleep(delay)
+        for j in range(log_lines):
+            print(f"  {name}: iteration {j} residual {1.0 / (j + 1):.6f}")
+        print(template.format(current=i, total=total, name=name), flush=not log_lines)
+    sys.stdout.flush()
+
+
+def list_images(folder, list_path=None):
+    if list_path:
+        with open(list_path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def connect(database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute("CREATE TABLE IF NOT EXISTS cameras (camera_id INTEGER PRIMARY KEY, model INTEGER)")
+    connection.execute("CREATE TABLE IF NOT EXISTS images (image_id INTEGER PRIMARY KEY, name TEXT UNIQUE, "
+                       "camera_id INTEGER)")
+    connection.execute("CREATE TABLE IF NOT EXISTS keypoints (image_id INTEGER PRIMARY KEY, rows INTEGER, "
+                       "cols INTEGER, data BLOB)")
+    for table in ("matches", "two_view_geometries"):
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (pair_id INTEGER PRIMARY KEY, rows INTEGER, "
+                           "cols INTEGER, data BLOB)")
+    return connection
+
+
+def database_images(database_path):
+    connection = connect(database_path)
+    try:
+        return [row[0] for row in connection.execute("SELECT name FROM images ORDER BY image_id")]
+    finally:
+        connection.close()
+
+
+def feature_extractor(options):
+    names = list_images(options["--image_path"], options.get("--image_list_path"))
+    connection = connect(options["--database_path"])
+    with connection:
+        camera_id = options.get("--ImageReader.existing_camera_id")
+        if camera_id is None:
+            camera_id = connection.execute("INSERT INTO cameras (model) VALUES (2)").lastrowid
+        existing = {row[0] for row in connection.execute("SELECT name FROM images")}
+        # 与 COLMAP 相同，已在数据库中的图像不再提取
+        pending = [name for name in names if name not in existing]
+        connection.executemany("INSERT INTO images (name, camera_id) VALUES (?, ?)",
+                               [(name, int(camera_id)) for name in pending])
+        rng = np.random.default_rng(0)
+        keypoints = (rng.random((KEYPOINTS_PER_IMAGE, 2)) * 1000).astype(np.float32).tobytes()
+        connection.execute("INSERT OR IGNORE INTO keypoints (image_id, rows, cols, data) "
+                           "SELECT image_id, ?, 2, ? FROM images", (KEYPOINTS_PER_IMAGE, keypoints))
+    connection.close()
+    emit_progress(pending, "Processed file [{current}/{total}]")
+
+
+def matcher(options):
+    # 每张图像与后面 MATCH_NEIGHBORS 张图像配对，内点数随距离减少
+    names = database_images(options["--database_path"])
+    connection = connect(options["--database_path"])
+    rng = np.random.default_rng(1)
+    rows = []
+    for first in range(1, len(names) + 1):
+        for second in range(first + 1, min(first + MATCH_NEIGHBORS, len(names)) + 1):
+            count = int(rng.integers(20, 200)) // (second - first)
+            matches = rng.integers(0, KEYPOINTS_PER_IMAGE, (count, 2)).astype(np.uint32).tobytes()
+            rows.append((first * 2147483647 + second, count, 2, matches))
+    with connection:
+        for table in ("matches", "two_view_geometries"):
+            connection.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)", rows)
+    connection.close()
+    emit_progress(names, "Matching image [{current}/{total}]")
+
+
+def write_model(folder, names, num_points, seed=0):
+    # 与 COLMAP 二进制模型相同的格式：一台相机、每张图像一个位姿、每个点的轨迹包含 2-5 张图像
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "cameras.bin"), "wb") as f:
+        f.write(struct.pack("<Q", 1))
+        f.write(struct.pack("<iiQQ", 1, 2, 4000, 3000))
+        f.write(struct.pack("<4d", 3000.0, 2000.0, 1500.0, 0.0))
+    observations = [[] for _ in names]
+    tracks = []
+    for point_id in range(1, num_points + 1):
+        length = min(len(names), int(rng.integers(2, 6)))
+        track = []
+        for image in rng.choice(len(names), length, replace=False).tolist():
+            track.append((image + 1, len(observations[image])))
+            observations[image].append(point_id)
+        tracks.append(track)
+    with open(os.path.join(folder, "images.bin"), "wb") as f:
+        f.write(struct.pack("<Q", len(names)))
+        for i, name in enumerate(names):
+            f.write(struct.pack("<i4d3di", i + 1, 1.0, 0.0, 0.0, 0.0, float(i), 0.0, 0.0, 1))
+            f.write(name.encode("utf-8") + b"\0")
+            f.write(struct.pack("<Q", len(observations[i])))
+            for j, point_id in enumerate(observations[i]):
+                f.write(struct.pack("<ddq", float(j), float(j), point_id))
+    xyz = rng.random((num_points, 3)) * [len(names), 10.0, 10.0]
+    rgb = rng.integers(0, 256, (num_points, 3))
+    with open(os.path.join(folder, "points3D.bin"), "wb") as f:
+        f.write(struct.pack("<Q", num_points))
+        for i, track in enumerate(tracks):
+            f.write(struct.pack("<Q3d3Bd", i + 1, *xyz[i], *rgb[i], 0.5))
+            f.write(struct.pack("<Q", len(track)))
+            for image_id, point2D in track:
+                f.write(struct.pack("<ii", image_id, point2D))
+
+
+def mapper(options):
+    names = database_images(options["--database_path"])
+    emit_progress(names, "Registering image #{current} ({current})")
+    output_folder = options["--output_path"]
+    if "--input_path" not in options:
+        output_folder = os.path.join(output_folder, "0")
+    num_points = int(os.environ.get("FAKE_COLMAP_POINTS", 200 * len(names)))
+    write_model(output_folder, names, num_points)
+
+
+def read_model_names(model_folder):
+    from colmap_model import read_images
+    return read_images(os.path.join(model_folder, "images.bin"))[1]
+
+
+def image_undistorter(options):
+    output_folder = options["--output_path"]
+    names = read_model_names(options["--input_path"])
+    # 与 COLMAP 相同，指定图像列表时只为列表中的图像去畸变并写入 patch-match.cfg 和 fusion.cfg
+    if options.get("--image_list_path"):
+        listed = set(list_images(None, options["--image_list_path"]))
+        names = [name for name in names if name in listed] or names
+    images_folder = os.path.join(output_folder, "images")
+    stereo_folder = os.path.join(output_folder, "stereo")
+    for folder in (images_folder, os.path.join(stereo_folder, "depth_maps"), os.path.join(stereo_folder, "normal_maps"),
+                   os.path.join(stereo_folder, "consistency_graphs")):
+        os.makedirs(folder, exist_ok=True)
+    for name in names:
+        source = os.path.join(options["--image_path"], name)
+        target = os.path.join(images_folder, name)
+        if os.path.exists(source) and not os.path.exists(target):
+            shutil.copyfile(source, target)
+    shutil.copytree(options["--input_path"], os.path.join(output_folder, "sparse"), dirs_exist_ok=True)
+    with open(os.path.join(stereo_folder, "patch-match.cfg"), "w", encoding="utf-8") as f:
+        f.write("".join(f"{name}\n__auto__, 20\n" for name in names))
+    with open(os.path.join(stereo_folder, "fusion.cfg"), "w", encoding="utf-8") as f:
+        f.write("".join(f"{name}\n" for name in names))
+    emit_progress(names, "Undistorting image [{current}/{total}]")
+
+
+def patch_match_stereo(options):
+    stereo_folder = os.path.join(options["--workspace_path"], "stereo")
+    with open(os.path.join(stereo_folder, "patch-match.cfg"), "r", encoding="utf-8") as f:
+        names = [line.strip() for line in f if line.strip()][0::2]
+    kind = "geometric" if options.get("--PatchMatchStereo.geom_consistency") == "true" else "photometric"
+    for name in names:
+        for folder in ("depth_maps", "normal_maps"):
+            with open(os.path.join(stereo_folder, folder, f"{name}.{kind}.bin"), "wb") as f:
+                f.write(b"\0" * 64)
+    emit_progress(names, "Processing view {current} / {total}")
+
+
+def stereo_fusion(options):
+    workspace_folder = options["--workspace_path"]
+    with open(os.path.join(workspace_folder, "stereo", "fusion.cfg"), "r", encoding="utf-8") as f:
+        names = [line.strip() for line in f if line.strip()]
+    index = {name: i for i, name in enumerate(read_model_names(os.path.join(workspace_folder, "sparse")))}
+    emit_progress(names, "Fusing image [{current}/{total}]")
+    points_per_image = 1000
+    rng = np.random.default_rng(len(names))
+    vertices = np.zeros(len(names) * points_per_image, dtype=POINT_DTYPE)
+    for axis in "xyz":
+        vertices[axis] = rng.random(len(vertices))
+    output_path = options["--output_path"]
+    ply_io.write_vertices(output_path, vertices)
+    with open(output_path + ".vis", "wb") as f:
+        f.write(struct.pack("<Q", len(vertices)))
+        records = np.empty((len(vertices), 2), dtype="<u4")
+        records[:, 0] = 1
+        records[:, 1] = np.repeat([index[name] for name in names], points_per_image)
+        f.write(records.tobytes())
+
+
+def poisson_mesher(options):
+    # 抽取部分融合点作为顶点，相邻三个顶点组成一个面片，并附带 PoissonRecon 输出的密度属性 value
+    source = ply_io.PlyFile(options["--input_path"])
+    points = np.array(source.vertices[::10])
+    vertices = np.zeros(len(points), dtype=POINT_DTYPE.descr + [("value", "<f4")])
+    for name in POINT_DTYPE.names:
+        vertices[name] = points[name]
+    vertices["value"] = np.random.default_rng(len(points)).random(len(points))
+    first = np.arange(max(0, len(points) - 2))
+    ply_io.write_mesh(options["--output_path"], vertices, np.stack([first, first + 1, first + 2], axis=1))
+    print("Poisson meshing done")
+
+
+def model_converter(options):
+    from colmap_model import SparseModel
+    model = SparseModel(options["--input_path"])
+    vertices = np.zeros(len(model.xyz), dtype=POINT_DTYPE)
+    for i, axis in enumerate("xyz"):
+        vertices[axis] = model.xyz[:, i]
+    ply_io.write_vertices(options["--output_path"], vertices)
+
+
+COMMANDS = {
+    "feature_extractor": feature_extractor,
+    "exhaustive_matcher": matcher,
+    "sequential_matcher": matcher,
+    "spatial_matcher": matcher,
+    "vocab_tree_matcher": matcher,
+    "matches_importer": matcher,
+    "mapper": mapper,
+    "image_undistorter": image_undistorter,
+    "patch_match_stereo": patch_match_stereo,
+    "stereo_fusion": stereo_fusion,
+    "poisson_mesher": poisson_mesher,
+    "model_converter": model_converter,
+}
+
+
+def install(folder):
+    # 生成可作为 colmap_executable 使用的启动脚本
+    os.makedirs(folder, exist_ok=True)
+    script = os.path.abspath(__file__)
+    if os.name == "nt":
+        path = os.path.join(folder, "colmap.bat")
+        with open(path, "w") as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = os.path.join(folder, "colmap")
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"Unknown command: {' '.join(sys.argv[1:2])}", file=sys.stderr)
+        sys.exit(2)
+    command = sys.argv[1]
+    if os.environ.get("FAKE_COLMAP_FAIL") == command:
+        print(f"Injected failure in {command}", file=sys.stderr)
+        sys.exit(1)
+    COMMANDS[command](parse_options(sys.argv[2:]))
@@ -1,48 +1,35 @@
+import os
 import sys
-import subprocess
+import json
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QWidget,
     QFileDialog, QLabel, QLineEdit, QMessageBox, QFrame
 )
-from PySide6.QtCore import Qt, QThread, Signal
+from PySide6.QtCore import Qt, QProcess
 from PySide6.QtGui import QFont, QPalette, QBrush, QLinearGradient, QColor
-from multiprocessing import Manager
 from logging_config import get_logger
+from job_engine import JobEngine, ImageProcessingJob, ReconstructionJob
 
-class Worker(QThread):
-    finished = Signal(str)
-    progress_message = Signal(str)
-
-    def __init__(self, command, progress_queue=None):
-        super().__init__()
-        self.command = command
-        self.progress_queue = progress_queue
-        self.error_message = None
-        self.logger = get_logger(__name__)
-
-    def run(self):
-        process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True)
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                self.progress_message.emit(output.strip())
-                self.logger.info(output.strip())
-        stderr_output = process.stderr.read()
-        if stderr_output:
-            self.progress_message.emit(stderr_output.strip())
-            self.logger.error(stderr_output.strip())
-        exit_code = process.poll()
-        if exit_code != 0:
-            self.error_message = stderr_output.strip()
-        self.finished.emit(self.error_message or "成功")
+CONFIG_PATH = "config.json"
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("三维重建软件")
         self.setGeometry(100, 100, 580, 520)
+        self.logger = get_logger(__name__)
+
+        with open(CONFIG_PATH, "r") as f:
+            self.config = json.load(f)
+        # 任务在界面进程内的线程池中运行，进度和结束通过信号送回界面线程
+        self.engine = JobEngine(parent=self)
+        self.engine.progress.connect(self.update_log)
+        self.engine.finished.connect(self.on_job_finished)
+        # job_id -> (按钮, 按钮原文字, 说明标签, 成功提示)
+        self.jobs = {}
+        self.image_job = None
+        self.reconstruction_job = None
+        self.viewer = None
 
         self.setAutoFillBackground(True)
         palette = QPalette()
@@ -159,6 +146,7 @@ class MainWindow(QMainWindow):
 
         self.image_folder_path = QLineEdit(self)
         self.image_folder_path.setFixedWidth(250)
+        self.image_folder_path.setText(self.config.get("input_folder", ""))
         self.image_folder_layout.addWidget(self.image_folder_path)
 
         self.image_process_layout.addLayout(self.image_folder_layout)
@@ -199,6 +187,7 @@ class MainWindow(QMainWindow):
 
         self.workspace_folder_path = QLineEdit(self)
         self.workspace_folder_path.setFixedWidth(250)
+        self.workspace_folder_path.setText(self.config.get("workspace_folder", ""))
         self.workspace_folder_layout.addWidget(self.workspace_folder_path)
 
         self.workspace_folder_container = QWidget()
@@ -262,67 +251,85 @@ class MainWindow(QMainWindow):
             self.workspace_folder_path.setText(folder)
 
     def process_images(self):
+        # 任务运行中再次点击按钮即取消
+        if self.image_job is not None:
+            self.engine.cancel(self.image_job)
+            return
         image_folder = self.image_folder_path.text()
         if image_folder:
-            manager = Manager()
-            progress_queue = manager.Queue()
-            self.worker = Worker(["python", "ImageProcessor.py"], progress_queue)
-            self.worker.progress_message.connect(self.update_log)
-            self.worker.finished.connect(lambda message: self.on_command_finished(message, "图像录入成功"))
-            self.worker.start()
+            config = dict(self.config, input_folder=image_folder)
+            self.image_job = self.start_job("图像录入", lambda queue: ImageProcessingJob(config, queue),
+                                            self.process_images_button, self.image_process_description, "图像录入成功")
         else:
             self.show_error("请选择图像文件夹")
 
     def run_reconstruction(self):
+        if self.reconstruction_job is not None:
+            self.engine.cancel(self.reconstruction_job)
+            return
         workspace_folder = self.workspace_folder_path.text()
         if workspace_folder:
-            manager = Manager()
-            progress_queue = manager.Queue()
-            self.worker = Worker(["python", "colmapReconstruction.py"], progress_queue)
-            self.worker.progress_message.connect(self.update_log)
-            self.worker.finished.connect(lambda message: self.on_command_finished(message, "三维重建成功"))
-            self.worker.start()
+            os.makedirs(workspace_folder, exist_ok=True)
+            config = dict(self.config, workspace_folder=workspace_folder)
+            if self.image_folder_path.text():
+                config["input_folder"] = self.image_folder_path.text()
+            self.reconstruction_job = self.start_job("三维重建", lambda queue: ReconstructionJob(config, queue),
+                                                     self.reconstruct_button, self.reconstruction_description,
+                                                     "三维重建成功")
         else:
             self.show_error("请选择输出文件夹")
 
+    def start_job(self, name, create, button, description, success_message):
+        job_id = self.engine.submit(name, create)
+        self.jobs[job_id] = (button, button.text(), description, success_message)
+        button.setText("取消")
+        description.setText(f"{name}进行中…")
+        return job_id
+
     def visualize_results(self):
-        self.run_command(["python", "visualization.py"], "欢迎您再次使用！")
-
-    def run_command(self, command, success_message, progress_queue=None, progress_bar=False):
-        if progress_bar:
-            if not hasattr(self, 'worker') or self.worker is None:
-                self.worker = Worker(command, progress_queue)
-                self.worker.progress_message.connect(self.update_log)
-                self.worker.finished.connect(lambda message: self.on_command_finished(message, success_message))
-                self.worker.start()
-            else:
-                self.worker.command = command
-                self.worker.progress_queue = progress_queue
-                self.worker.finished.disconnect()
-                self.worker.finished.connect(lambda message: self.on_command_finished(message, success_message))
-                self.worker.start()
+        # 查看器使用单独的进程，Open3D 窗口不阻塞界面；通过 QProcess 的信号得知结束，不轮询
+        if self.viewer is not None:
+            return
+        workspace_folder = self.workspace_folder_path.text() or self.config["workspace_folder"]
+        self.viewer = QProcess(self)
+        self.viewer.finished.connect(self.on_viewer_finished)
+        self.viewer.start(sys.executable, ["visualization.py", workspace_folder])
+
+    def on_viewer_finished(self, exit_code, exit_status):
+        error = bytes(self.viewer.readAllStandardError()).decode("utf-8", errors="replace").strip()
+        self.viewer = None
+        if exit_code != 0 or exit_status != QProcess.NormalExit:
+            self.show_error(f"错误: {error}")
         else:
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True)
-            while process.poll() is None:
-                if progress_queue and not progress_queue.empty():
-                    message = progress_queue.get()
-                    self.update_log(message)
-            stdout, stderr = process.communicate()
-            if process.returncode != 0:
-                self.show_error(f"错误: {stderr}")
-            else:
-                self.show_message(success_message)
-
-    def update_log(self, message):
-        if "三维重建" in message:
-            print(message)
-
-    def on_command_finished(self, message, success_message):
-        if "成功" in message:
-            self.show_message(success_message)
+            self.show_message("欢迎您再次使用！")
+
+    def update_log(self, job_id, message):
+        if job_id not in self.jobs:
+            return
+        description = self.jobs[job_id][2]
+        if isinstance(message, dict):
+            if message.get("type") == "progress":
+                description.setText(f"{message['stage']}: {message['percent']:.0f}%")
         else:
+            self.logger.info(message)
+            description.setText(message if len(message) <= 40 else message[:37] + "...")
+
+    def on_job_finished(self, job_id, succeeded, message):
+        button, text, description, success_message = self.jobs.pop(job_id)
+        button.setText(text)
+        if job_id == self.image_job:
+            self.image_job = None
+        if job_id == self.reconstruction_job:
+            self.reconstruction_job = None
+        description.setText(success_message if succeeded else message)
+        if succeeded:
+            self.show_message(success_message)
+        elif message != "已取消":
             self.show_error(f"操作失败，请查看日志文件了解详细信息：{message}")
-        self.worker = None
+
+    def closeEvent(self, event):
+        self.engine.shutdown()
+        super().closeEvent(event)
 
     def show_error(self, message):
         error_dialog = QMessageBox(self)
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from collections import OrderedDict
+from logging_config import get_logger
+
+
+class ImageCache:
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_folder, max_bytes):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.logger = get_logger(__name__)
+        self.hits = 0
+        self.misses = 0
+        # (路径, 大小, 修改时间) -> 内容哈希；质量门和增强缓存在同一次运行中共用，每个文件只读一次
+        self.hashes = {}
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self.index = self.load_index()
+
+    def load_index(self):
+        index_path = os.path.join(self.cache_folder, self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return OrderedDict()
+        try:
+            with open(index_path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Cache index unreadable, starting empty: {e}")
+            return OrderedDict()
+        # 按最近使用时间排序，最久未使用的在最前面
+        return OrderedDict(sorted(entries.items(), key=lambda item: item[1]["last_used"]))
+
+    def save_index(self):
+        index_path = os.path.join(self.cache_folder, self.INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, index_path)
+
+    @staticmethod
+    def file_hash(path, chunk_size=1024 * 1024):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def content_hash(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        memo_key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = self.hashes.get(memo_key)
+        if digest is None:
+            digest = self.hashes[memo_key] = self.file_hash(path)
+        return digest
+
+    def load_records(self, name):
+        # 按内容哈希保存的小型分析结果（例如质量门的清晰度和 pHash），与缓存的图像放在同一目录
+        path = os.path.join(self.cache_folder, f"{name}.json")
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Cache records {name} unreadable, starting empty: {e}")
+            return {}
+
+    def save_records(self, name, records, max_records=100000):
+        # 只保留最近写入的 max_records 条
+        if len(records) > max_records:
+            records = dict(list(records.items())[-max_records:])
+        path = os.path.join(self.cache_folder, f"{name}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(records, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def fingerprint(params):
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def make_key(self, source_path, params_fingerprint):
+        ext = os.path.splitext(source_path)[1].lower()
+        digest = hashlib.sha256(f"{self.content_hash(source_path)}:{params_fingerprint}".encode("utf-8"))
+        return digest.hexdigest() + ext
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_folder, key[:2], key)
+
+    def restore(self, key, output_path):
+        entry_path = self.entry_path(key)
+        if key not in self.index or not os.path.exists(entry_path):
+            self.index.pop(key, None)
+            self.misses += 1
+            return False
+        # 输出文件已经是缓存文件的硬链接时直接跳过
+        if not (os.path.exists(output_path) and os.path.samefile(entry_path, output_path)):
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            self.link_or_copy(entry_path, output_path)
+        self.touch(key)
+        self.hits += 1
+        return True
+
+    def store(self, key, output_path):
+        entry_path = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        if os.path.lexists(entry_path):
+            os.remove(entry_path)
+        self.link_or_copy(output_path, entry_path)
+        self.index[key] = {"size": os.path.getsize(entry_path), "last_used": time.time()}
+        self.index.move_to_end(key)
+
+    def touch(self, key):
+        self.index[key]["last_used"] = time.time()
+        self.index.move_to_end(key)
+
+    @staticmethod
+    def link_or_copy(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def evict(self):
+        total = self.total_bytes()
+        evicted = 0
+        while total > self.max_bytes and self.index:
+            key, entry = self.index.popitem(last=False)
+            try:
+                os.remove(self.entry_path(key))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            evicted += 1
+        if evicted:
+            self.logger.debug(f"Evicted {evicted} cache entries, cache size now {total} bytes")
+        return evicted
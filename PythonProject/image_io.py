@@ -0,0 +1,100 @@
+import os
+import zlib
+import struct
+import numpy as np
+import cv2
+from exif_utils import read_exif_segment, read_image_size, update_exif
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+IMAGE_IO_DEFAULTS = {
+    # source 保持输入的文件名和格式；jpg 统一输出 JPEG；png 为无损输出
+    "output_format": "source",
+    "jpeg_quality": 95,
+    "png_compression": 1,
+    # 需要缩小时由 libjpeg 直接按 1/2、1/4、1/8 解码，不先解码全分辨率
+    "reduced_decode": True,
+    # 把输入的 EXIF（相机型号、焦距等）写入输出，COLMAP 据此得到焦距先验
+    "preserve_exif": True,
+}
+
+OUTPUT_EXTENSIONS = {"jpg": ".jpg", "png": ".png"}
+
+REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def list_images(folder, extensions=IMAGE_EXTENSIONS):
+    # scandir 的目录项自带文件类型，大文件夹中不需要逐个 stat
+    with os.scandir(folder) as entries:
+        return [entry.name for entry in entries if entry.name.lower().endswith(extensions) and entry.is_file()]
+
+
+def is_jpeg(path):
+    return path.lower().endswith((".jpg", ".jpeg"))
+
+
+def reduced_flag(path, max_megapixels):
+    # 选择缩小后仍不低于 max_megapixels 的最大缩小倍数，剩余部分再由 INTER_AREA 缩小
+    if not max_megapixels or not is_jpeg(path):
+        return cv2.IMREAD_COLOR
+    size = read_image_size(path)
+    if size is None:
+        return cv2.IMREAD_COLOR
+    width, height = size
+    for factor, flag in REDUCED_FLAGS:
+        if (width // factor) * (height // factor) >= max_megapixels * 1e6:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(path, flags=cv2.IMREAD_COLOR):
+    # 先读入字节再解码，Windows 上非 ASCII 路径也能读取；与 cv2.imread 一样，读取失败时返回 None
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, flags)
+
+
+def read_image(path, max_megapixels=0):
+    return decode_image(path, reduced_flag(path, max_megapixels))
+
+
+def read_metadata(path):
+    # 返回 EXIF 的 TIFF 数据，PNG 输入或没有 EXIF 时返回 None
+    return read_exif_segment(path) if is_jpeg(path) else None
+
+
+def encode_image(image, extension, options, exif=None, source_size=None):
+    if exif is not None:
+        height, width = image.shape[:2]
+        exif = update_exif(exif, width, height, source_size)
+    if extension == ".png":
+        ok, buffer = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, options["png_compression"]])
+        if not ok:
+            raise IOError("Failed to encode PNG")
+        data = buffer.tobytes()
+        if exif:
+            # eXIf 块放在 IHDR 之后、图像数据之前
+            chunk = struct.pack(">I", len(exif)) + b"eXIf" + exif + struct.pack(">I", zlib.crc32(b"eXIf" + exif))
+            data = data[:33] + chunk + data[33:]
+        return data
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, options["jpeg_quality"]])
+    if not ok:
+        raise IOError("Failed to encode JPEG")
+    data = buffer.tobytes()
+    if exif and len(exif) + 8 <= 0xFFFF:
+        # APP1 放在 OpenCV 写入的 JFIF APP0 段之后
+        segment = b"\xff\xe1" + struct.pack(">H", len(exif) + 8) + b"Exif\x00\x00" + exif
+        position = 2
+        if data[2:4] == b"\xff\xe0":
+            position = 4 + struct.unpack(">H", data[4:6])[0]
+        data = data[:position] + segment + data[position:]
+    return data
+
+
+def write_image(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
@@ -0,0 +1,107 @@
+import os
+import queue
+import threading
+from logging_config import get_logger
+
+_STOP = object()
+
+
+class ImagePipeline:
+    # 解码 -> 增强 -> 编码 三个阶段由有界队列连接，OpenCV 在计算时释放 GIL，线程即可并行
+    def __init__(self, decode, enhance, encode, enhance_workers=None, encode_workers=1,
+                 max_in_flight=None, queue_size=2):
+        self.enhance_workers = enhance_workers or os.cpu_count() or 1
+        self.encode_workers = encode_workers
+        self.stages = [
+            ("decode", decode, 1),
+            ("enhance", enhance, self.enhance_workers),
+            ("encode", encode, self.encode_workers),
+        ]
+        # 同时处于流水线中的图像数量上限，决定峰值内存
+        self.max_in_flight = max_in_flight or 2 * self.enhance_workers
+        self.queue_size = queue_size
+        self.logger = get_logger(__name__)
+
+    def run(self, items):
+        # 按完成顺序产出 (item, result, error)，类似 imap_unordered
+        stop = threading.Event()
+        budget = threading.Semaphore(self.max_in_flight)
+        results = queue.Queue()
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        queues.append(results)
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], budget, stop), daemon=True)]
+        for index, (name, func, workers) in enumerate(self.stages):
+            remaining = [workers]
+            lock = threading.Lock()
+            for _ in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(name, func, queues[index], queues[index + 1], results, remaining, lock, stop),
+                    daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                entry = results.get()
+                if entry is _STOP:
+                    break
+                budget.release()
+                yield entry
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=1)
+
+    @staticmethod
+    def _put(target, entry, stop):
+        while not stop.is_set():
+            try:
+                target.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(source, stop):
+        while not stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    def _feed(self, items, target, budget, stop):
+        for item in items:
+            while not budget.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            if not self._put(target, (item, item), stop):
+                return
+        self._put(target, _STOP, stop)
+
+    def _work(self, name, func, source, target, results, remaining, lock, stop):
+        while True:
+            entry = self._get(source, stop)
+            if entry is _STOP:
+                # 同一阶段的其他线程也需要收到结束信号
+                self._put(source, _STOP, stop)
+                break
+            item, payload = entry
+            try:
+                output = func(item, payload)
+            except Exception as e:
+                self.logger.debug(f"Stage {name} failed for {item}: {e}")
+                self._put(results, (item, None, e), stop)
+                continue
+            if target is results:
+                self._put(results, (item, output, None), stop)
+            else:
+                self._put(target, (item, output), stop)
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            self._put(target, _STOP, stop)
@@ -0,0 +1,279 @@
+import os
+import json
+import shutil
+import sqlite3
+import logging
+import numpy as np
+from multiprocessing import Queue
+from colmapReconstruction import ColmapReconstructor
+from combined_pipeline import FeatureBatcher
+from ImageProcessor import ImageProcessor
+from checkpoint import StageCheckpoint
+from colmap_model import SparseModel, read_images
+from pair_generation import ordered_pair, write_pair_list
+
+INCREMENTAL_DEFAULTS = {
+    # 与新图像共视点数不少于该值的已有图像也需要重新计算深度图
+    "min_shared_points": 30,
+    # 已有图像不超过该数量时新图像与所有图像配对，否则只与外观或拍摄时间最接近的图像配对
+    "exhaustive_max_images": 500,
+    "process_images": True,
+    # 注册新图像时光束法平差会移动已有图像的位姿；相机中心移动超过场景尺度的该比例、
+    # 或旋转超过该角度的已有图像，其深度图按新位姿重新计算
+    "pose_tolerance": 0.005,
+    "rotation_tolerance_degrees": 0.1,
+}
+
+
+def database_image_names(database_path):
+    connection = sqlite3.connect(database_path)
+    try:
+        return {row[0] for row in connection.execute("SELECT name FROM images")}
+    finally:
+        connection.close()
+
+
+def read_patch_match_config(path):
+    # patch-match.cfg 每两行一组：参考图像名、源图像设置（例如 "__auto__, 20"）
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.rstrip("\r\n") for line in f if line.strip()]
+    return [(lines[i], lines[i + 1]) for i in range(0, len(lines) - 1, 2)]
+
+
+def write_patch_match_config(path, entries):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(f"{name}\n{sources}\n" for name, sources in entries))
+
+
+def read_fusion_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def write_fusion_config(path, names):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(f"{name}\n" for name in names))
+
+
+def image_poses(model_folder):
+    # 返回 {图像名: (qvec, tvec)}；只复制位姿，不保留对 images.bin 的内存映射，COLMAP 随后可以覆盖该文件
+    images, names, _ = read_images(os.path.join(model_folder, "images.bin"))
+    return {name: (images["qvec"][i].copy(), images["tvec"][i].copy()) for i, name in enumerate(names)}
+
+
+def camera_centers(qvecs, tvecs):
+    # COLMAP 位姿为世界到相机的变换，相机中心为 -R^T t
+    w, x, y, z = (qvecs / np.linalg.norm(qvecs, axis=1, keepdims=True)).T
+    rotations = np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=1),
+    ], axis=1)
+    return -np.einsum("nji,nj->ni", rotations, tvecs)
+
+
+def moved_images(before, after, pose_tolerance, rotation_tolerance_degrees):
+    # 比较注册前后同一图像的位姿，返回位姿变化超过容差的图像名
+    names = [name for name in before if name in after]
+    if not names:
+        return set()
+    q0 = np.array([before[name][0] for name in names])
+    t0 = np.array([before[name][1] for name in names])
+    q1 = np.array([after[name][0] for name in names])
+    t1 = np.array([after[name][1] for name in names])
+    centers0, centers1 = camera_centers(q0, t0), camera_centers(q1, t1)
+    # 场景尺度取相机中心到其中位点的中位距离，容差与模型的任意尺度无关
+    scale = np.median(np.linalg.norm(centers1 - np.median(centers1, axis=0), axis=1)) or 1.0
+    shift = np.linalg.norm(centers1 - centers0, axis=1)
+    dot = np.abs(np.sum(q0 / np.linalg.norm(q0, axis=1, keepdims=True) *
+                        q1 / np.linalg.norm(q1, axis=1, keepdims=True), axis=1))
+    angle = np.degrees(2 * np.arccos(np.clip(dot, 0.0, 1.0)))
+    moved = (shift > pose_tolerance * scale) | (angle > rotation_tolerance_degrees)
+    return {name for name, flag in zip(names, moved.tolist()) if flag}
+
+
+class IncrementalReconstructor:
+    # 在已有模型上追加新图像：只为新图像提取特征、只匹配涉及新图像的图像对、在原模型上继续注册，
+    # 并且只重新计算新图像及其共视邻居的深度图
+    def __init__(self, config, progress_queue=None):
+        self.config = config
+        self.reconstructor = ColmapReconstructor(config, progress_queue)
+        self.progress_queue = progress_queue
+        self.options = dict(INCREMENTAL_DEFAULTS, **config.get("incremental", {}))
+        workspace_folder = self.reconstructor.workspace_folder
+        self.database_path = os.path.join(workspace_folder, "database.db")
+        self.sparse_folder = os.path.join(workspace_folder, "sparse")
+        self.model_folder = os.path.join(self.sparse_folder, "0")
+        self.dense_folder = os.path.join(workspace_folder, "dense")
+        self.incremental_folder = os.path.join(workspace_folder, "incremental")
+
+    def notify(self, message):
+        logging.debug(message)
+        if self.progress_queue:
+            self.progress_queue.put(message)
+
+    def run(self):
+        # 先处理 input_folder 中新增的照片，已有图像直接从增强缓存恢复
+        if self.options["process_images"]:
+            ImageProcessor(self.config, self.progress_queue).process_images()
+        if not os.path.exists(self.database_path) or not os.path.exists(os.path.join(self.model_folder, "images.bin")):
+            self.notify("No existing model found, running the full reconstruction")
+            return self.reconstructor.run_stages(self.reconstructor.build_stages())
+
+        existing = database_image_names(self.database_path)
+        new_images = [name for name in self.reconstructor.list_images() if name not in existing]
+        if not new_images:
+            self.notify("No new images, the model is up to date")
+            return True
+        self.notify(f"Incremental update: {len(new_images)} new images, {len(existing)} existing")
+        os.makedirs(self.incremental_folder, exist_ok=True)
+        checkpoint = StageCheckpoint(self.reconstructor.workspace_folder)
+
+        with self.reconstructor.instrumented("incremental"):
+            try:
+                # 增量更新在阶段流程之外修改数据库、模型和稠密工作区，先使所有阶段清单失效，
+                # 之后的完整重建不会按过期的指纹跳过阶段
+                checkpoint.invalidate_all()
+                self.extract_features(new_images)
+                self.match_new_images(new_images, sorted(existing))
+                before = image_poses(self.model_folder)
+                self.register_new_images(len(existing) + len(new_images))
+                moved = moved_images(before, image_poses(self.model_folder), self.options["pose_tolerance"],
+                                     self.options["rotation_tolerance_degrees"])
+                changed = self.changed_images(new_images, moved)
+                self.update_dense(changed)
+                # 数据库中所有图像的特征与完整提取的结果相同，特征提取阶段可以记录为最新；
+                # 匹配和建图只处理了新图像，之后的完整重建会重新运行这些阶段
+                extraction = self.reconstructor.feature_extraction_stage(self.database_path)
+                checkpoint.record(extraction.description, extraction.command, extraction.inputs, extraction.outputs)
+            except (RuntimeError, OSError, ValueError) as e:
+                # 读取模型、patch-match.cfg 或替换文件出错时同样要上报，GUI 依赖该 [ERROR] 消息
+                logging.error(f"Incremental update failed with error: {e}")
+                self.notify(f"[ERROR] Incremental update failed with error: {e}")
+                return False
+        return True
+
+    def extract_features(self, new_images):
+        stage = self.reconstructor.feature_extraction_stage(self.database_path)
+        batcher = FeatureBatcher(self.reconstructor, stage, self.incremental_folder)
+        # 新图像使用已有模型的相机
+        if batcher.single_camera:
+            batcher.camera_id = batcher.read_camera_id()
+        batcher.extract(new_images)
+
+    def candidate_pairs(self, new_images, existing):
+        new_set = set(new_images)
+        names = existing + new_images
+        if len(existing) <= self.options["exhaustive_max_images"]:
+            return {ordered_pair(new, other) for new in new_images for other in names if other != new}
+        # 大数据集：沿用匹配配置中的候选对生成方式，只保留至少包含一张新图像的图像对
+        pairs = self.reconstructor.generate_pairs(sorted(names))
+        return {pair for pair in pairs if pair[0] in new_set or pair[1] in new_set}
+
+    def match_new_images(self, new_images, existing):
+        pairs = self.candidate_pairs(new_images, existing)
+        pairs_path = os.path.join(self.incremental_folder, "match_pairs.txt")
+        write_pair_list(pairs, pairs_path)
+        self.notify(f"Matching {len(pairs)} pairs involving new images")
+        self.reconstructor.run_command([
+            self.reconstructor.colmap_executable, "matches_importer",
+            "--database_path", self.database_path,
+            "--match_list_path", pairs_path,
+            "--match_type", "pairs"
+        ], "Incremental Matching")
+
+    def register_new_images(self, total_images):
+        # 以已有模型为起点继续注册新图像，结果写回 sparse/0；固定相机内参，
+        # 已有的去畸变图像和未移动图像的深度图因此仍然有效
+        stage = self.reconstructor.sparse_reconstruction_stage(self.database_path, self.sparse_folder)
+        command = list(stage.command)
+        command[command.index("--output_path") + 1] = self.model_folder
+        for option in ("--Mapper.ba_refine_focal_length", "--Mapper.ba_refine_principal_point",
+                       "--Mapper.ba_refine_extra_params"):
+            command[command.index(option) + 1] = "0"
+        command += ["--input_path", self.model_folder]
+        self.reconstructor.run_command(command, "Incremental Registration", total_images)
+
+    def changed_images(self, new_images, moved=()):
+        model = SparseModel(self.model_folder)
+        names = dict(zip(model.images["image_id"].tolist(), model.image_names))
+        new_set = set(new_images)
+        registered = {image_id for image_id, name in names.items() if name in new_set}
+        if len(registered) < len(new_images):
+            self.notify(f"{len(new_images) - len(registered)} new images could not be registered")
+        # 新图像和位姿移动的已有图像都要重新计算深度图，它们作为源图像的共视邻居也一样
+        seeds = registered | {image_id for image_id, name in names.items() if name in moved}
+        if len(seeds) > len(registered):
+            self.notify(f"{len(seeds) - len(registered)} existing images moved during registration")
+        changed = set(seeds)
+        pairs, counts = model.covisibility()
+        strong = counts >= self.options["min_shared_points"]
+        for first, second in pairs[strong].tolist():
+            if first in seeds:
+                changed.add(second)
+            if second in seeds:
+                changed.add(first)
+        self.notify(f"{len(changed)} images need new depth maps ({len(registered)} new)")
+        return sorted(names[image_id] for image_id in changed if image_id in names)
+
+    def undistort_new_images(self, undistortion, stereo_folder):
+        # 内参固定时已去畸变的图像仍然有效，只为还没有去畸变图像的注册图像运行 image_undistorter；
+        # 稠密工作区的 sparse 模型仍按所有图像的新位姿重写
+        config_path = os.path.join(stereo_folder, "patch-match.cfg")
+        fusion_path = os.path.join(stereo_folder, "fusion.cfg")
+        old_config = read_patch_match_config(config_path) if os.path.exists(config_path) else []
+        old_fusion = read_fusion_config(fusion_path) if os.path.exists(fusion_path) else []
+        names = read_images(os.path.join(self.model_folder, "images.bin"))[1]
+        images_folder = os.path.join(self.dense_folder, "images")
+        pending = [name for name in names if not os.path.exists(os.path.join(images_folder, name))]
+        list_path = os.path.join(self.incremental_folder, "undistort_images.txt")
+        write_fusion_config(list_path, pending)
+        self.notify(f"Undistorting {len(pending)} of {len(names)} images")
+        self.reconstructor.run_command(undistortion.command_for() + ["--image_list_path", list_path],
+                                       undistortion.description)
+        # 按列表去畸变时 patch-match.cfg 和 fusion.cfg 只包含列表中的图像，与原有配置合并为全部注册图像
+        registered = set(names)
+        new_config = read_patch_match_config(config_path)
+        config = [entry for entry in old_config if entry[0] in registered and entry[0] not in pending]
+        config += [entry for entry in new_config if entry[0] in pending]
+        fusion = [name for name in old_fusion if name in registered and name not in pending]
+        fusion += [name for name in read_fusion_config(fusion_path) if name in pending]
+        write_patch_match_config(config_path, config)
+        write_fusion_config(fusion_path, fusion)
+        return config
+
+    def update_dense(self, changed):
+        undistortion, stereo, fusion, meshing = self.reconstructor.dense_stages(self.model_folder, self.dense_folder)
+        stereo_folder = os.path.join(self.dense_folder, "stereo")
+        config_path = os.path.join(stereo_folder, "patch-match.cfg")
+        full_config = self.undistort_new_images(undistortion, stereo_folder)
+        shutil.copyfile(config_path, config_path + ".full")
+        changed_set = set(changed)
+        # 写入裁剪后的配置或删除旧结果失败时，同样恢复完整的 patch-match.cfg
+        try:
+            write_patch_match_config(config_path, [entry for entry in full_config if entry[0] in changed_set])
+            # 已存在的深度图会被 patch_match_stereo 跳过，先删除需要重新计算的图像的旧结果
+            for name in changed:
+                for folder in ("depth_maps", "normal_maps"):
+                    for kind in ("photometric", "geometric"):
+                        path = os.path.join(stereo_folder, folder, f"{name}.{kind}.bin")
+                        if os.path.exists(path):
+                            os.remove(path)
+            self.reconstructor.run_command(stereo.command_for(), stereo.description)
+        finally:
+            os.replace(config_path + ".full", config_path)
+
+        # 融合会合并所有图像的深度图中相互对应的点，网格化以融合点云为输入，这两步仍然整体运行
+        self.reconstructor.run_command(fusion.command_for(), fusion.description)
+        self.reconstructor.run_command(meshing.command_for(), meshing.description)
+        if self.reconstructor.mesh_postprocess["enabled"]:
+            self.reconstructor.mesh_postprocess_stage(self.dense_folder).action()
+
+
+if __name__ == "__main__":
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    progress_queue = Queue()
+    reconstructor = IncrementalReconstructor(config, progress_queue)
+    reconstructor.run()
+    print("Incremental reconstruction completed.")
@@ -0,0 +1,266 @@
+import os
+import csv
+import json
+import time
+import socket
+import threading
+from contextlib import contextmanager
+from logging_config import get_logger
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGE_FIELDS = ["name", "kind", "status", "wall_seconds", "cpu_seconds", "peak_rss_bytes",
+                "read_bytes", "write_bytes"]
+IMAGE_FIELDS = ["name", "status", "wall_seconds", "decode_seconds", "enhance_seconds", "encode_seconds",
+                "cpu_seconds", "read_bytes", "write_bytes"]
+
+
+# 当前进程中正在运行的外部命令阶段；RUSAGE_CHILDREN 是进程级统计，阶段重叠时无法区分归属
+_active_commands = set()
+_active_lock = threading.Lock()
+
+
+def children_rusage():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+class TreeSampler:
+    # 后台线程定期采样进程树（根进程及其所有子进程）的内存、CPU 时间和磁盘读写
+    def __init__(self, pid, interval):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        # 按 pid 保存最后一次看到的累计值，进程退出后仍保留其贡献
+        self.cpu = {}
+        self.io = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.sample()
+        self.stop_event.set()
+        self.thread.join(timeout=self.interval * 2)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        try:
+            root = psutil.Process(self.pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return
+        rss = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    times = process.cpu_times()
+                    self.cpu[process.pid] = times.user + times.system
+                    if hasattr(process, "io_counters"):
+                        counters = process.io_counters()
+                        self.io[process.pid] = (counters.read_bytes, counters.write_bytes)
+            except psutil.Error:
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def totals(self):
+        read_bytes = sum(value[0] for value in self.io.values()) if self.io else None
+        write_bytes = sum(value[1] for value in self.io.values()) if self.io else None
+        return sum(self.cpu.values()), read_bytes, write_bytes
+
+
+class StageProbe:
+    def __init__(self, name, kind, interval):
+        self.name = name
+        self.kind = kind
+        self.interval = interval
+        self.sampler = None
+        self.overlapped = False
+        self.record = {"name": name, "kind": kind, "status": "ok"}
+
+    def attach(self, pid):
+        # 外部命令启动后调用，开始采样该子进程树
+        if psutil is not None:
+            self.sampler = TreeSampler(pid, self.interval)
+            self.sampler.start()
+
+
+class Instrumentation:
+    def __init__(self, report_folder, run_name, sample_interval=0.5, prometheus_path=None):
+        self.report_folder = report_folder
+        self.run_name = run_name
+        self.sample_interval = sample_interval
+        self.prometheus_path = prometheus_path
+        self.started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.run_id = time.strftime("%Y%m%d_%H%M%S")
+        self.stages = []
+        self.images = []
+        self.lock = threading.Lock()
+        self.logger = get_logger(__name__)
+        if psutil is None:
+            self.logger.debug("psutil not installed, RSS and disk I/O come from rusage where available")
+
+    @contextmanager
+    def stage(self, name, kind="command"):
+        probe = StageProbe(name, kind, self.sample_interval)
+        wall_start = time.perf_counter()
+        usage_start = children_rusage()
+        cpu_start = time.process_time()
+        own_sampler = None
+        if kind == "command":
+            with _active_lock:
+                if _active_commands:
+                    probe.overlapped = True
+                    for other in _active_commands:
+                        other.overlapped = True
+                _active_commands.add(probe)
+        if kind != "command" and psutil is not None:
+            own_sampler = TreeSampler(os.getpid(), self.sample_interval)
+            own_sampler.start()
+        try:
+            yield probe
+        except BaseException:
+            probe.record["status"] = "failed"
+            raise
+        finally:
+            record = probe.record
+            record["wall_seconds"] = round(time.perf_counter() - wall_start, 3)
+            if kind == "command":
+                with _active_lock:
+                    _active_commands.discard(probe)
+            sampler = probe.sampler or own_sampler
+            if sampler is not None:
+                sampler.stop()
+                cpu, read_bytes, write_bytes = sampler.totals()
+                record["peak_rss_bytes"] = sampler.peak_rss
+                record["read_bytes"] = read_bytes
+                record["write_bytes"] = write_bytes
+            elif kind == "command":
+                # 没有采样器时退回 rusage，但它统计的是本进程所有已回收子进程，只在命令串行执行时才属于本阶段
+                usage_end = children_rusage()
+                if usage_start is not None and usage_end is not None and not probe.overlapped:
+                    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+                    # Linux 上 ru_maxrss 单位为 KB，是迄今最大单个子进程的驻留内存；仅在本阶段内增长时才归属本阶段
+                    if usage_end.ru_maxrss > usage_start.ru_maxrss:
+                        record["peak_rss_bytes"] = usage_end.ru_maxrss * 1024
+                    else:
+                        record["peak_rss_bytes"] = None
+                else:
+                    cpu = None
+                    record["peak_rss_bytes"] = None
+            if kind != "command":
+                cpu = time.process_time() - cpu_start
+            record["cpu_seconds"] = round(cpu, 3) if cpu is not None else None
+            with self.lock:
+                self.stages.append(record)
+            self.logger.debug(f"Stage {name}: {record}")
+
+    def record_image(self, record):
+        with self.lock:
+            self.images.append(record)
+
+    def summary(self):
+        return {
+            "run": self.run_name,
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "host": {"hostname": socket.gethostname(), "cpu_count": os.cpu_count()},
+            "stages": self.stages,
+            "images": self.images,
+        }
+
+    def write_report(self):
+        os.makedirs(self.report_folder, exist_ok=True)
+        base = os.path.join(self.report_folder, f"{self.run_name}_{self.run_id}")
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=4, ensure_ascii=False)
+        self.write_csv(base + "_stages.csv", STAGE_FIELDS, self.stages)
+        if self.images:
+            self.write_csv(base + "_images.csv", IMAGE_FIELDS, self.images)
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+        return base + ".json"
+
+    @staticmethod
+    def write_csv(path, fields, rows):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def write_prometheus(self, path):
+        # Prometheus 文本格式，可由 node_exporter 的 textfile collector 采集
+        metrics = [
+            ("wall_seconds", "gauge", "Wall-clock time of the stage"),
+            ("cpu_seconds", "gauge", "CPU time of the stage"),
+            ("peak_rss_bytes", "gauge", "Peak resident memory of the stage process tree"),
+            ("read_bytes", "gauge", "Bytes read from disk by the stage"),
+            ("write_bytes", "gauge", "Bytes written to disk by the stage"),
+        ]
+        lines = []
+        for field, metric_type, description in metrics:
+            metric = f"reconstruction_stage_{field}"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for record in self.stages:
+                if record.get(field) is None:
+                    continue
+                stage = record["name"].replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{metric}{{run="{self.run_name}",stage="{stage}"}} {record[field]}')
+        if self.images:
+            lines.append("# HELP reconstruction_images_processed_total Images processed in the run")
+            lines.append("# TYPE reconstruction_images_processed_total gauge")
+            lines.append(f'reconstruction_images_processed_total{{run="{self.run_name}"}} {len(self.images)}')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+
+class ImageTimer:
+    # 记录每张图像在解码、增强、编码各阶段的耗时和线程 CPU 时间，各阶段可能在不同线程中执行
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name, phase):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        with self.lock:
+            entry = self.pending.setdefault(name, {"name": name, "status": "ok", "start": wall_start,
+                                                   "cpu_seconds": 0.0, "read_bytes": 0, "write_bytes": 0})
+        try:
+            yield entry
+        except BaseException:
+            entry["status"] = "failed"
+            raise
+        finally:
+            entry[f"{phase}_seconds"] = round(time.perf_counter() - wall_start, 4)
+            entry["cpu_seconds"] += time.thread_time() - cpu_start
+
+    def finish(self, name):
+        with self.lock:
+            entry = self.pending.pop(name, None)
+        if entry is None:
+            return
+        entry["wall_seconds"] = round(time.perf_counter() - entry.pop("start"), 4)
+        entry["cpu_seconds"] = round(entry["cpu_seconds"], 4)
+        self.instrumentation.record_image(entry)
@@ -0,0 +1,120 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QObject, Signal
+from logging_config import get_logger
+
+
+class SignalQueue:
+    # 代替 progress_queue 传给 ImageProcessor / ColmapReconstructor：put 直接发出 Qt 信号，
+    # 跨线程的信号由 Qt 排队到界面线程处理，界面不需要轮询
+    def __init__(self, engine, job_id):
+        self.engine = engine
+        self.job_id = job_id
+
+    def put(self, message):
+        self.engine.progress.emit(self.job_id, message)
+
+
+class Job:
+    def __init__(self, job_id, name, create):
+        self.id = job_id
+        self.name = name
+        # create(progress_queue) 返回带有 run() 和 cancel() 的对象，在工作线程中创建，配置错误也作为任务失败报告
+        self.create = create
+        self.runner = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.future = None
+
+
+class JobEngine(QObject):
+    # 在界面进程内的常驻线程池中运行任务：OpenCV、NumPy 等模块只导入一次，所选文件夹通过配置直接传入；
+    # OpenCV 和 COLMAP 子进程在计算时不占用 GIL，界面保持响应
+    started = Signal(int, str)
+    progress = Signal(int, object)
+    finished = Signal(int, bool, str)
+
+    def __init__(self, max_workers=2, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.logger = get_logger(__name__)
+
+    def submit(self, name, create):
+        job = Job(next(self.ids), name, create)
+        self.jobs[job.id] = job
+        job.future = self.executor.submit(self.run_job, job)
+        return job.id
+
+    def run_job(self, job):
+        self.started.emit(job.id, job.name)
+        try:
+            runner = job.create(SignalQueue(self, job.id))
+            with job.lock:
+                job.runner = runner
+                cancelled = job.cancelled
+            if cancelled:
+                runner.cancel()
+            succeeded = runner.run() is not False
+        except Exception as e:
+            self.logger.exception(f"Job {job.id} ({job.name}) failed")
+            self.finished.emit(job.id, False, str(e))
+            return
+        finally:
+            self.jobs.pop(job.id, None)
+        if job.cancelled:
+            self.finished.emit(job.id, False, "已取消")
+        elif succeeded:
+            self.finished.emit(job.id, True, "成功")
+        else:
+            self.finished.emit(job.id, False, "任务失败，请查看日志")
+
+    def is_running(self, job_id):
+        return job_id in self.jobs
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        with job.lock:
+            job.cancelled = True
+            runner = job.runner
+        # 还在排队的任务直接取消；已开始的任务由 runner 终止子进程或停止取新图像
+        if job.future.cancel():
+            self.jobs.pop(job_id, None)
+            self.finished.emit(job_id, False, "已取消")
+        elif runner is not None:
+            runner.cancel()
+        return True
+
+    def shutdown(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        self.executor.shutdown(wait=True)
+
+
+class ImageProcessingJob:
+    def __init__(self, config, progress_queue):
+        from ImageProcessor import ImageProcessor
+        self.processor = ImageProcessor(config, progress_queue)
+
+    def run(self):
+        self.processor.process_images()
+        return not self.processor.cancel_event.is_set()
+
+    def cancel(self):
+        self.processor.cancel()
+
+
+class ReconstructionJob:
+    def __init__(self, config, progress_queue):
+        from colmapReconstruction import ColmapReconstructor
+        self.reconstructor = ColmapReconstructor(config, progress_queue)
+
+    def run(self):
+        return self.reconstructor.run_stages(self.reconstructor.build_stages())
+
+    def cancel(self):
+        self.reconstructor.cancel()
@@ -0,0 +1,228 @@
+import os
+import json
+import struct
+import logging
+import numpy as np
+import ply_io
+
+MESH_POSTPROCESS_DEFAULTS = {
+    "enabled": False,
+    # 删除含有泊松密度最低的这部分顶点的面片；网格没有密度属性时跳过
+    "trim_quantile": 0.05,
+    # 最长边超过全部边长中位数这么多倍的面片视为低密度区域的伪表面，0 表示不按边长裁剪
+    "max_edge_ratio": 10.0,
+    # 面片数超过该值时用二次误差简化到该值
+    "target_faces": 2000000,
+    # 同时输出 glTF 二进制文件供其他程序使用
+    "export_glb": False,
+    # glTF 使用 KHR_mesh_quantization：位置量化为 16 位整数、法线为 8 位整数，顶点数少于 65536 时序号为 16 位
+    "glb_quantize": True,
+}
+
+# PoissonRecon 的 --density 输出和 SurfaceTrimmer 使用的顶点密度属性名
+DENSITY_PROPERTIES = ("value", "density")
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+
+def trim_faces(xyz, faces, density, quantile, max_edge_ratio):
+    # 返回保留面片的布尔掩码
+    keep = np.ones(len(faces), dtype=bool)
+    if density is not None and quantile > 0 and len(density):
+        low = density < np.quantile(density, quantile)
+        keep &= ~low[faces].any(axis=1)
+    if max_edge_ratio > 0 and len(faces):
+        corners = xyz[faces]
+        lengths = np.linalg.norm(corners - np.roll(corners, 1, axis=1), axis=2)
+        keep &= lengths.max(axis=1) <= max_edge_ratio * np.median(lengths)
+    return keep
+
+
+def decimate(xyz, colors, faces, target_faces):
+    # 二次误差简化由 Open3D 完成，只有需要简化时才导入
+    import open3d as o3d
+    mesh = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(xyz), o3d.utility.Vector3iVector(faces.astype(np.int32)))
+    if colors is not None:
+        mesh.vertex_colors = o3d.utility.Vector3dVector(colors / 255.0)
+    mesh = mesh.simplify_quadric_decimation(int(target_faces))
+    if colors is not None:
+        colors = np.clip(np.asarray(mesh.vertex_colors) * 255 + 0.5, 0, 255)
+    return np.asarray(mesh.vertices), colors, np.asarray(mesh.triangles, dtype=np.int64)
+
+
+def remove_unreferenced_vertices(faces, count):
+    # 返回保留的原顶点序号和重新编号后的面片；同时去掉有重复顶点的退化面片
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    used = np.unique(faces)
+    remap = np.full(count, -1, dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    return used, remap[faces]
+
+
+def vertex_normals(xyz, faces):
+    # 面法线的长度为面积的两倍，直接累加即为按面积加权
+    corners = xyz[faces]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    normals = np.zeros_like(xyz)
+    for axis in range(3):
+        for corner in range(3):
+            normals[:, axis] += np.bincount(faces[:, corner], weights=face_normals[:, axis], minlength=len(xyz))
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+
+def write_glb(path, xyz, normals, colors, faces, quantize=True):
+    # 单个网格的 glTF 2.0 二进制文件：float 位置和法线、uchar 颜色、uint 序号；
+    # quantize 时按 KHR_mesh_quantization 存为 uint16 位置（由节点的平移和缩放还原）、int8 法线和尽量短的序号，
+    # 体积约为未量化时的一半，不依赖额外的压缩库和解码器
+    binary = bytearray()
+    buffer_views = []
+    accessors = []
+
+    def add(array, target, accessor, stride=None):
+        data = np.ascontiguousarray(array).tobytes()
+        view = {"buffer": 0, "byteOffset": len(binary), "byteLength": len(data), "target": target}
+        if stride:
+            view["byteStride"] = stride
+        buffer_views.append(view)
+        binary.extend(data + b"\x00" * (-len(data) % 4))
+        accessors.append(dict(accessor, bufferView=len(buffer_views) - 1))
+        return len(accessors) - 1
+
+    node = {"mesh": 0}
+    if quantize:
+        low = xyz.min(axis=0)
+        extent = xyz.max(axis=0) - low
+        extent[extent == 0] = 1.0
+        # 顶点属性的每个元素需按 4 字节对齐：三个分量后补一个填充分量
+        positions = np.zeros((len(xyz), 4), dtype="<u2")
+        positions[:, :3] = np.round((xyz - low) / extent * 65535)
+        packed_normals = np.zeros((len(normals), 4), dtype="i1")
+        packed_normals[:, :3] = np.round(np.clip(normals, -1, 1) * 127)
+        normalized = positions[:, :3] / 65535.0
+        attributes = {
+            "POSITION": add(positions, ARRAY_BUFFER, {"componentType": 5123, "normalized": True,
+                                                      "count": len(positions), "type": "VEC3",
+                                                      "min": normalized.min(axis=0).tolist(),
+                                                      "max": normalized.max(axis=0).tolist()}, stride=8),
+            "NORMAL": add(packed_normals, ARRAY_BUFFER, {"componentType": 5120, "normalized": True,
+                                                         "count": len(normals), "type": "VEC3"}, stride=4),
+        }
+        node.update(translation=low.tolist(), scale=extent.tolist())
+    else:
+        positions = xyz.astype("<f4")
+        attributes = {
+            "POSITION": add(positions, ARRAY_BUFFER, {"componentType": 5126, "count": len(positions), "type": "VEC3",
+                                                      "min": positions.min(axis=0).tolist(),
+                                                      "max": positions.max(axis=0).tolist()}),
+            "NORMAL": add(normals.astype("<f4"), ARRAY_BUFFER, {"componentType": 5126, "count": len(normals),
+                                                                "type": "VEC3"}),
+        }
+    if colors is not None:
+        # 顶点属性需按 4 字节对齐，颜色补上不透明的 alpha
+        rgba = np.concatenate([colors.astype(np.uint8), np.full((len(colors), 1), 255, np.uint8)], axis=1)
+        attributes["COLOR_0"] = add(rgba, ARRAY_BUFFER, {"componentType": 5121, "normalized": True,
+                                                         "count": len(rgba), "type": "VEC4"})
+    if quantize and len(xyz) < 65536:
+        indices = add(faces.astype("<u2").ravel(), ELEMENT_ARRAY_BUFFER,
+                      {"componentType": 5123, "count": faces.size, "type": "SCALAR"})
+    else:
+        indices = add(faces.astype("<u4").ravel(), ELEMENT_ARRAY_BUFFER,
+                      {"componentType": 5125, "count": faces.size, "type": "SCALAR"})
+    document = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [node],
+        "meshes": [{"primitives": [{"attributes": attributes, "indices": indices, "mode": 4}]}],
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": buffer_views,
+        "accessors": accessors,
+    }
+    if quantize:
+        document["extensionsUsed"] = document["extensionsRequired"] = ["KHR_mesh_quantization"]
+    content = json.dumps(document, separators=(",", ":")).encode("utf-8")
+    content += b" " * (-len(content) % 4)
+    total = 12 + 8 + len(content) + 8 + len(binary)
+    with open(path + ".tmp", "wb") as f:
+        f.write(struct.pack("<III", GLB_MAGIC, 2, total))
+        f.write(struct.pack("<II", len(content), GLB_JSON_CHUNK) + content)
+        f.write(struct.pack("<II", len(binary), GLB_BIN_CHUNK) + bytes(binary))
+    os.replace(path + ".tmp", path)
+    return path
+
+
+class MeshPostProcessor:
+    # 泊松网格后处理：裁剪低密度面片、简化到面片预算、删除未引用的顶点并预先计算法线，
+    # 写出紧凑的二进制 PLY（可选 glTF），查看器直接使用其中的法线
+    def __init__(self, mesh_path, output_path, options, glb_path=None, progress_queue=None):
+        self.mesh_path = mesh_path
+        self.output_path = output_path
+        self.glb_path = glb_path
+        self.options = dict(MESH_POSTPROCESS_DEFAULTS, **options)
+        self.progress_queue = progress_queue
+
+    def notify(self, message):
+        logging.debug(message)
+        if self.progress_queue:
+            self.progress_queue.put(message)
+
+    def run(self, threads=None):
+        ply = ply_io.PlyFile(self.mesh_path)
+        faces = ply.faces
+        if faces is None or not len(faces):
+            raise ValueError(f"{self.mesh_path} has no faces")
+        faces = np.asarray(faces, dtype=np.int64)
+        if faces.shape[1] != 3:
+            raise ValueError(f"Only triangle meshes are supported, {self.mesh_path} has {faces.shape[1]}-gons")
+        vertices = ply.vertices
+        names = vertices.dtype.names
+        xyz = ply_io.positions(vertices)
+        colors = None
+        if all(name in names for name in ("red", "green", "blue")):
+            colors = np.stack([vertices["red"], vertices["green"], vertices["blue"]], axis=1).astype(np.float64)
+        density = next((np.asarray(vertices[name], dtype=np.float64) for name in DENSITY_PROPERTIES
+                        if name in names), None)
+        source_faces = len(faces)
+        if density is None and self.options["trim_quantile"] > 0:
+            # COLMAP 的 poisson_mesher 不输出密度属性，只有 PoissonRecon 自带的工具会写出
+            self.notify(f"{self.mesh_path} has no density property ({', '.join(DENSITY_PROPERTIES)}), "
+                        f"skipping density trimming; faces are trimmed by edge length only")
+
+        faces = faces[trim_faces(xyz, faces, density, self.options["trim_quantile"], self.options["max_edge_ratio"])]
+        trimmed = source_faces - len(faces)
+        target_faces = self.options["target_faces"]
+        if target_faces and len(faces) > target_faces:
+            used, faces = remove_unreferenced_vertices(faces, len(xyz))
+            xyz, colors, faces = decimate(xyz[used], None if colors is None else colors[used], faces, target_faces)
+        used, faces = remove_unreferenced_vertices(faces, len(xyz))
+        if not len(faces):
+            raise ValueError(f"No faces left in {self.mesh_path} after trimming")
+        xyz = xyz[used]
+        colors = None if colors is None else colors[used]
+        normals = vertex_normals(xyz, faces)
+
+        fields = [(name, "<f4") for name in ("x", "y", "z", "nx", "ny", "nz")]
+        if colors is not None:
+            fields += [(name, "u1") for name in ("red", "green", "blue")]
+        output = np.empty(len(xyz), dtype=fields)
+        for i, name in enumerate("xyz"):
+            output[name] = xyz[:, i]
+            output["n" + name] = normals[:, i]
+        if colors is not None:
+            for i, name in enumerate(("red", "green", "blue")):
+                output[name] = colors[:, i]
+        ply_io.write_mesh(self.output_path, output, faces)
+        if self.glb_path:
+            write_glb(self.glb_path, xyz, normals, colors, faces, self.options["glb_quantize"])
+
+        source_size = os.path.getsize(self.mesh_path)
+        output_size = os.path.getsize(self.output_path)
+        self.notify(f"Mesh post-processing: {source_faces} -> {len(faces)} faces ({trimmed} trimmed), "
+                    f"{len(ply)} -> {len(xyz)} vertices, {source_size / 2 ** 20:.1f} -> "
+                    f"{output_size / 2 ** 20:.1f} MB. Output: {self.output_path}")
+        return self.output_path
@@ -0,0 +1,78 @@
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from image_io import decode_image
+
+DESCRIPTOR_SIZE = 32
+HISTOGRAM_BINS = 8
+
+
+def global_descriptor(path):
+    # 全局描述子：缩小灰度图的归一化外观 + HSV 颜色直方图，用于快速找出可能重叠的图像
+    image = decode_image(path, cv2.IMREAD_REDUCED_COLOR_8)
+    if image is None:
+        return None
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (DESCRIPTOR_SIZE, DESCRIPTOR_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    thumbnail -= thumbnail.mean()
+    thumbnail /= np.linalg.norm(thumbnail) + 1e-6
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    histogram = cv2.calcHist([hsv], [0, 1, 2], None, [HISTOGRAM_BINS] * 3, [0, 180, 0, 256, 0, 256]).ravel()
+    histogram = np.sqrt(histogram / (histogram.sum() + 1e-6))
+    descriptor = np.concatenate([thumbnail.ravel(), histogram])
+    return descriptor / (np.linalg.norm(descriptor) + 1e-6)
+
+
+def pairs_from_descriptors(folder, names, k=20, workers=None, block_size=1024):
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        descriptors = list(executor.map(global_descriptor, [os.path.join(folder, name) for name in names]))
+    valid = [i for i, descriptor in enumerate(descriptors) if descriptor is not None]
+    if len(valid) < 2:
+        return set()
+    matrix = np.stack([descriptors[i] for i in valid]).astype(np.float32)
+    k = min(k, len(valid) - 1)
+    pairs = set()
+    # 分块计算余弦相似度，避免一次生成 N x N 矩阵
+    for start in range(0, len(valid), block_size):
+        similarity = matrix[start:start + block_size] @ matrix.T
+        rows = np.arange(similarity.shape[0])
+        similarity[rows, rows + start] = -np.inf
+        neighbors = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        for row, columns in zip(rows, neighbors):
+            for column in columns:
+                pairs.add(ordered_pair(names[valid[start + row]], names[valid[column]]))
+    return pairs
+
+
+def pairs_from_timestamps(names, timestamps, window_seconds=10.0, min_neighbors=5):
+    # 拍摄时间相近的图像视为候选对；时间窗口内不足 min_neighbors 时补足时间上最近的若干张
+    valid = [(timestamps[i], names[i]) for i in range(len(names)) if timestamps[i] is not None]
+    if len(valid) < 2:
+        return set()
+    valid.sort()
+    times = np.array([stamp for stamp, _ in valid])
+    ordered_names = [name for _, name in valid]
+    window_end = np.searchsorted(times, times + window_seconds, side="right")
+    pairs = set()
+    for i in range(len(valid)):
+        end = max(window_end[i], min(i + 1 + min_neighbors, len(valid)))
+        for j in range(i + 1, end):
+            pairs.add(ordered_pair(ordered_names[i], ordered_names[j]))
+    return pairs
+
+
+def ordered_pair(first, second):
+    return (first, second) if first < second else (second, first)
+
+
+def write_pair_list(pairs, path):
+    # 内容不变时不重写文件，保持修改时间不变，断点续跑才不会误判为输入变化
+    content = "".join(f"{first} {second}\n" for first, second in sorted(pairs))
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return True
@@ -0,0 +1,361 @@
+import os
+import sys
+import json
+import numpy as np
+from logging_config import get_logger
+
+# PLY 属性类型 -> NumPy 类型（不含字节序）
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+NUMPY_TYPES = {"i1": "char", "u1": "uchar", "i2": "short", "u2": "ushort", "i4": "int", "u4": "uint",
+               "f4": "float", "f8": "double"}
+ENDIANNESS = {"binary_little_endian": "<", "binary_big_endian": ">"}
+# 写入时顶点数先占位，写完后回填，宽度足够容纳任何 64 位计数
+COUNT_WIDTH = 20
+DEFAULT_CHUNK = 1 << 20
+
+
+class PlyElement:
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+        # 普通属性为 (名称, 类型)，列表属性为 (名称, 计数类型, 元素类型)
+        self.properties = []
+
+    def dtype(self, endian, list_length=None):
+        fields = []
+        for prop in self.properties:
+            if len(prop) == 2:
+                fields.append((prop[0], endian + PLY_TYPES[prop[1]]))
+            else:
+                if list_length is None:
+                    raise ValueError(f"Element {self.name} has a list property, its length must be known")
+                fields.append((prop[0] + "_count", endian + PLY_TYPES[prop[1]]))
+                fields.append((prop[0], endian + PLY_TYPES[prop[2]], (list_length,)))
+        return np.dtype(fields)
+
+    def has_list(self):
+        return any(len(prop) == 3 for prop in self.properties)
+
+
+def read_header(path):
+    elements = []
+    fmt = None
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"Not a PLY file: {path}")
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"PLY header is not terminated: {path}")
+            words = line.decode("ascii", errors="ignore").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "format":
+                fmt = words[1]
+            elif words[0] == "element":
+                elements.append(PlyElement(words[1], int(words[2])))
+            elif words[0] == "property":
+                if words[1] == "list":
+                    elements[-1].properties.append((words[4], words[2], words[3]))
+                else:
+                    elements[-1].properties.append((words[2], words[1]))
+            elif words[0] == "end_header":
+                return fmt, elements, f.tell()
+
+
+class PlyFile:
+    # 二进制 PLY 的零拷贝访问：顶点和（等长的）面片块直接内存映射为结构化数组
+    def __init__(self, path):
+        self.path = path
+        self.format, self.elements, self.header_size = read_header(path)
+        if self.format not in ENDIANNESS:
+            raise ValueError(f"Only binary PLY files are supported, got {self.format}: {path}")
+        self.endian = ENDIANNESS[self.format]
+        self.arrays = {}
+        self.map_elements()
+
+    def element(self, name):
+        for element in self.elements:
+            if element.name == name:
+                return element
+        return None
+
+    def map_elements(self):
+        # 列表属性（面片的顶点索引）按第一条记录的长度映射，随后校验所有记录等长
+        raw = np.memmap(self.path, dtype=np.uint8, mode="r")
+        offset = self.header_size
+        for element in self.elements:
+            list_length = None
+            if element.has_list():
+                if element.count == 0:
+                    list_length = 0
+                else:
+                    if len(element.properties) != 1:
+                        # 含多个属性的变长元素无法直接映射，之后的元素也无法定位
+                        break
+                    count_type = np.dtype(self.endian + PLY_TYPES[element.properties[0][1]])
+                    list_length = int(np.frombuffer(raw, count_type, 1, offset)[0])
+            dtype = element.dtype(self.endian, list_length)
+            array = np.ndarray((element.count,), dtype=dtype, buffer=raw, offset=offset)
+            if element.has_list() and element.count:
+                counts = array[element.properties[0][0] + "_count"]
+                if not all((counts[start:start + DEFAULT_CHUNK] == list_length).all()
+                           for start in range(0, element.count, DEFAULT_CHUNK)):
+                    break
+            self.arrays[element.name] = array
+            offset += dtype.itemsize * element.count
+
+    @property
+    def vertices(self):
+        return self.arrays["vertex"]
+
+    @property
+    def faces(self):
+        element = self.element("face")
+        if element is None:
+            return None
+        if "face" not in self.arrays:
+            raise ValueError(f"Faces in {self.path} are not all the same size and cannot be memory-mapped")
+        return self.arrays["face"][element.properties[0][0]]
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def iter_chunks(self, element="vertex", chunk_size=DEFAULT_CHUNK):
+        array = self.arrays[element]
+        for start in range(0, len(array), chunk_size):
+            yield array[start:start + chunk_size]
+
+
+def positions(chunk):
+    return np.stack([chunk["x"], chunk["y"], chunk["z"]], axis=1).astype(np.float64)
+
+
+def color_histogram(values):
+    # 颜色属性可能是 uchar、ushort 或 [0, 1] 范围的 float，都统计为 256 个区间
+    if values.dtype == np.uint8:
+        return np.bincount(values, minlength=256)
+    if np.issubdtype(values.dtype, np.floating):
+        value_range = (0.0, 1.0)
+    else:
+        value_range = (0, np.iinfo(values.dtype).max + 1)
+    return np.histogram(values, bins=256, range=value_range)[0]
+
+
+def statistics(ply, chunk_size=DEFAULT_CHUNK):
+    # 分块统计点数、包围盒、中心和颜色直方图
+    count = 0
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    total = np.zeros(3)
+    colors = [name for name in ("red", "green", "blue") if name in ply.vertices.dtype.names]
+    histograms = {name: np.zeros(256, dtype=np.int64) for name in colors}
+    for chunk in ply.iter_chunks(chunk_size=chunk_size):
+        xyz = positions(chunk)
+        count += len(xyz)
+        low = np.minimum(low, xyz.min(axis=0))
+        high = np.maximum(high, xyz.max(axis=0))
+        total += xyz.sum(axis=0)
+        for name in colors:
+            histograms[name] += color_histogram(chunk[name])
+    result = {"vertices": count, "faces": len(ply.arrays["face"]) if "face" in ply.arrays else 0}
+    if count:
+        result.update({"bounds_min": low.tolist(), "bounds_max": high.tolist(), "centroid": (total / count).tolist()})
+    if colors:
+        result["color_histogram"] = {name: histogram.tolist() for name, histogram in histograms.items()}
+    return result
+
+
+class PlyWriter:
+    # 流式写入顶点：先写占位的计数，逐块追加数据，关闭时回填真实数量
+    def __init__(self, path, dtype, comments=()):
+        self.path = path
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.count = 0
+        self.file = open(path + ".tmp", "wb")
+        header = ["ply", "format binary_little_endian 1.0"]
+        header += [f"comment {comment}" for comment in comments]
+        header.append("element vertex ")
+        self.count_offset = len("\n".join(header).encode("ascii"))
+        header[-1] += " " * COUNT_WIDTH
+        for name in self.dtype.names:
+            base = self.dtype.fields[name][0]
+            if base.shape:
+                raise ValueError(f"Vertex property {name} must be a scalar")
+            header.append(f"property {NUMPY_TYPES[base.str[1:]]} {name}")
+        header.append("end_header")
+        self.file.write(("\n".join(header) + "\n").encode("ascii"))
+
+    def write(self, chunk):
+        if len(chunk):
+            self.file.write(np.asarray(chunk, dtype=self.dtype).tobytes())
+            self.count += len(chunk)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.seek(self.count_offset)
+        self.file.write(str(self.count).ljust(COUNT_WIDTH).encode("ascii"))
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_vertices(path, vertices, chunk_size=DEFAULT_CHUNK):
+    with PlyWriter(path, vertices.dtype) as writer:
+        for start in range(0, len(vertices), chunk_size):
+            writer.write(vertices[start:start + chunk_size])
+    return path
+
+
+def write_mesh(path, vertices, faces, comments=()):
+    # 三角网格：顶点为结构化数组，面片为 N x 3 的顶点序号，以 uchar 计数 + int 序号的列表属性写出
+    dtype = np.dtype(vertices.dtype).newbyteorder("<")
+    header = ["ply", "format binary_little_endian 1.0"]
+    header += [f"comment {comment}" for comment in comments]
+    header.append(f"element vertex {len(vertices)}")
+    for name in dtype.names:
+        header.append(f"property {NUMPY_TYPES[dtype.fields[name][0].str[1:]]} {name}")
+    header += [f"element face {len(faces)}", "property list uchar int vertex_indices", "end_header"]
+    records = np.empty(len(faces), dtype=[("count", "u1"), ("indices", "<i4", (3,))])
+    records["count"] = 3
+    records["indices"] = faces
+    with open(path + ".tmp", "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(np.asarray(vertices, dtype=dtype).tobytes())
+        f.write(records.tobytes())
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def filter_file(source, destination, keep, chunk_size=DEFAULT_CHUNK):
+    # keep(chunk) 返回布尔掩码；逐块读取、筛选、写出，内存只与块大小有关
+    ply = PlyFile(source)
+    with PlyWriter(destination, ply.vertices.dtype) as writer:
+        for chunk in ply.iter_chunks(chunk_size=chunk_size):
+            writer.write(chunk[keep(chunk)])
+    return writer.count
+
+
+def crop(source, destination, bounds_min, bounds_max, chunk_size=DEFAULT_CHUNK):
+    low = np.asarray(bounds_min, dtype=np.float64)
+    high = np.asarray(bounds_max, dtype=np.float64)
+
+    def inside(chunk):
+        xyz = positions(chunk)
+        return ((xyz >= low) & (xyz <= high)).all(axis=1)
+
+    return filter_file(source, destination, inside, chunk_size)
+
+
+def voxel_keys(xyz, origin, voxel_size):
+    # 体素坐标打包成一个 int64，每轴 21 位
+    cells = np.floor((xyz - origin) / voxel_size).astype(np.int64)
+    if len(cells) and (cells.min() < 0 or cells.max() >= 1 << 21):
+        raise ValueError(f"Voxel size {voxel_size} is too small for the extent of the cloud")
+    return cells[:, 0] << 42 | cells[:, 1] << 21 | cells[:, 2]
+
+
+class VoxelAccumulator:
+    # 按体素累加所有属性求平均；内存与输出的体素数成正比，与输入点数无关
+    def __init__(self, dtype, origin, voxel_size):
+        self.dtype = np.dtype(dtype)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.voxel_size = voxel_size
+        self.keys = np.empty(0, dtype=np.int64)
+        self.sums = np.empty((0, len(self.dtype.names)))
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def add(self, chunk):
+        if not len(chunk):
+            return
+        keys = voxel_keys(positions(chunk), self.origin, self.voxel_size)
+        merged, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        old, new = inverse[:len(self.keys)], inverse[len(self.keys):]
+        sums = np.zeros((len(merged), len(self.dtype.names)))
+        sums[old] = self.sums
+        for column, name in enumerate(self.dtype.names):
+            sums[:, column] += np.bincount(new, weights=chunk[name], minlength=len(merged))
+        counts = np.zeros(len(merged), dtype=np.int64)
+        counts[old] = self.counts
+        counts += np.bincount(new, minlength=len(merged))
+        self.keys, self.sums, self.counts = merged, sums, counts
+
+    def result(self):
+        means = self.sums / np.maximum(self.counts, 1)[:, None]
+        output = np.empty(len(self.keys), dtype=self.dtype)
+        for column, name in enumerate(self.dtype.names):
+            if output.dtype.fields[name][0].kind in "iu":
+                output[name] = np.rint(means[:, column])
+            else:
+                output[name] = means[:, column]
+        return output
+
+
+def voxel_downsample(chunks, dtype, origin, voxel_size):
+    accumulator = VoxelAccumulator(dtype, origin, voxel_size)
+    for chunk in chunks:
+        accumulator.add(chunk)
+    return accumulator.result()
+
+
+def voxel_downsample_file(source, destination, voxel_size, chunk_size=DEFAULT_CHUNK):
+    ply = PlyFile(source)
+    origin = statistics(ply, chunk_size).get("bounds_min", [0.0, 0.0, 0.0])
+    result = voxel_downsample(ply.iter_chunks(chunk_size=chunk_size), ply.vertices.dtype, origin, voxel_size)
+    write_vertices(destination, result)
+    return len(result)
+
+
+def remove_sparse_outliers(source, destination, voxel_size, min_points=3, chunk_size=DEFAULT_CHUNK):
+    # 两遍扫描：先统计每个体素及其 26 邻域的点数，再丢弃邻域内点数不足 min_points 的孤立点
+    ply = PlyFile(source)
+    if not len(ply):
+        return filter_file(source, destination, lambda chunk: np.ones(len(chunk), dtype=bool), chunk_size)
+    origin = np.asarray(statistics(ply, chunk_size)["bounds_min"]) - voxel_size
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    for chunk in ply.iter_chunks(chunk_size=chunk_size):
+        chunk_keys, chunk_counts = np.unique(voxel_keys(positions(chunk), origin, voxel_size), return_counts=True)
+        merged, inverse = np.unique(np.concatenate([keys, chunk_keys]), return_inverse=True)
+        keys, counts = merged, np.bincount(inverse, weights=np.concatenate([counts, chunk_counts])).astype(np.int64)
+
+    # 邻域计数按占据的体素计算一次，之后每个点只需查找所在体素
+    neighborhood = np.zeros(len(keys), dtype=np.int64)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                # 原点向外扩了一个体素，邻居坐标不会越界借位
+                neighbor = keys + (dx << 42) + (dy << 21) + dz
+                index = np.minimum(np.searchsorted(keys, neighbor), len(keys) - 1)
+                neighborhood += np.where(keys[index] == neighbor, counts[index], 0)
+    dense_keys = keys[neighborhood >= min_points]
+
+    def dense(chunk):
+        # 邻域计数包含该点自身
+        return np.isin(voxel_keys(positions(chunk), origin, voxel_size), dense_keys)
+
+    return filter_file(source, destination, dense, chunk_size)
+
+
+if __name__ == "__main__":
+    get_logger(__name__).info(f"Reading {sys.argv[1]}")
+    print(json.dumps({key: value for key, value in statistics(PlyFile(sys.argv[1])).items()
+                      if key != "color_histogram"}, indent=4))
@@ -0,0 +1,131 @@
+import os
+import json
+import argparse
+import threading
+import numpy as np
+from multiprocessing import Queue
+from logging_config import get_logger
+from colmap_model import SparseModel
+from colmapReconstruction import ColmapReconstructor, ReconstructionStage
+import ply_io
+
+PREVIEW_DEFAULTS = {
+    # 预览使用 preview 参数档位（缩小图像、限制特征数），另外可覆盖单个参数
+    "options": {},
+    "sequential_overlap": 10,
+    # 预览完成后在后台启动完整质量的重建
+    "full_pass": True,
+}
+
+POINT_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                        ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+
+
+def export_sparse_points(model_folder, ply_path):
+    model = SparseModel(model_folder)
+    vertices = np.empty(len(model.xyz), dtype=POINT_DTYPE)
+    for i, axis in enumerate("xyz"):
+        vertices[axis] = model.xyz[:, i]
+    for i, channel in enumerate(("red", "green", "blue")):
+        vertices[channel] = model.rgb[:, i]
+    ply_io.write_vertices(ply_path, vertices)
+    return len(vertices)
+
+
+class PreviewReconstructor:
+    # 只做特征提取、顺序匹配和稀疏重建，把 points3D 导出为 PLY，几分钟内就能检查拍摄是否有问题；
+    # 预览使用单独的 workspace/preview 工作区，不影响完整重建的断点续跑
+    def __init__(self, config, progress_queue=None):
+        self.config = config
+        self.progress_queue = progress_queue
+        self.options = dict(PREVIEW_DEFAULTS, **config.get("preview", {}))
+        self.preview_folder = os.path.join(config["workspace_folder"], "preview")
+        os.makedirs(self.preview_folder, exist_ok=True)
+        preview_config = dict(config, workspace_folder=self.preview_folder)
+        preview_config["profile"] = dict(config.get("profile", {}), name="preview", options=self.options["options"])
+        preview_config["matching"] = dict(config.get("matching", {}), strategy="sequential",
+                                          sequential_overlap=self.options["sequential_overlap"])
+        self.reconstructor = ColmapReconstructor(preview_config, progress_queue)
+        self.database_path = os.path.join(self.preview_folder, "database.db")
+        self.sparse_folder = os.path.join(self.preview_folder, "sparse")
+        self.ply_path = os.path.join(self.preview_folder, "sparse.ply")
+        self.full_thread = None
+        # 后台完整重建的结果：None 表示未运行或未结束
+        self.full_succeeded = None
+        self.logger = get_logger(__name__)
+
+    def notify(self, message):
+        self.logger.info(message)
+        if self.progress_queue:
+            self.progress_queue.put(message)
+
+    def build_stages(self):
+        os.makedirs(self.sparse_folder, exist_ok=True)
+        model_folder = os.path.join(self.sparse_folder, "0")
+        return [
+            self.reconstructor.feature_extraction_stage(self.database_path),
+            self.reconstructor.matching_stage(self.database_path),
+            self.reconstructor.sparse_reconstruction_stage(self.database_path, self.sparse_folder),
+            ReconstructionStage("Sparse Point Export", ["export_sparse_points", model_folder, self.ply_path],
+                                inputs=[model_folder], outputs=[self.ply_path], resource="io", action=self.export),
+        ]
+
+    def export(self, threads=None):
+        count = export_sparse_points(os.path.join(self.sparse_folder, "0"), self.ply_path)
+        self.notify(f"Exported {count} sparse points to {self.ply_path}")
+
+    def run(self):
+        if not self.reconstructor.run_stages(self.build_stages()):
+            return False
+        self.notify(f"Preview ready: {self.ply_path}")
+        if self.options["full_pass"]:
+            self.start_full_pass()
+        return True
+
+    def start_full_pass(self):
+        self.full_thread = threading.Thread(target=self.run_full_pass, daemon=True)
+        self.full_thread.start()
+        return self.full_thread
+
+    def run_full_pass(self):
+        # 构建阶段本身可能较慢（例如为候选图像对计算描述子），也放在后台线程中；
+        # 预览档位的特征参数与完整档位不同，完整重建使用自己的数据库重新提取特征
+        self.notify("Full-quality reconstruction started in the background")
+        try:
+            full = ColmapReconstructor(self.config, self.progress_queue)
+            self.full_succeeded = full.run_stages(full.build_stages())
+        except Exception as e:
+            self.logger.exception("Full-quality reconstruction failed")
+            self.full_succeeded = False
+            self.notify(f"[ERROR] Full-quality reconstruction failed with error: {e}")
+            return
+        if self.full_succeeded:
+            self.notify("Full-quality reconstruction completed")
+        else:
+            self.notify("[ERROR] Full-quality reconstruction failed, see the reconstruction log")
+
+
+if __name__ == "__main__":
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    parser = argparse.ArgumentParser(description="Quick sparse preview, then the full reconstruction in the background")
+    parser.add_argument("--view", action="store_true", help="open the preview point cloud while the full pass runs")
+    parser.add_argument("--no-full-pass", action="store_true")
+    args = parser.parse_args()
+    if args.no_full_pass:
+        config["preview"] = dict(config.get("preview", {}), full_pass=False)
+
+    progress_queue = Queue()
+    preview = PreviewReconstructor(config, progress_queue)
+    if preview.run():
+        print(f"Preview point cloud: {preview.ply_path}")
+        if args.view:
+            from visualization import visualize_ply
+            # 稀疏点云没有面片，用 LOD 查看器按点云显示
+            visualize_ply(preview.ply_path, lod=True)
+        if preview.full_thread:
+            preview.full_thread.join()
+            if preview.full_succeeded:
+                print("3D reconstruction process completed.")
+            else:
+                print("3D reconstruction process failed.")
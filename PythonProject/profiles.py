@@ -0,0 +1,223 @@
+import os
+import json
+import shutil
+import argparse
+from statistics import median
+from exif_utils import read_image_size
+from image_io import list_images
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+GB = 1024 ** 3
+
+PROFILE_DEFAULTS = {
+    # preview / balanced / max / auto；缺省为 max，与引入参数档位之前的命令行一致
+    "name": "max",
+    # auto 模式选择预计耗时不超过该小时数的最高档位
+    "time_budget_hours": 12,
+    # 是否有可用于 COLMAP 的 CUDA GPU："auto" 时检测 nvidia-smi
+    "gpu": "auto",
+    # 覆盖档位中的单个参数，例如 {"PatchMatchStereo.max_image_size": "3000"}
+    "options": {},
+}
+
+# 各档位的 COLMAP 参数；值为 None 表示不传该参数，使用 COLMAP 默认值
+PROFILES = {
+    "preview": {
+        "SiftExtraction.max_image_size": "1600",
+        "SiftExtraction.max_num_features": "4096",
+        "SiftExtraction.estimate_affine_shape": "false",
+        "SiftExtraction.domain_size_pooling": "false",
+        "ExhaustiveMatching.block_size": "50",
+        "PatchMatchStereo.geom_consistency": "false",
+        "PatchMatchStereo.window_radius": "4",
+        "PatchMatchStereo.num_iterations": "3",
+        "PatchMatchStereo.max_image_size": "1200",
+        "StereoFusion.max_image_size": "1200",
+        "StereoFusion.check_num_images": "5",
+        "PoissonMeshing.depth": "10",
+    },
+    "balanced": {
+        "SiftExtraction.max_image_size": None,
+        "SiftExtraction.max_num_features": "8192",
+        "SiftExtraction.estimate_affine_shape": "false",
+        "SiftExtraction.domain_size_pooling": "true",
+        "ExhaustiveMatching.block_size": "50",
+        "PatchMatchStereo.geom_consistency": "true",
+        "PatchMatchStereo.window_radius": "5",
+        "PatchMatchStereo.num_iterations": "5",
+        "PatchMatchStereo.max_image_size": "2000",
+        "StereoFusion.max_image_size": "2000",
+        "StereoFusion.check_num_images": "7",
+        "PoissonMeshing.depth": "11",
+    },
+    "max": {
+        "SiftExtraction.max_image_size": None,
+        "SiftExtraction.max_num_features": "200000",
+        "SiftExtraction.estimate_affine_shape": "true",
+        "SiftExtraction.domain_size_pooling": "true",
+        "ExhaustiveMatching.block_size": "200",
+        "PatchMatchStereo.geom_consistency": "true",
+        "PatchMatchStereo.window_radius": "9",
+        "PatchMatchStereo.num_iterations": "7",
+        "PatchMatchStereo.max_image_size": "4000",
+        "StereoFusion.max_image_size": None,
+        "StereoFusion.check_num_images": "7",
+        "PoissonMeshing.depth": None,
+    },
+}
+# auto 模式从高到低尝试的顺序
+PROFILE_ORDER = ("max", "balanced", "preview")
+
+# 运行时间模型的系数，按常见硬件上的 COLMAP 运行记录粗略标定，只用于量级估计
+SIFT_CPU_SECONDS_PER_MEGAPIXEL = 0.5  # 单核
+SIFT_GPU_SECONDS_PER_MEGAPIXEL = 0.05
+FEATURES_PER_MEGAPIXEL = 1500
+MATCH_CPU_SECONDS_PER_PAIR = 0.05  # 单核，8192 个特征
+MATCH_GPU_SECONDS_PER_PAIR = 0.005
+MAPPER_SECONDS_COEFFICIENT = 0.05  # 乘以图像数的 1.5 次方
+PATCH_MATCH_GPU_SECONDS_PER_MEGAPIXEL = 0.25  # 5 次迭代、窗口半径 5
+PATCH_MATCH_CPU_SLOWDOWN = 20
+FUSION_SECONDS_PER_MEGAPIXEL = 2.0  # 单核
+POISSON_BASE_SECONDS = 20.0  # 深度 10
+FUSED_POINTS_PER_PIXEL = 0.15
+# 融合时每个像素的深度图、法线图、颜色和可见性占用的内存
+FUSION_BYTES_PER_PIXEL = 24
+
+
+def dataset_statistics(folder, names, sample=25):
+    # 只读取抽样图像的文件头，统计中位分辨率
+    sizes = [read_image_size(os.path.join(folder, name)) for name in names[::max(1, len(names) // sample)]]
+    megapixels = [width * height / 1e6 for width, height in filter(None, sizes)]
+    return {"images": len(names), "megapixels": median(megapixels) if megapixels else 0.0}
+
+
+def hardware_statistics(gpu="auto"):
+    memory_bytes = psutil.virtual_memory().total if psutil is not None else None
+    if gpu == "auto":
+        gpu = shutil.which("nvidia-smi") is not None
+    return {"cores": os.cpu_count() or 1, "memory_bytes": memory_bytes, "gpu": bool(gpu)}
+
+
+def profile_options(name, overrides=None):
+    if name not in PROFILES:
+        raise ValueError(f"Unknown parameter profile: {name}")
+    return dict(PROFILES[name], **(overrides or {}))
+
+
+def estimate_pairs(images, matching):
+    # 与 choose_matching_strategy 相同的规模划分，不读取 EXIF
+    strategy = matching.get("strategy", "auto")
+    if strategy == "exhaustive" or (strategy == "auto" and images <= matching.get("exhaustive_max_images", 200)):
+        return images * (images - 1) // 2
+    if strategy == "sequential":
+        return images * matching.get("sequential_overlap", 10) * 2
+    if strategy == "spatial":
+        return images * matching.get("spatial_max_neighbors", 50) // 2
+    if strategy == "vocab_tree":
+        return images * matching.get("vocab_tree_num_images", 100) // 2
+    return images * matching.get("pairs_k", 20)
+
+
+def limited_megapixels(megapixels, max_image_size):
+    # max_image_size 限制长边，按 4:3 的画幅换算像素上限
+    if max_image_size is None or int(max_image_size) <= 0:
+        return megapixels
+    return min(megapixels, int(max_image_size) ** 2 * 0.75 / 1e6)
+
+
+def is_true(value):
+    return str(value).lower() in ("1", "true")
+
+
+def estimate_run(options, dataset, hardware, pairs):
+    # 返回 (各阶段预计秒数, 预计峰值内存字节数)
+    images, cores, gpu = dataset["images"], hardware["cores"], hardware["gpu"]
+    extract_mp = limited_megapixels(dataset["megapixels"], options["SiftExtraction.max_image_size"] or 3200)
+    features = min(int(options["SiftExtraction.max_num_features"]), FEATURES_PER_MEGAPIXEL * extract_mp)
+    affine = is_true(options["SiftExtraction.estimate_affine_shape"])
+    pooling = is_true(options["SiftExtraction.domain_size_pooling"])
+    # 仿射形状估计和 DSP 只有 CPU 实现
+    if gpu and not affine and not pooling:
+        extraction = images * extract_mp * SIFT_GPU_SECONDS_PER_MEGAPIXEL
+    else:
+        extraction = images * extract_mp * SIFT_CPU_SECONDS_PER_MEGAPIXEL * (2.5 if affine else 1) \
+            * (1.5 if pooling else 1) / cores
+    feature_scale = (features / 8192) ** 2
+    if gpu:
+        matching = pairs * feature_scale * MATCH_GPU_SECONDS_PER_PAIR
+    else:
+        matching = pairs * feature_scale * MATCH_CPU_SECONDS_PER_PAIR / cores
+    mapping = MAPPER_SECONDS_COEFFICIENT * images ** 1.5 * max(1.0, features / 8192) ** 0.5
+
+    dense_mp = limited_megapixels(dataset["megapixels"], options["PatchMatchStereo.max_image_size"])
+    window = (2 * int(options["PatchMatchStereo.window_radius"]) + 1) / 11
+    iterations = int(options["PatchMatchStereo.num_iterations"]) / 5
+    stereo = images * dense_mp * PATCH_MATCH_GPU_SECONDS_PER_MEGAPIXEL * iterations * window ** 2 \
+        * (2 if is_true(options["PatchMatchStereo.geom_consistency"]) else 1)
+    if not gpu:
+        stereo *= PATCH_MATCH_CPU_SLOWDOWN
+    fusion_mp = limited_megapixels(dense_mp, options["StereoFusion.max_image_size"])
+    fusion = images * fusion_mp * FUSION_SECONDS_PER_MEGAPIXEL / cores
+    depth = int(options["PoissonMeshing.depth"] or 13)
+    points = images * fusion_mp * 1e6 * FUSED_POINTS_PER_PIXEL
+    meshing = POISSON_BASE_SECONDS * 2 ** (depth - 10) + points * 2e-6
+
+    stages = {
+        "Feature Extraction": extraction,
+        "Feature Matching": matching,
+        "Sparse Reconstruction": mapping,
+        "Dense Reconstruction": stereo,
+        "Dense Fusion": fusion,
+        "Mesh Generation": meshing,
+    }
+    memory = images * fusion_mp * 1e6 * FUSION_BYTES_PER_PIXEL
+    return stages, memory
+
+
+def choose_profile(dataset, hardware, pairs, time_budget_hours, overrides=None):
+    # 从最高档开始，选第一个预计耗时在预算内且融合内存不超过物理内存 80% 的档位
+    budget = time_budget_hours * 3600
+    memory_limit = hardware["memory_bytes"] * 0.8 if hardware["memory_bytes"] else float("inf")
+    for name in PROFILE_ORDER:
+        stages, memory = estimate_run(profile_options(name, overrides), dataset, hardware, pairs)
+        if sum(stages.values()) <= budget and memory <= memory_limit:
+            return name
+    return PROFILE_ORDER[-1]
+
+
+def format_duration(seconds):
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f"{max(minutes, 1)}m"
+    return f"{minutes // 60}h {minutes % 60:02d}m"
+
+
+def describe_estimate(name, stages, memory, dataset, hardware):
+    memory_text = f"{hardware['memory_bytes'] / GB:.0f} GB RAM" if hardware["memory_bytes"] else "unknown RAM"
+    details = ", ".join(f"{stage} {format_duration(seconds)}" for stage, seconds in stages.items())
+    return (f"Profile {name}: {dataset['images']} images, {dataset['megapixels']:.1f} MP, {hardware['cores']} cores, "
+            f"{memory_text}, {'GPU' if hardware['gpu'] else 'no GPU'}; estimated runtime "
+            f"{format_duration(sum(stages.values()))} ({details}); fusion memory {memory / GB:.1f} GB")
+
+
+if __name__ == "__main__":
+    # 重建前查看各档位的预计耗时
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    options = dict(PROFILE_DEFAULTS, **config.get("profile", {}))
+    parser = argparse.ArgumentParser(description="Estimate reconstruction runtime for each parameter profile")
+    parser.add_argument("--images", default=config["output_folder"])
+    args = parser.parse_args()
+
+    names = sorted(list_images(args.images))
+    dataset = dataset_statistics(args.images, names)
+    hardware = hardware_statistics(options["gpu"])
+    pairs = estimate_pairs(len(names), config.get("matching", {}))
+    for name in PROFILE_ORDER:
+        stages, memory = estimate_run(profile_options(name, options["options"]), dataset, hardware, pairs)
+        print(describe_estimate(name, stages, memory, dataset, hardware))
+    print(f"auto selects: {choose_profile(dataset, hardware, pairs, options['time_budget_hours'], options['options'])}")
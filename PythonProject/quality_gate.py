@@ -0,0 +1,138 @@
+import os
+import cv2
+import json
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from image_io import decode_image
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+# 清晰度或哈希的计算方式改变时递增，使缓存的分析结果失效
+GATE_VERSION = 1
+
+
+def dct_matrix(size):
+    # 正交 DCT-II 矩阵，用于对整批缩略图做矩阵乘法形式的 DCT
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def popcount64(values):
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class QualityGate:
+    def __init__(self, blur_threshold=30.0, max_hash_distance=4, analysis_size=640, workers=None):
+        self.blur_threshold = blur_threshold
+        self.max_hash_distance = max_hash_distance
+        self.analysis_size = analysis_size
+        self.workers = workers or os.cpu_count() or 1
+        self.dct = dct_matrix(DCT_SIZE)
+
+    def analyze(self, path):
+        # 以缩小的灰度图评估，长边统一到 analysis_size，使清晰度阈值与原始分辨率无关
+        gray = decode_image(path, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        if gray is None:
+            return None, None
+        height, width = gray.shape
+        scale = self.analysis_size / max(height, width)
+        if scale < 1:
+            gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+        thumbnail = cv2.resize(gray, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA)
+        return float(sharpness), thumbnail
+
+    def perceptual_hashes(self, thumbnails):
+        # 整批计算 pHash：DCT 低频 8x8 系数与中值比较得到 64 位哈希
+        batch = np.stack(thumbnails).astype(np.float32)
+        coefficients = self.dct @ batch @ self.dct.T
+        low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(thumbnails), -1)
+        bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+        return np.packbits(bits, axis=1).view(">u8").astype(np.uint64).ravel()
+
+    def analyze_all(self, paths, cache=None):
+        # 返回每张图像的 (清晰度, pHash)，无法读取时为 (None, None)；
+        # 有增强缓存时按同样的文件内容哈希保存分析结果，内容未变的图像不再解码
+        results = [(None, None)] * len(paths)
+        records = cache.load_records("quality_gate") if cache else {}
+        keys = [None] * len(paths)
+        with ThreadPoolExecutor(self.workers) as executor:
+            if cache:
+                digests = list(executor.map(cache.content_hash, paths))
+                keys = [f"{digest}:{self.analysis_size}:{GATE_VERSION}" if digest else None for digest in digests]
+            pending = []
+            for i, key in enumerate(keys):
+                if key in records:
+                    results[i] = tuple(records[key])
+                else:
+                    pending.append(i)
+            analyses = list(executor.map(self.analyze, [paths[i] for i in pending]))
+        readable = [(i, analysis) for i, analysis in zip(pending, analyses) if analysis[0] is not None]
+        if readable:
+            hashes = self.perceptual_hashes([thumbnail for _, (_, thumbnail) in readable])
+            for (i, (sharpness, _)), phash in zip(readable, hashes.tolist()):
+                results[i] = (sharpness, phash)
+                if keys[i] is not None:
+                    records[keys[i]] = [sharpness, phash]
+        if cache and readable:
+            cache.save_records("quality_gate", records)
+        return results
+
+    def filter(self, folder, filenames, cache=None):
+        paths = [os.path.join(folder, filename) for filename in filenames]
+        analyses = self.analyze_all(paths, cache)
+
+        readable = [i for i, (sharpness, _) in enumerate(analyses) if sharpness is not None]
+        sharpness = np.array([analyses[i][0] for i in readable], dtype=np.float64)
+        report = {
+            "total": len(filenames),
+            "blur_threshold": self.blur_threshold,
+            "max_hash_distance": self.max_hash_distance,
+            "unreadable": [filenames[i] for i, (score, _) in enumerate(analyses) if score is None],
+            "blurry": [],
+            "duplicates": [],
+        }
+
+        sharp_mask = sharpness >= self.blur_threshold
+        report["blurry"] = [{"file": filenames[readable[i]], "sharpness": float(sharpness[i])}
+                            for i in np.flatnonzero(~sharp_mask)]
+        candidates = np.flatnonzero(sharp_mask)
+
+        accepted = []
+        if len(candidates):
+            hashes = np.array([analyses[readable[i]][1] for i in candidates], dtype=np.uint64)
+            # 按清晰度从高到低贪心选择，近似重复的一组中保留最清晰的一张
+            order = np.argsort(-sharpness[candidates], kind="stable")
+            accepted_hashes = np.empty(len(order), dtype=np.uint64)
+            for rank in order:
+                if accepted:
+                    distances = popcount64(np.bitwise_xor(accepted_hashes[:len(accepted)], hashes[rank]))
+                    nearest = int(np.argmin(distances))
+                    if distances[nearest] <= self.max_hash_distance:
+                        report["duplicates"].append({
+                            "file": filenames[readable[candidates[rank]]],
+                            "duplicate_of": filenames[readable[candidates[accepted[nearest]]]],
+                            "distance": int(distances[nearest]),
+                        })
+                        continue
+                accepted_hashes[len(accepted)] = hashes[rank]
+                accepted.append(rank)
+
+        kept = sorted(filenames[readable[candidates[rank]]] for rank in accepted)
+        readable_count = len(readable)
+        report["accepted"] = len(kept)
+        report["pairs_before"] = readable_count * (readable_count - 1) // 2
+        report["pairs_after"] = len(kept) * (len(kept) - 1) // 2
+        report["pairs_saved"] = report["pairs_before"] - report["pairs_after"]
+        return kept, report
+
+    def write_report(self, report, report_folder):
+        os.makedirs(report_folder, exist_ok=True)
+        path = os.path.join(report_folder, f"quality_gate_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        return path
@@ -0,0 +1,269 @@
+import os
+import glob
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from logging_config import get_logger
+from colmapReconstruction import ColmapReconstructor
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+GB = 1024 ** 3
+# 没有历史运行报告时各类阶段的内存估计
+DEFAULT_STAGE_MEMORY = {"cpu": 4 * GB, "io": 1 * GB, "gpu": 4 * GB}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    config TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    current_stage TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class JobStore:
+    # 持久化的任务队列，调度器重启后继续处理；任务配置在加入队列时保存快照
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute(SCHEMA)
+
+    def execute(self, sql, params=()):
+        with self.lock, self.connection:
+            return self.connection.execute(sql, params).fetchall()
+
+    def add(self, config, name=None, priority=0):
+        now = time.time()
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (name, config, priority, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (name or os.path.basename(os.path.normpath(config["workspace_folder"])), json.dumps(config),
+                 priority, now, now))
+            return cursor.lastrowid
+
+    def jobs(self, status=None):
+        if status is None:
+            return self.execute("SELECT * FROM jobs ORDER BY id")
+        return self.execute("SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, id", (status,))
+
+    def claim_next(self):
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, id LIMIT 1").fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                                        (time.time(), row["id"]))
+            return row
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def requeue_interrupted(self):
+        # 上次调度器退出时仍在运行的任务重新排队，已完成的阶段由断点续跑跳过
+        rows = self.execute("SELECT id FROM jobs WHERE status = 'running'")
+        self.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),))
+        return len(rows)
+
+
+class ResourceBudget:
+    # 全局的 CPU 核心、内存和 GPU 预算；每个任务同一时刻只持有一份预留，不会相互死锁
+    def __init__(self, cores, memory_bytes, gpus=1):
+        self.cores = cores
+        self.memory_bytes = memory_bytes
+        self.gpus = gpus
+        self.free_cores = cores
+        self.free_memory = memory_bytes
+        self.free_gpus = gpus
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, min_cores, max_cores, memory_bytes, gpus=0):
+        # 至少有 min_cores 个空闲核心时开始，尽量多给但不超过 max_cores；返回实际分到的核心数
+        min_cores = min(min_cores, self.cores)
+        memory_bytes = min(memory_bytes, self.memory_bytes)
+        gpus = min(gpus, self.gpus)
+        with self.condition:
+            self.condition.wait_for(lambda: self.free_cores >= min_cores and self.free_memory >= memory_bytes
+                                    and self.free_gpus >= gpus)
+            cores = min(max_cores, self.free_cores)
+            self.free_cores -= cores
+            self.free_memory -= memory_bytes
+            self.free_gpus -= gpus
+        try:
+            yield cores
+        finally:
+            with self.condition:
+                self.free_cores += cores
+                self.free_memory += memory_bytes
+                self.free_gpus += gpus
+                self.condition.notify_all()
+
+
+class JobProgress:
+    # 给重建器的进度消息加上任务标识，多个任务共用一个进度队列
+    def __init__(self, progress_queue, job_id, name):
+        self.progress_queue = progress_queue
+        self.job_id = job_id
+        self.name = name
+
+    def put(self, message):
+        if isinstance(message, dict):
+            self.progress_queue.put(dict(message, job=self.job_id))
+        else:
+            self.progress_queue.put(f"[{self.name}] {message}")
+
+
+class Scheduler:
+    def __init__(self, store, cores=None, memory_bytes=None, gpus=1, max_jobs=4, stage_memory=None,
+                 progress_queue=None, poll_interval=2.0):
+        self.store = store
+        cores = cores or os.cpu_count() or 1
+        if not memory_bytes:
+            # 默认使用物理内存的 80%；没有 psutil 时不限制内存
+            memory_bytes = int(psutil.virtual_memory().total * 0.8) if psutil is not None else float("inf")
+        self.budget = ResourceBudget(cores, memory_bytes, gpus)
+        self.max_jobs = max_jobs
+        self.stage_memory = stage_memory or {}
+        self.progress_queue = progress_queue
+        self.poll_interval = poll_interval
+        self.threads = {}
+        self.logger = get_logger(__name__)
+
+    def notify(self, message):
+        self.logger.info(message)
+        if self.progress_queue:
+            self.progress_queue.put(message)
+
+    def run(self, watch=False):
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            self.notify(f"Requeued {requeued} interrupted job(s)")
+        while True:
+            for job_id, thread in list(self.threads.items()):
+                if not thread.is_alive():
+                    del self.threads[job_id]
+            while len(self.threads) < self.max_jobs:
+                row = self.store.claim_next()
+                if row is None:
+                    break
+                thread = threading.Thread(target=self.run_job, args=(row,), daemon=True)
+                self.threads[row["id"]] = thread
+                thread.start()
+            if not self.threads and not watch:
+                break
+            time.sleep(self.poll_interval)
+        self.notify("All jobs finished")
+
+    def run_job(self, row):
+        job_id, name = row["id"], row["name"]
+        self.notify(f"Starting job {job_id} ({name})")
+        try:
+            config = json.loads(row["config"])
+            reconstructor = ColmapReconstructor(config, JobProgress(self.progress_queue, job_id, name)
+                                                if self.progress_queue else None)
+            estimates = self.memory_estimates(config["workspace_folder"])
+            succeeded = reconstructor.run_stages(reconstructor.build_stages(),
+                                                 lambda stage: self.allocate(job_id, stage, estimates))
+        except Exception as e:
+            self.logger.exception(f"Job {job_id} ({name}) failed")
+            self.store.update(job_id, status="failed", error=str(e))
+            self.notify(f"[ERROR] Job {job_id} ({name}) failed: {e}")
+            return
+        if succeeded:
+            self.store.update(job_id, status="done", current_stage=None, error=None)
+            self.notify(f"Job {job_id} ({name}) completed")
+        else:
+            self.store.update(job_id, status="failed", error="A reconstruction stage failed, see the job log")
+            self.notify(f"[ERROR] Job {job_id} ({name}) failed")
+
+    @contextmanager
+    def allocate(self, job_id, stage, estimates):
+        # CPU 阶段至少分到平均份额的核心，最多为其他每个任务各留一个核心；
+        # I/O 阶段和 GPU 阶段只占一个核心，可与其他任务的 CPU 阶段重叠
+        if stage.resource == "cpu":
+            min_cores = max(1, self.budget.cores // self.max_jobs)
+            max_cores = max(min_cores, self.budget.cores - (self.max_jobs - 1))
+        else:
+            min_cores, max_cores = 1, 1
+        memory = self.stage_memory.get(stage.description, estimates.get(stage.description,
+                                                                          DEFAULT_STAGE_MEMORY[stage.resource]))
+        self.store.update(job_id, current_stage=f"{stage.description} (waiting)")
+        with self.budget.reserve(min_cores, max_cores, memory, 1 if stage.resource == "gpu" else 0) as cores:
+            self.store.update(job_id, current_stage=stage.description)
+            self.logger.debug(f"Job {job_id}: {stage.description} gets {cores} core(s), {memory / GB:.1f} GB")
+            yield cores
+
+    @staticmethod
+    def memory_estimates(workspace_folder):
+        # 用该工作区最近一次运行报告中各阶段的峰值内存作为估计，留 20% 余量
+        reports = sorted(glob.glob(os.path.join(workspace_folder, "reports", "reconstruction_*[0-9].json")))
+        if not reports:
+            return {}
+        try:
+            with open(reports[-1], "r", encoding="utf-8") as f:
+                stages = json.load(f)["stages"]
+        except (OSError, ValueError, KeyError):
+            return {}
+        return {stage["name"]: int(stage["peak_rss_bytes"] * 1.2) for stage in stages if stage.get("peak_rss_bytes")}
+
+
+def load_job_config(path, base_config):
+    # 数据集配置只需写与默认 config.json 不同的键，嵌套的配置段按键合并
+    with open(path, "r") as f:
+        job_config = json.load(f)
+    config = dict(base_config)
+    for key, value in job_config.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key] = dict(config[key], **value)
+        else:
+            config[key] = value
+    return config
+
+
+if __name__ == "__main__":
+    with open("config.json", "r") as f:
+        base_config = json.load(f)
+    options = base_config.get("scheduler", {})
+
+    parser = argparse.ArgumentParser(description="Run many reconstruction jobs under a shared resource budget")
+    parser.add_argument("--database", default=options.get("database", "jobs.db"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="queue dataset configs")
+    add_parser.add_argument("configs", nargs="+")
+    add_parser.add_argument("--priority", type=int, default=0)
+    subparsers.add_parser("list", help="show the job queue")
+    run_parser = subparsers.add_parser("run", help="process queued jobs")
+    run_parser.add_argument("--watch", action="store_true", help="keep polling for new jobs")
+    args = parser.parse_args()
+
+    store = JobStore(args.database)
+    if args.command == "add":
+        for path in args.configs:
+            job_id = store.add(load_job_config(path, base_config), priority=args.priority)
+            print(f"Queued job {job_id}: {path}")
+    elif args.command == "list":
+        for row in store.jobs():
+            print(f"{row['id']:>4}  {row['status']:<9} {row['name']:<30} {row['current_stage'] or ''}")
+    else:
+        memory_gb = options.get("memory_gb", 0)
+        scheduler = Scheduler(store, options.get("cores", 0), int(memory_gb * GB), options.get("gpus", 1),
+                              options.get("max_jobs", 4),
+                              {name: int(value * GB) for name, value in options.get("stage_memory_gb", {}).items()})
+        scheduler.run(args.watch)
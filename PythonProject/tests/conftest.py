@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模块以脚本方式放在 PythonProject 下（from ply_io import ...），测试从任意目录运行时也能导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
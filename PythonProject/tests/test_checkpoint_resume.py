@@ -0,0 +1,87 @@
+import os
+import queue
+import pytest
+import fake_colmap
+from benchmark import make_dataset, reconstruction_config
+from checkpoint import StageCheckpoint
+from colmapReconstruction import ColmapReconstructor
+
+
+@pytest.fixture
+def config(tmp_path):
+    executable = fake_colmap.install(str(tmp_path / "fake_colmap"))
+    image_folder = make_dataset(str(tmp_path / "images"), 6, 64, 48)
+    workspace_folder = str(tmp_path / "workspace")
+    os.makedirs(workspace_folder)
+    return reconstruction_config(image_folder, workspace_folder, executable)
+
+
+def run(config, fail=None):
+    # 返回是否成功，以及被跳过和实际运行的阶段
+    progress = queue.Queue()
+    if fail:
+        os.environ["FAKE_COLMAP_FAIL"] = fail
+    try:
+        reconstructor = ColmapReconstructor(config, progress)
+        stages = reconstructor.build_stages()
+        succeeded = reconstructor.run_stages(stages)
+    finally:
+        os.environ.pop("FAKE_COLMAP_FAIL", None)
+    messages = []
+    while not progress.empty():
+        message = progress.get()
+        if isinstance(message, str):
+            messages.append(message)
+    skipped = [stage.description for stage in stages
+               if f"{stage.description} skipped (inputs and parameters unchanged)" in messages]
+    ran = [stage.description for stage in stages if f"{stage.description} completed" in messages
+           or any(message.startswith(f"[ERROR] {stage.description} failed") for message in messages)]
+    return succeeded, skipped, ran, [stage.description for stage in stages]
+
+
+def test_second_run_skips_every_stage(config):
+    succeeded, skipped, ran, stages = run(config)
+    assert succeeded
+    assert ran == stages
+    assert os.path.exists(os.path.join(config["workspace_folder"], "dense", "meshed.ply"))
+
+    succeeded, skipped, ran, stages = run(config)
+    assert succeeded
+    assert skipped == stages
+    assert ran == []
+
+
+def test_resume_after_failure_starts_at_failed_stage(config):
+    succeeded, skipped, ran, stages = run(config, fail="mapper")
+    assert not succeeded
+    failed_index = stages.index("Sparse Reconstruction")
+    assert ran == stages[:failed_index + 1]
+
+    succeeded, skipped, ran, stages = run(config)
+    assert succeeded
+    assert skipped == stages[:failed_index]
+    assert ran == stages[failed_index:]
+
+
+def test_resume_disabled_reruns_everything(config):
+    assert run(config)[0]
+    succeeded, skipped, ran, stages = run(dict(config, resume=False))
+    assert succeeded
+    assert skipped == []
+    assert ran == stages
+
+
+def test_changed_parameters_invalidate_later_stages(config):
+    assert run(config)[0]
+    config = dict(config, matching={"strategy": "sequential", "sequential_overlap": 3})
+    succeeded, skipped, ran, stages = run(config)
+    assert succeeded
+    assert skipped == stages[:1]
+    assert ran == stages[1:]
+
+
+def test_invalidate_all_clears_manifests(config):
+    assert run(config)[0]
+    checkpoint = StageCheckpoint(config["workspace_folder"])
+    checkpoint.invalidate_all()
+    assert run(config)[1] == []
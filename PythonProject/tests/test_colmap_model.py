@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import fake_colmap
+from colmap_model import SparseModel, read_cameras, read_images
+
+NAMES = [f"image_{i:04d}.jpg" for i in range(8)]
+
+
+def test_read_cameras_and_images(tmp_path):
+    fake_colmap.write_model(str(tmp_path), NAMES, 100)
+    cameras, params = read_cameras(str(tmp_path / "cameras.bin"))
+    assert cameras["camera_id"].tolist() == [1]
+    assert cameras["model_id"].tolist() == [2]
+    assert (int(cameras["width"][0]), int(cameras["height"][0])) == (4000, 3000)
+    np.testing.assert_array_equal(params[1], [3000.0, 2000.0, 1500.0, 0.0])
+
+    images, names, points2D = read_images(str(tmp_path / "images.bin"))
+    assert names == NAMES
+    assert images["image_id"].tolist() == list(range(1, len(NAMES) + 1))
+    np.testing.assert_array_equal(images["tvec"][:, 0], np.arange(len(NAMES)))
+    assert [len(points) for points in points2D] == images["num_points2D"].tolist()
+
+
+def test_sparse_model_tracks_match_observations(tmp_path):
+    fake_colmap.write_model(str(tmp_path / "0"), NAMES, 300, seed=3)
+    model = SparseModel(str(tmp_path / "0"))
+    assert len(model.xyz) == 300
+    assert model.point_ids.tolist() == list(range(1, 301))
+    lengths = model.track_lengths()
+    assert lengths.min() >= 2 and lengths.max() <= 5
+    # 每个观测都指回图像中记录了该点的二维点
+    for index in (0, 150, 299):
+        for image_id, point2D_idx in model.point_track(index).tolist():
+            assert model.points2D[image_id - 1]["point3D_id"][point2D_idx] == model.point_ids[index]
+
+    statistics = model.statistics()
+    assert statistics["num_registered_images"] == len(NAMES)
+    assert statistics["num_observations"] == sum(len(points) for points in model.points2D)
+    assert statistics["mean_reprojection_error"] == 0.5
+
+
+def test_points_cache_is_reused_and_rebuilt(tmp_path):
+    model_folder = str(tmp_path / "0")
+    fake_colmap.write_model(model_folder, NAMES, 50)
+    first = SparseModel(model_folder)
+    assert os.path.isdir(model_folder + ".npcache")
+    np.testing.assert_array_equal(SparseModel(model_folder).xyz, first.xyz)
+
+    # 模型被重写后缓存失效
+    fake_colmap.write_model(model_folder, NAMES, 80, seed=1)
+    assert len(SparseModel(model_folder).xyz) == 80
+
+
+def test_covisibility_counts_shared_points(tmp_path):
+    fake_colmap.write_model(str(tmp_path), NAMES, 200, seed=5)
+    model = SparseModel(str(tmp_path), cache_folder=str(tmp_path / "cache"))
+    pairs, counts = model.covisibility(chunk_pairs=16)
+    expected = {}
+    for index in range(len(model.xyz)):
+        image_ids = sorted(model.point_track(index)["image_id"].tolist())
+        for i, first in enumerate(image_ids):
+            for second in image_ids[i + 1:]:
+                expected[(first, second)] = expected.get((first, second), 0) + 1
+    assert dict(zip(map(tuple, pairs.tolist()), counts.tolist())) == expected
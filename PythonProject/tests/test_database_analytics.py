@@ -0,0 +1,74 @@
+import itertools
+import numpy as np
+import pytest
+from database_analytics import UnionFind, maximum_spanning_forest, nearest_edges
+
+
+def edges(pairs):
+    first, second, weights = (np.array(column) for column in zip(*pairs))
+    return first, second, weights
+
+
+def brute_force_forest_weight(count, first, second, weights):
+    # 枚举边子集，找出与 Kruskal 结果边数相同的无环子集中的最大权重
+    best = None
+    for size in range(len(weights), -1, -1):
+        for subset in itertools.combinations(range(len(weights)), size):
+            forest = UnionFind(count)
+            if all(forest.union(int(first[edge]), int(second[edge])) for edge in subset):
+                total = weights[list(subset)].sum()
+                best = total if best is None else max(best, total)
+        if best is not None:
+            return size, best
+
+
+def test_spanning_forest_picks_heaviest_edges():
+    first, second, weights = edges([(0, 1, 10), (1, 2, 5), (0, 2, 7), (3, 4, 3)])
+    selected, components = maximum_spanning_forest(5, first, second, weights)
+    assert sorted(selected.tolist()) == [0, 2, 3]
+    assert components[0] == components[1] == components[2]
+    assert components[3] == components[4] != components[0]
+
+
+def test_spanning_forest_matches_brute_force():
+    rng = np.random.default_rng(0)
+    count = 6
+    pairs = [(a, b, int(rng.integers(1, 100))) for a, b in itertools.combinations(range(count), 2)
+             if rng.random() < 0.6]
+    first, second, weights = edges(pairs)
+    selected, components = maximum_spanning_forest(count, first, second, weights)
+    size, best = brute_force_forest_weight(count, first, second, weights)
+    assert len(selected) == size
+    assert weights[selected].sum() == best
+    assert len(set(components.tolist())) == count - size
+
+
+def test_spanning_forest_isolated_vertices():
+    selected, components = maximum_spanning_forest(3, np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+                                                   np.array([]))
+    assert len(selected) == 0
+    assert components.tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize("k", [1, 2, 3])
+def test_nearest_edges_keeps_top_k_per_vertex(k):
+    rng = np.random.default_rng(k)
+    count = 8
+    pairs = [(a, b, int(weight)) for (a, b), weight in
+             zip(itertools.combinations(range(count), 2), rng.permutation(28) + 1)]
+    first, second, weights = edges(pairs)
+    keep = nearest_edges(count, first, second, weights, k)
+    expected = np.zeros(len(weights), dtype=bool)
+    for vertex in range(count):
+        incident = np.flatnonzero((first == vertex) | (second == vertex))
+        expected[incident[np.argsort(-weights[incident])[:k]]] = True
+    np.testing.assert_array_equal(keep, expected)
+
+
+def test_nearest_edges_breaks_ties_by_edge_order():
+    first, second, weights = edges([(0, 1, 5), (0, 2, 5), (0, 3, 5)])
+    keep = nearest_edges(4, first, second, weights, 1)
+    # 顶点 0 的三条边权重相同，保留最先出现的；其余顶点各自只有一条边
+    assert keep.tolist() == [True, True, True]
+    keep = nearest_edges(4, first, second, weights, 0)
+    assert not keep.any()
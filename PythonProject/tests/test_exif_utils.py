@@ -0,0 +1,71 @@
+import struct
+import pytest
+from exif_utils import (TAG_EXIF_IFD, TAG_FOCAL_LENGTH, TAG_FOCAL_PLANE_X_RESOLUTION, TAG_FOCAL_PLANE_Y_RESOLUTION,
+                        TAG_ORIENTATION, TAG_PIXEL_X_DIMENSION, TAG_PIXEL_Y_DIMENSION, parse_ifd, update_exif)
+
+
+def build_tiff(endian, width=4000, height=3000, orientation=6):
+    # IFD0：方向 + Exif 指针；Exif IFD：像素尺寸（LONG 和 SHORT 各一个）、焦距和焦平面分辨率（RATIONAL）
+    rationals = [(4500, 10), (1000000, 254), (1000000, 254)]
+    ifd0_offset = 8
+    exif_offset = ifd0_offset + 2 + 12 * 2 + 4
+    data_offset = exif_offset + 2 + 12 * 5 + 4
+    ifd0 = struct.pack(endian + "H", 2)
+    ifd0 += struct.pack(endian + "HHIH2x", TAG_ORIENTATION, 3, 1, orientation)
+    ifd0 += struct.pack(endian + "HHII", TAG_EXIF_IFD, 4, 1, exif_offset)
+    ifd0 += struct.pack(endian + "I", 0)
+    exif = struct.pack(endian + "H", 5)
+    exif += struct.pack(endian + "HHII", TAG_PIXEL_X_DIMENSION, 4, 1, width)
+    exif += struct.pack(endian + "HHIH2x", TAG_PIXEL_Y_DIMENSION, 3, 1, height)
+    for i, tag in enumerate((TAG_FOCAL_LENGTH, TAG_FOCAL_PLANE_X_RESOLUTION, TAG_FOCAL_PLANE_Y_RESOLUTION)):
+        exif += struct.pack(endian + "HHII", tag, 5, 1, data_offset + 8 * i)
+    exif += struct.pack(endian + "I", 0)
+    data = b"".join(struct.pack(endian + "II", *rational) for rational in rationals)
+    header = (b"II" if endian == "<" else b"MM") + struct.pack(endian + "HI", 42, ifd0_offset)
+    return header + ifd0 + exif + data
+
+
+def read_tags(tiff):
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd0 = parse_ifd(tiff, struct.unpack(endian + "I", tiff[4:8])[0], endian)
+    return ifd0, parse_ifd(tiff, ifd0[TAG_EXIF_IFD], endian)
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_update_exif_resets_orientation_and_size(endian):
+    ifd0, exif = read_tags(update_exif(build_tiff(endian), 2000, 1500))
+    assert ifd0[TAG_ORIENTATION] == 1
+    assert (exif[TAG_PIXEL_X_DIMENSION], exif[TAG_PIXEL_Y_DIMENSION]) == (2000, 1500)
+    assert exif[TAG_FOCAL_LENGTH] == pytest.approx(450.0)
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_update_exif_scales_focal_plane_resolution(endian):
+    tiff = build_tiff(endian)
+    original = read_tags(tiff)[1][TAG_FOCAL_PLANE_X_RESOLUTION]
+    # 缩小一半：每毫米像素数也减半，焦距换算到像素后与新尺寸一致
+    exif = read_tags(update_exif(tiff, 2000, 1500))[1]
+    assert exif[TAG_FOCAL_PLANE_X_RESOLUTION] == pytest.approx(original / 2)
+    assert exif[TAG_FOCAL_PLANE_Y_RESOLUTION] == pytest.approx(original / 2)
+
+
+def test_update_exif_uses_source_size_after_rotation():
+    # 方向为 6 的图像旋转后宽高互换，缩放比例只看长边
+    tiff = build_tiff("<")
+    original = read_tags(tiff)[1][TAG_FOCAL_PLANE_X_RESOLUTION]
+    exif = read_tags(update_exif(tiff, 1500, 2000, source_size=(4000, 3000)))[1]
+    assert (exif[TAG_PIXEL_X_DIMENSION], exif[TAG_PIXEL_Y_DIMENSION]) == (1500, 2000)
+    assert exif[TAG_FOCAL_PLANE_X_RESOLUTION] == pytest.approx(original / 2)
+
+
+def test_update_exif_keeps_resolution_without_resize():
+    tiff = build_tiff("<")
+    original = read_tags(tiff)[1]
+    exif = read_tags(update_exif(tiff, 4000, 3000))[1]
+    assert exif[TAG_FOCAL_PLANE_X_RESOLUTION] == original[TAG_FOCAL_PLANE_X_RESOLUTION]
+
+
+def test_update_exif_ignores_truncated_data():
+    assert update_exif(b"II*\x00", 100, 100) == b"II*\x00"
+    tiff = build_tiff("<")
+    assert len(update_exif(tiff[:40], 100, 100)) == 40
@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pytest
+import ply_io
+
+POINT_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+
+
+def make_vertices(count, seed=0, color_type="u1"):
+    rng = np.random.default_rng(seed)
+    dtype = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                      ("red", color_type), ("green", color_type), ("blue", color_type)])
+    vertices = np.empty(count, dtype=dtype)
+    for axis in "xyz":
+        vertices[axis] = rng.random(count) * 10
+    for channel in ("red", "green", "blue"):
+        if np.issubdtype(dtype[channel], np.floating):
+            vertices[channel] = rng.random(count)
+        else:
+            vertices[channel] = rng.integers(0, 256, count)
+    return vertices
+
+
+def test_vertices_round_trip(tmp_path):
+    vertices = make_vertices(1000)
+    path = ply_io.write_vertices(str(tmp_path / "points.ply"), vertices, chunk_size=128)
+    ply = ply_io.PlyFile(path)
+    assert len(ply) == len(vertices)
+    assert ply.faces is None
+    for name in POINT_DTYPE.names:
+        np.testing.assert_array_equal(ply.vertices[name], vertices[name])
+
+
+def test_mesh_round_trip(tmp_path):
+    vertices = make_vertices(50)
+    faces = np.random.default_rng(1).integers(0, 50, (80, 3))
+    path = ply_io.write_mesh(str(tmp_path / "mesh.ply"), vertices, faces, comments=["test"])
+    ply = ply_io.PlyFile(path)
+    np.testing.assert_array_equal(ply.vertices["x"], vertices["x"])
+    np.testing.assert_array_equal(ply.faces, faces)
+
+
+def test_writer_backfills_count_and_chunks(tmp_path):
+    vertices = make_vertices(300)
+    path = str(tmp_path / "stream.ply")
+    with ply_io.PlyWriter(path, vertices.dtype) as writer:
+        for start in range(0, len(vertices), 70):
+            writer.write(vertices[start:start + 70])
+    assert not os.path.exists(path + ".tmp")
+    ply = ply_io.PlyFile(path)
+    chunks = list(ply.iter_chunks(chunk_size=64))
+    assert [len(chunk) for chunk in chunks] == [64, 64, 64, 64, 44]
+    np.testing.assert_array_equal(np.concatenate(chunks)["z"], vertices["z"])
+
+
+def test_filter_and_crop(tmp_path):
+    vertices = make_vertices(500)
+    source = ply_io.write_vertices(str(tmp_path / "points.ply"), vertices)
+    count = ply_io.crop(source, str(tmp_path / "crop.ply"), [0, 0, 0], [5, 5, 5], chunk_size=100)
+    expected = (vertices["x"] <= 5) & (vertices["y"] <= 5) & (vertices["z"] <= 5)
+    assert count == expected.sum()
+    np.testing.assert_array_equal(ply_io.PlyFile(str(tmp_path / "crop.ply")).vertices["x"], vertices["x"][expected])
+
+
+@pytest.mark.parametrize("color_type", ["u1", "<u2", "<f4"])
+def test_statistics_color_types(tmp_path, color_type):
+    vertices = make_vertices(200, color_type=color_type)
+    path = ply_io.write_vertices(str(tmp_path / "points.ply"), vertices)
+    result = ply_io.statistics(ply_io.PlyFile(path), chunk_size=64)
+    assert result["vertices"] == 200
+    assert result["faces"] == 0
+    np.testing.assert_allclose(result["bounds_min"], [vertices[axis].min() for axis in "xyz"], rtol=1e-6)
+    for histogram in result["color_histogram"].values():
+        assert len(histogram) == 256
+        assert sum(histogram) == 200
@@ -0,0 +1,78 @@
+import threading
+import time
+from colmapReconstruction import ReconstructionStage
+from scheduler import JobStore, ResourceBudget, Scheduler
+
+GB = 1024 ** 3
+
+
+def test_reserve_grants_up_to_max_and_releases():
+    budget = ResourceBudget(8, 16 * GB)
+    with budget.reserve(2, 6, 4 * GB) as cores:
+        assert cores == 6
+        assert (budget.free_cores, budget.free_memory) == (2, 12 * GB)
+        with budget.reserve(1, 6, 4 * GB) as remaining:
+            assert remaining == 2
+    assert (budget.free_cores, budget.free_memory, budget.free_gpus) == (8, 16 * GB, 1)
+
+
+def test_reserve_clamps_requests_larger_than_budget():
+    # 超过总量的请求按总量处理，否则会永远等待
+    budget = ResourceBudget(4, 8 * GB, gpus=1)
+    with budget.reserve(16, 16, 32 * GB, gpus=2) as cores:
+        assert cores == 4
+        assert (budget.free_memory, budget.free_gpus) == (0, 0)
+    assert (budget.free_cores, budget.free_memory, budget.free_gpus) == (4, 8 * GB, 1)
+
+
+def test_reserve_releases_on_error():
+    budget = ResourceBudget(4, 8 * GB)
+    try:
+        with budget.reserve(1, 4, GB, gpus=1):
+            raise RuntimeError("stage failed")
+    except RuntimeError:
+        pass
+    assert (budget.free_cores, budget.free_memory, budget.free_gpus) == (4, 8 * GB, 1)
+
+
+def test_reserve_waits_for_resources():
+    budget = ResourceBudget(4, 8 * GB, gpus=1)
+    events = []
+    holding = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with budget.reserve(1, 4, GB, gpus=1):
+            events.append("holder")
+            holding.set()
+            release.wait(5)
+
+    def waiter():
+        # GPU 被占用时即使核心足够也要等待
+        with budget.reserve(1, 2, GB, gpus=1) as cores:
+            events.append(("waiter", cores))
+
+    first = threading.Thread(target=holder)
+    first.start()
+    holding.wait(5)
+    second = threading.Thread(target=waiter)
+    second.start()
+    time.sleep(0.1)
+    assert events == ["holder"]
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert events == ["holder", ("waiter", 2)]
+
+
+def test_allocate_leaves_a_core_for_each_other_job(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.add({"workspace_folder": str(tmp_path)}, name="job")
+    scheduler = Scheduler(store, cores=8, memory_bytes=16 * GB, max_jobs=3)
+    with scheduler.allocate(job_id, ReconstructionStage("Dense", ["dense"]), {}) as cores:
+        assert cores == 6
+    with scheduler.allocate(job_id, ReconstructionStage("Undistort", ["undistort"], resource="io"), {}) as cores:
+        assert cores == 1
+    with scheduler.allocate(job_id, ReconstructionStage("Stereo", ["stereo"], resource="gpu"), {}) as cores:
+        assert cores == 1
+        assert scheduler.budget.free_gpus == 0
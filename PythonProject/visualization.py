@@ -1,14 +1,223 @@
 # Littlebear is coming!!!
+import os
+import sys
+import json
+import numpy as np
 import open3d as o3d
+import ply_io
+from logging_config import get_logger
+
+LOD_VERSION = 1
+# 相邻两级之间点数至少减半，否则跳过该级
+LEVEL_REDUCTION = 0.5
+
+
+class LodPyramid:
+    # 多分辨率体素降采样金字塔，首次打开时生成并缓存在 PLY 旁边的 <ply>.lod 目录中，level 0 最粗
+    def __init__(self, ply_path, coarse_points=500000):
+        self.ply_path = ply_path
+        self.coarse_points = coarse_points
+        self.folder = ply_path + ".lod"
+        self.logger = get_logger(__name__)
+        self.meta = None
+
+    def source_stamp(self):
+        stat = os.stat(self.ply_path)
+        return {"version": LOD_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                "coarse_points": self.coarse_points}
+
+    def load(self):
+        meta_path = os.path.join(self.folder, "meta.json")
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+            if meta and meta.get("source") == self.source_stamp() and all(
+                    level["file"] is None or os.path.exists(os.path.join(self.folder, level["file"]))
+                    for level in meta["levels"]):
+                self.meta = meta
+                return self
+        self.build()
+        return self
+
+    @property
+    def kind(self):
+        return self.meta["kind"]
+
+    @property
+    def levels(self):
+        return self.meta["levels"]
+
+    def build(self):
+        fmt, elements, _ = ply_io.read_header(self.ply_path)
+        counts = {element.name: element.count for element in elements}
+        kind = "mesh" if counts.get("face", 0) > 0 else "points"
+        self.logger.info(f"Building LOD pyramid for {self.ply_path} ({counts.get('vertex', 0)} vertices, {kind})")
+        os.makedirs(self.folder, exist_ok=True)
+        if kind == "points" and fmt in ply_io.ENDIANNESS:
+            levels = self.build_points()
+        else:
+            levels = self.build_open3d(kind)
+        levels.reverse()
+        self.meta = {"source": self.source_stamp(), "kind": kind, "levels": levels}
+        with open(os.path.join(self.folder, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=4)
+        self.logger.info("LOD levels: " + ", ".join(str(level["points"]) for level in levels))
+
+    def build_points(self):
+        # 二进制点云按块流式降采样，不把原始点云整体读入内存；最细一级就是原文件本身
+        ply = ply_io.PlyFile(self.ply_path)
+        levels = [{"file": None, "points": len(ply), "voxel_size": 0.0}]
+        if not len(ply):
+            return levels
+        stats = ply_io.statistics(ply)
+        origin = np.asarray(stats["bounds_min"])
+        voxel_size = float(np.linalg.norm(np.asarray(stats["bounds_max"]) - origin)) / 4096
+        current = None
+        while levels[-1]["points"] > self.coarse_points and voxel_size > 0:
+            # 每一级从上一级降采样，越往上越快
+            chunks = ply.iter_chunks() if current is None else [current]
+            reduced = ply_io.voxel_downsample(chunks, ply.vertices.dtype, origin, voxel_size)
+            if len(reduced) <= levels[-1]["points"] * LEVEL_REDUCTION:
+                level = {"file": f"level_{len(levels)}.ply", "points": len(reduced), "voxel_size": voxel_size}
+                ply_io.write_vertices(os.path.join(self.folder, level["file"]), reduced)
+                levels.append(level)
+                current = reduced
+            voxel_size *= 2
+        return levels
+
+    def build_open3d(self, kind):
+        # 网格需要保留拓扑，ASCII 点云无法内存映射，这两种情况仍由 Open3D 整体读入
+        if kind == "mesh":
+            source = o3d.io.read_triangle_mesh(self.ply_path)
+            # 法线只在建立金字塔时计算一次，打开时不再对整个网格重新计算；后处理过的网格已带法线
+            if not source.has_vertex_normals():
+                source.compute_vertex_normals()
+            finest = {"file": "level_full.ply", "points": len(source.vertices), "voxel_size": 0.0}
+            o3d.io.write_triangle_mesh(os.path.join(self.folder, finest["file"]), source)
+        else:
+            source = o3d.io.read_point_cloud(self.ply_path)
+            finest = {"file": None, "points": len(source.points), "voxel_size": 0.0}
+
+        levels = [finest]
+        voxel_size = float(np.linalg.norm(source.get_max_bound() - source.get_min_bound())) / 4096
+        current = source
+        while levels[-1]["points"] > self.coarse_points and voxel_size > 0:
+            if kind == "mesh":
+                reduced = current.simplify_vertex_clustering(voxel_size, o3d.geometry.SimplificationContraction.Average)
+                reduced.compute_vertex_normals()
+                count = len(reduced.vertices)
+            else:
+                reduced = current.voxel_down_sample(voxel_size)
+                count = len(reduced.points)
+            if count <= levels[-1]["points"] * LEVEL_REDUCTION:
+                level = {"file": f"level_{len(levels)}.ply", "points": count, "voxel_size": voxel_size}
+                path = os.path.join(self.folder, level["file"])
+                if kind == "mesh":
+                    o3d.io.write_triangle_mesh(path, reduced)
+                else:
+                    o3d.io.write_point_cloud(path, reduced)
+                levels.append(level)
+                # 每一级从上一级降采样，越往上越快
+                current = reduced
+            voxel_size *= 2
+        return levels
+
+    def level_path(self, index):
+        file = self.levels[index]["file"]
+        return self.ply_path if file is None else os.path.join(self.folder, file)
+
+    def load_level(self, index):
+        path = self.level_path(index)
+        if self.kind == "mesh":
+            geometry = o3d.io.read_triangle_mesh(path)
+            if not geometry.has_vertex_normals():
+                geometry.compute_vertex_normals()
+            return geometry
+        return o3d.io.read_point_cloud(path)
+
+
+class LodViewer:
+    # 打开时只加载最粗一级，按 "]" 加载更细一级，按 "[" 回到更粗一级；视角保持不变
+    def __init__(self, pyramid, max_points=20000000):
+        self.pyramid = pyramid
+        self.max_points = max_points
+        self.level = 0
+        self.geometry = None
+        self.logger = get_logger(__name__)
+
+    def set_level(self, vis, index):
+        if index < 0 or index >= len(self.pyramid.levels) or index == self.level and self.geometry is not None:
+            return False
+        points = self.pyramid.levels[index]["points"]
+        if points > self.max_points:
+            self.logger.warning(f"Level {index} has {points} points, over the limit of {self.max_points}")
+            return False
+        geometry = self.pyramid.load_level(index)
+        first = self.geometry is None
+        if not first:
+            vis.remove_geometry(self.geometry, reset_bounding_box=False)
+        vis.add_geometry(geometry, reset_bounding_box=first)
+        self.geometry = geometry
+        self.level = index
+        self.logger.info(f"Showing LOD level {index + 1}/{len(self.pyramid.levels)} ({points} points)")
+        return True
+
+    def run(self):
+        vis = o3d.visualization.VisualizerWithKeyCallback()
+        vis.create_window(window_name=os.path.basename(self.pyramid.ply_path))
+        self.set_level(vis, 0)
+        vis.register_key_callback(ord("]"), lambda v: self.set_level(v, self.level + 1))
+        vis.register_key_callback(ord("["), lambda v: self.set_level(v, self.level - 1))
+        self.logger.info("Press ] to refine, [ to coarsen")
+        vis.run()
+        vis.destroy_window()
+
+
+def visualize_ply(file_path, lod=True, coarse_points=500000, max_points=20000000):
+    if not lod:
+        # 读取 PLY 文件
+        mesh = o3d.io.read_triangle_mesh(file_path)
+        # 稀疏点云和 fused.ply 没有面片，按点云显示
+        if not mesh.has_triangles():
+            o3d.visualization.draw_geometries([o3d.io.read_point_cloud(file_path)])
+            return
+        # 计算法线
+        if not mesh.has_vertex_normals():
+            mesh.compute_vertex_normals()
+        # 可视化
+        o3d.visualization.draw_geometries([mesh])
+        return
+    pyramid = LodPyramid(file_path, coarse_points).load()
+    LodViewer(pyramid, max_points).run()
+
+
+def default_ply_path(config):
+    # 优先显示后处理过的网格，其次是原始网格，没有网格时显示稠密点云，完整重建还未完成时显示预览的稀疏点云
+    dense_folder = os.path.join(config["workspace_folder"], "dense")
+    clean_path = os.path.join(dense_folder, "meshed_clean.ply")
+    mesh_path = os.path.join(dense_folder, "meshed.ply")
+    candidates = [mesh_path, os.path.join(dense_folder, "fused.ply")]
+    # 关闭后处理后重新生成的 meshed.ply 会比旧的 meshed_clean.ply 新，此时不再显示过期的后处理结果
+    if os.path.exists(clean_path) and (not os.path.exists(mesh_path)
+                                       or os.path.getmtime(clean_path) >= os.path.getmtime(mesh_path)):
+        candidates.insert(0, clean_path)
+    candidates.append(os.path.join(config["workspace_folder"], "preview", "sparse.ply"))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return os.path.join(dense_folder, "meshed.ply")
 
-def visualize_ply(file_path):
-    # 读取 PLY 文件
-    mesh = o3d.io.read_triangle_mesh(file_path)
-    # 计算法线
-    mesh.compute_vertex_normals()
-    # 可视化
-    o3d.visualization.draw_geometries([mesh])
 
 if __name__ == "__main__":
-    ply_file_path = "D:/Littlebear/PythonProject/workspace/dense/meshed.ply"
-    visualize_ply(ply_file_path)
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    options = config.get("visualization", {})
+    ply_file_path = sys.argv[1] if len(sys.argv) > 1 else default_ply_path(config)
+    if os.path.isdir(ply_file_path):
+        # 界面传入所选的工作区文件夹
+        ply_file_path = default_ply_path(dict(config, workspace_folder=ply_file_path))
+    visualize_ply(ply_file_path, options.get("lod", True), options.get("coarse_points", 500000),
+                  options.get("max_points", 20000000))